@@ -0,0 +1,67 @@
+"""多管理员分配：负载均衡程度、增加管理员时被重新分配的用户比例、转发吞吐
+
+1. 10 万个用户在哈希环上的分配：最多的管理员是平均值的多少倍；增加一个管理员后，
+   一致性哈希只移动约 1/(n+1) 的用户，取模 user_id % n 会移动绝大多数用户。
+2. 同时到达的一批留言分给 1 个和 3 个管理员：发送调度器按会话限速（默认每秒 1 条），
+   管理员越多，转发全部送达越快。
+运行: python -m benchmarks.admin_routing [留言数]
+"""
+import asyncio
+import statistics
+import sys
+import time
+from collections import Counter
+
+from bot.utils.admin_router import AdminRouter
+from bot.utils.send_scheduler import SendScheduler, PRIORITY_FORWARD
+
+USERS = 100_000
+
+
+class FakeBot:
+    async def send_message(self, chat_id: int, **kwargs):
+        await asyncio.sleep(0.05)
+
+
+def distribution():
+    users = range(1, USERS + 1)
+    print(f"{'管理员数':>8} {'最多/平均':>10} {'增加 1 个后移动（哈希环）':>24} {'（取模）':>10}")
+    for n in (2, 3, 5, 8):
+        admins = list(range(1001, 1001 + n))
+        ring = AdminRouter(db=object(), admins=admins, strategy="sticky")
+        bigger = AdminRouter(db=object(), admins=admins + [1001 + n], strategy="sticky")
+        loads = Counter(ring.ring_lookup(user_id) for user_id in users)
+        moved = sum(ring.ring_lookup(user_id) != bigger.ring_lookup(user_id) for user_id in users)
+        moved_mod = sum(user_id % n != user_id % (n + 1) for user_id in users)
+        print(f"{n:>8} {max(loads.values()) / statistics.mean(loads.values()):>10.2f} "
+              f"{moved / USERS:>24.1%} {moved_mod / USERS:>10.1%}")
+
+
+async def forward_burst(admins: list[int], forwards: int) -> float:
+    """forwards 个不同用户的留言同时到达，全部转发完成的耗时"""
+    router = AdminRouter(db=object(), admins=admins, strategy="sticky")
+    scheduler = SendScheduler()
+    scheduler.start()
+    bot = FakeBot()
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        scheduler.send(bot, "send_message", PRIORITY_FORWARD,
+                       chat_id=router.ring_lookup(user_id), text="留言")
+        for user_id in range(1, forwards + 1)
+    ))
+    elapsed = time.perf_counter() - start
+    await scheduler.close()
+    return elapsed
+
+
+async def main():
+    forwards = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    distribution()
+    print()
+    for n in (1, 3):
+        elapsed = await forward_burst(list(range(1001, 1001 + n)), forwards)
+        print(f"{forwards} 条留言同时到达，{n} 个管理员: {elapsed:.1f}s 全部送达")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
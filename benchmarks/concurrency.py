@@ -0,0 +1,85 @@
+"""并发更新处理压测：验证计数不丢失、同一用户顺序不乱，并对比 p99 延迟
+
+模拟 N 个用户同时发消息，处理器执行与 handle_user_message 相同的数据库读写，
+发送给管理员的 API 调用用随机 sleep 代替（偶尔出现慢请求）。
+运行: python -m benchmarks.concurrency [发送者数] [每人消息数] [并发数]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from bot.database import Database
+from bot.utils.update_processor import PerUserUpdateProcessor
+
+
+async def run(senders: int, per_sender: int, concurrency: int, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.connect()
+        processor = PerUserUpdateProcessor(concurrency)
+        seen: dict[int, list[int]] = {}
+        latencies: list[float] = []
+
+        async def handler(update):
+            user_id = update.effective_user.id
+            await database.get_or_create_user(user_id, f"user{user_id}")
+            # 模拟 send_photo 等 API 调用，5% 的请求很慢
+            await asyncio.sleep(0.2 if rng.random() < 0.05 else rng.uniform(0.002, 0.01))
+            await database.save_message(user_id, update.seq, user_id * 1000 + update.seq, "text")
+            seen.setdefault(user_id, []).append(update.seq)
+            latencies.append(time.perf_counter() - update.arrived)
+
+        # 每个用户的消息按顺序到达，不同用户之间交错
+        queue = [(u, i) for u in range(senders) for i in range(per_sender)]
+        rng.shuffle(queue)
+        counters = {u: 0 for u in range(senders)}
+        updates = []
+        for user_id, _ in queue:
+            updates.append(SimpleNamespace(
+                effective_user=SimpleNamespace(id=user_id), seq=counters[user_id], arrived=0.0
+            ))
+            counters[user_id] += 1
+
+        start = time.perf_counter()
+        tasks = []
+        for update in updates:
+            update.arrived = time.perf_counter()
+            tasks.append(asyncio.create_task(processor.process_update(update, handler(update))))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        await database.writer.flush()
+
+        cursor = await database.conn.execute("SELECT SUM(msg_count) AS total FROM users")
+        total = (await cursor.fetchone())["total"]
+        await database.close()
+
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "lost": senders * per_sender - total,
+        "ordered": all(seq == sorted(seq) for seq in seen.values()),
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main():
+    senders = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    per_sender = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+
+    print(f"{senders} 个发送者，每人 {per_sender} 条")
+    for label, workers in (("逐条处理", 1), (f"并发 {concurrency}", concurrency)):
+        r = await run(senders, per_sender, workers)
+        print(f"{label:<8} 耗时 {r['elapsed']:6.2f}s  p50 {r['p50']:8.1f}ms  p99 {r['p99']:8.1f}ms  "
+              f"丢失计数 {r['lost']}  顺序正确 {r['ordered']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""导出的内存占用：一次 fetchall 全表 vs 游标分块流式写入
+
+分别在不同规模的消息表上导出 JSONL，用 tracemalloc 记录 Python 内存峰值。
+流式导出的峰值只与 EXPORT_CHUNK_ROWS 有关，不随表大小增长。
+运行: python -m benchmarks.export [最大消息数]
+"""
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bot.database import Database
+from bot.export import export_table
+
+TEXT = "请问我的订单什么时候发货？已经等了好几天了，麻烦帮忙看一下，谢谢"
+
+
+async def create(path: str, messages: int):
+    database = Database(path)
+    await database.connect()
+    now = int(time.time())
+    batch = 100_000
+    for start in range(0, messages, batch):
+        await database.conn.executemany(
+            "INSERT INTO messages (user_id, user_msg_id, content_type, text, created_at) "
+            "VALUES (?, ?, 'text', ?, ?)",
+            [(i % 5000, i, f"{TEXT} #{i}", now - messages + i)
+             for i in range(start, min(start + batch, messages))]
+        )
+        await database.conn.commit()
+    await database.close()
+
+
+def export_fetchall(conn: sqlite3.Connection, path: str) -> int:
+    """对照组：一次读出全表再写入"""
+    cursor = conn.execute("SELECT * FROM messages ORDER BY id")
+    columns = [column[0] for column in cursor.description]
+    rows = cursor.fetchall()
+    with gzip.open(path, "wt", encoding="utf-8") as out:
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+    return len(rows)
+
+
+def peak_memory(func, *args) -> float:
+    """函数执行期间的 Python 内存峰值（MB）"""
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    sizes = [largest // 10, largest]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'消息数':>10} {'fetchall 峰值':>14} {'流式峰值':>10} {'流式耗时':>10} {'文件大小':>10}")
+        for size in sizes:
+            db_path = os.path.join(tmp, f"bench-{size}.db")
+            asyncio.run(create(db_path, size))
+            conn = sqlite3.connect(db_path)
+            out = os.path.join(tmp, "out.jsonl.gz")
+
+            naive_peak = peak_memory(export_fetchall, conn, out)
+            stream_peak = peak_memory(export_table, conn, "messages", out, "jsonl")
+            # tracemalloc 会明显拖慢执行，耗时单独测
+            start = time.perf_counter()
+            rows = export_table(conn, "messages", out, "jsonl")
+            elapsed = time.perf_counter() - start
+            conn.close()
+            print(f"{rows:>10} {naive_peak:>12.1f}MB {stream_peak:>8.1f}MB {elapsed:>9.1f}s "
+                  f"{os.path.getsize(out) / 1024 / 1024:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
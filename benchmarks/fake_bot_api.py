@@ -0,0 +1,281 @@
+"""本地模拟的 Telegram Bot API 服务（离线压测用，见 benchmarks.load_test）
+
+机器人设置 BOT_API_URL=http://127.0.0.1:<端口> 后所有接口调用都发到这里：
+getUpdates 长轮询返回压测脚本排好的更新；sendMessage / sendPhoto / copyMessage / sendMediaGroup
+等发送类方法返回新的消息（带上 reply_markup），answerCallbackQuery 等其他方法返回 True。
+每个调用可以加上固定延迟和随机抖动，发送类方法可以按比例返回 429（retry_after）。
+
+控制接口（JSON）：
+  POST /control/script  {"updates": [...], "delays": [...]}：按相对秒数依次放入更新队列
+  GET  /control/stats   各方法调用次数、429 次数、最后一次调用的时间（time.monotonic）
+  GET  /control/cards   发给各会话的带按钮的消息（管理员收到的留言卡片），供脚本回复和点击
+
+只实现压测需要的最小 HTTP/1.1 子集（Content-Length + keep-alive），请求体支持表单和 JSON。
+运行: python -m benchmarks.fake_bot_api [--port 0] [--latency-ms 0] [--jitter-ms 0]
+      [--error-rate 0] [--retry-after 1]，启动后第一行输出监听的端口
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from itertools import count
+from typing import Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# 按比例返回 429 的方法（Telegram 只对发送类方法限流）
+LIMITED_PREFIXES = ("send", "copy", "forward")
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests"}
+
+
+class FakeBotApi:
+    """模拟的 Bot API：更新队列、消息 ID 分配、延迟和 429 注入，以及调用统计"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 retry_after: int = 1, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._message_ids = count(1_000_000)
+        self._update_ids = count(1)
+
+        self.updates: list[dict] = []
+        self._updates_changed = asyncio.Condition()
+        self._script_tasks: set[asyncio.Task] = set()
+
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self.last_call_at = 0.0
+        # 带按钮的消息：(chat_id, message_id, reply_markup)
+        self.cards: list[tuple[int, int, dict]] = []
+
+    # ===== 更新 =====
+
+    def push_update(self, update: dict):
+        update["update_id"] = next(self._update_ids)
+        self.updates.append(update)
+
+    async def _notify(self):
+        async with self._updates_changed:
+            self._updates_changed.notify_all()
+
+    def schedule(self, updates: list[dict], delays: list[float]):
+        """按相对秒数依次放入更新（delays 为每条更新距开始的秒数）"""
+        task = asyncio.create_task(self._replay(updates, delays))
+        self._script_tasks.add(task)
+        task.add_done_callback(self._script_tasks.discard)
+
+    async def _replay(self, updates: list[dict], delays: list[float]):
+        start = time.monotonic()
+        for update, delay in zip(updates, delays):
+            wait = start + delay - time.monotonic()
+            if wait > 0:
+                await self._notify()
+                await asyncio.sleep(wait)
+            self.push_update(update)
+        await self._notify()
+
+    async def get_updates(self, offset: int = 0, limit: int = 100, timeout: float = 0) -> list[dict]:
+        """丢弃已确认（update_id < offset）的更新；没有新更新时最多等待 timeout 秒"""
+        if offset:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            try:
+                async with self._updates_changed:
+                    await asyncio.wait_for(
+                        self._updates_changed.wait_for(lambda: self.updates), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    # ===== 接口调用 =====
+
+    def _message(self, chat_id, **fields) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": {"id": int(chat_id), "type": "private"}, "from": BOT_USER}
+        message.update(fields)
+        return message
+
+    async def call(self, method: str, params: dict) -> dict:
+        """执行一次接口调用，返回 Bot API 格式的响应"""
+        if method == "getUpdates":
+            updates = await self.get_updates(int(params.get("offset", 0)),
+                                             int(params.get("limit", 100)),
+                                             float(params.get("timeout", 0)))
+            return {"ok": True, "result": updates}
+
+        self.calls[method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        self.last_call_at = time.monotonic()
+        if method.startswith(LIMITED_PREFIXES) and self._random.random() < self.error_rate:
+            self.rejected[method] += 1
+            return {"ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after}}
+        return {"ok": True, "result": self._result(method, params)}
+
+    def _result(self, method: str, params: dict):
+        chat_id = params.get("chat_id", 0)
+        if method == "getMe":
+            return BOT_USER
+        if method == "copyMessage":
+            result = {"message_id": next(self._message_ids)}
+        elif method == "copyMessages":
+            return [{"message_id": next(self._message_ids)} for _ in params.get("message_ids", [])]
+        elif method == "sendMediaGroup":
+            return [self._message(chat_id, photo=[{"file_id": item.get("media"),
+                                                   "file_unique_id": "u", "width": 1, "height": 1}])
+                    for item in params.get("media", [])]
+        elif method.startswith("send") or method.startswith("edit"):
+            fields = {key: params[key] for key in ("text", "caption") if key in params}
+            if "photo" in params:
+                fields["photo"] = [{"file_id": params["photo"], "file_unique_id": "u",
+                                    "width": 1, "height": 1}]
+            result = self._message(chat_id, **fields)
+            if method.startswith("edit"):
+                if "message_id" in params:
+                    result["message_id"] = int(params["message_id"])
+                return result
+        else:
+            return True
+        if params.get("reply_markup"):
+            self.cards.append((int(chat_id), result["message_id"], params["reply_markup"]))
+        return result
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "rejected": dict(self.rejected),
+                "pending_updates": len(self.updates), "last_call_at": self.last_call_at}
+
+
+class FakeBotApiServer:
+    """把 HTTP 请求交给 FakeBotApi：/bot<token>/<method> 和 /control/*"""
+
+    def __init__(self, api: FakeBotApi, listen: str = "127.0.0.1", port: int = 0):
+        self.api = api
+        self.listen = listen
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> bool:
+        """处理一个请求，返回连接是否保持"""
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+        _, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = headers.get("connection", "").lower() != "close"
+
+        status, response = await self._dispatch(path.split("?", 1)[0], body,
+                                                headers.get("content-type", ""))
+        data = json.dumps(response, ensure_ascii=False).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+        return keep_alive
+
+    async def _dispatch(self, path: str, body: bytes, content_type: str) -> tuple[int, object]:
+        try:
+            params = parse_params(body, content_type)
+        except ValueError:
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request"}
+
+        if path == "/control/script":
+            self.api.schedule(params["updates"], params.get("delays") or [0] * len(params["updates"]))
+            return 200, {"ok": True}
+        if path == "/control/stats":
+            return 200, self.api.stats()
+        if path == "/control/cards":
+            return 200, [{"chat_id": chat_id, "message_id": message_id, "reply_markup": markup}
+                         for chat_id, message_id, markup in self.api.cards]
+
+        # /bot<token>/<method>
+        parts = path.strip("/").split("/")
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        response = await self.api.call(parts[1], params)
+        return response.get("error_code", 200), response
+
+
+def parse_params(body: bytes, content_type: str) -> dict:
+    """表单（复杂字段为 JSON 字符串，python-telegram-bot 的默认格式）或 JSON 请求体"""
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    params = {}
+    for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+        if value[:1] in ("{", "["):
+            value = json.loads(value)
+        params[key] = value
+    return params
+
+
+async def serve(args):
+    api = FakeBotApi(args.latency_ms, args.jitter_ms, args.error_rate, args.retry_after, args.seed)
+    server = FakeBotApiServer(api, args.listen, args.port)
+    await server.start()
+    print(server.port, flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 Telegram Bot API 服务")
+    parser.add_argument("--listen", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0, help="每个调用的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="额外的随机延迟上限")
+    parser.add_argument("--error-rate", type=float, default=0, help="发送类方法返回 429 的比例")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 响应中的 retry_after 秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""每条转发消息的 Bot API 调用次数：旧版按类型手写 send_* vs copy_message 统一转发
+
+用计数的假 Bot 分别跑旧版转发分支和 forward_message，统计发给管理员的调用次数。
+运行: python -m benchmarks.forwarding
+"""
+import asyncio
+import itertools
+import os
+import tempfile
+from collections import Counter
+from types import SimpleNamespace
+
+from bot.config import config
+from bot.storage import db
+from bot.handlers.user import (
+    CONTENT_POLICIES, build_action_keyboard, build_user_info_text, forward_message,
+)
+from bot.utils.outbox import outbox
+from bot.utils.send_scheduler import scheduler
+
+ADMIN_ID = 1
+_sent_ids = itertools.count(1)
+
+
+class CountingBot:
+    def __init__(self):
+        self.calls = Counter()
+
+    def __getattr__(self, method: str):
+        async def call(**kwargs):
+            self.calls[method] += 1
+            return SimpleNamespace(message_id=next(_sent_ids))
+        return call
+
+
+def fake_message(content_type: str, message_id: int):
+    message = SimpleNamespace(
+        message_id=message_id, chat_id=42, text=None, caption=None, photo=None,
+        video=None, animation=None, voice=None, video_note=None, sticker=None,
+        document=None, audio=None,
+    )
+    file = SimpleNamespace(file_id=f"{content_type}-{message_id}")
+    setattr(message, content_type, "hello" if content_type == "text" else file)
+    if content_type == "photo":
+        message.photo = [file]
+    return message
+
+
+async def legacy_forward(bot, message, content_type: str, user_info: str, user_id: int):
+    """旧版 handle_user_message 的转发分支，作为对照组"""
+    keyboard = build_action_keyboard(user_id)
+    if content_type == "photo":
+        await bot.send_photo(chat_id=ADMIN_ID, photo=message.photo[-1].file_id,
+                             caption=user_info, reply_markup=keyboard)
+    elif content_type == "voice":
+        await bot.send_voice(chat_id=ADMIN_ID, voice=message.voice.file_id,
+                             caption=user_info, reply_markup=keyboard)
+    elif content_type == "sticker":
+        await bot.send_message(chat_id=ADMIN_ID, text=user_info + "\n\n⬇️ 贴纸如下：",
+                               reply_markup=keyboard)
+        await bot.send_sticker(chat_id=ADMIN_ID, sticker=message.sticker.file_id)
+    elif content_type == "animation":
+        await bot.send_animation(chat_id=ADMIN_ID, animation=message.animation.file_id,
+                                 caption=user_info, reply_markup=keyboard)
+    elif content_type == "video_note":
+        await bot.send_message(chat_id=ADMIN_ID, text=user_info + "\n\n⬇️ 视频圈如下：",
+                               reply_markup=keyboard)
+        await bot.send_video_note(chat_id=ADMIN_ID, video_note=message.video_note.file_id)
+    else:
+        await bot.send_message(chat_id=ADMIN_ID, text=user_info, reply_markup=keyboard)
+
+
+async def main():
+    # 转发目标由 AdminRouter 按 ADMIN_IDS 选择
+    config.ADMIN_IDS = [ADMIN_ID]
+    config.ADMIN_ID = ADMIN_ID
+    user = SimpleNamespace(id=7, first_name="Bench", last_name=None, username="bench")
+    per_type = 100
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.db_path = os.path.join(tmp, "bench.db")
+        await db.connect()
+        try:
+            await compare(user, per_type)
+        finally:
+            await scheduler.close()
+            await outbox.close()
+            await db.close()
+
+
+async def compare(user, per_type: int):
+    await db.get_or_create_user(user.id, user.username, user.first_name)
+    scheduler.global_policy.rate = scheduler.global_policy.capacity = 1e9
+    scheduler.chat_policy.rate = scheduler.chat_policy.capacity = 1e9
+    scheduler.start()
+
+    print(f"{'类型':<12} {'旧版 调用/条':>12} {'copy_message 调用/条':>22}  新版方法")
+    total_legacy = total_new = count = 0
+    message_id = 0
+    for policy in CONTENT_POLICIES:
+        if policy.forward is None:
+            continue
+        legacy_bot, new_bot = CountingBot(), CountingBot()
+        outbox.start(new_bot)
+        for _ in range(per_type):
+            message_id += 1
+            message = fake_message(policy.name, message_id)
+            user_info = build_user_info_text(user, 1, message.text)
+            await legacy_forward(legacy_bot, message, policy.name, user_info, user.id)
+            await forward_message(message, user, policy, 1, user_info)
+        await scheduler.close()
+        await outbox.close()
+        scheduler.start()
+
+        legacy = sum(legacy_bot.calls.values()) / per_type
+        new = sum(new_bot.calls.values()) / per_type
+        total_legacy += legacy
+        total_new += new
+        count += 1
+        print(f"{policy.name:<12} {legacy:>12.1f} {new:>22.1f}  {', '.join(new_bot.calls)}")
+
+    print(f"{'平均':<12} {total_legacy / count:>12.2f} {total_new / count:>22.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
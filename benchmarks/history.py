@@ -0,0 +1,78 @@
+"""/history 翻页耗时：OFFSET 分页 vs 按 (user_id, id) 的 keyset 分页
+
+给一个用户写入大量留言（夹杂其他用户的消息），分别测翻到第 1 页、中间页和最后一页的耗时。
+OFFSET 需要跳过前面所有行，越往后越慢；keyset 每页都是一次索引定位。
+运行: python -m benchmarks.history [该用户消息数]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from bot.config import config
+from bot.database import Database
+
+USER_ID = 1
+RUNS = 20
+
+
+async def fill(database: Database, messages: int):
+    now = int(time.time())
+    rows = []
+    for i in range(messages * 3):
+        # 每 3 条中 1 条属于目标用户，其余来自其他用户
+        user_id = USER_ID if i % 3 == 0 else 1000 + i % 997
+        rows.append((user_id, i, "text", f"message {i}", i % 7 == 0 and user_id == USER_ID, now - i))
+    await database.conn.executemany(
+        "INSERT INTO messages (user_id, user_msg_id, content_type, text, is_reply, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows
+    )
+    await database.conn.commit()
+
+
+async def offset_page(database: Database, page: int):
+    return await database._fetchall("""
+        SELECT id, content_type, text, is_reply, created_at FROM messages
+        WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ?
+    """, (USER_ID, config.HISTORY_PAGE_SIZE, page * config.HISTORY_PAGE_SIZE))
+
+
+async def timed(coro_factory) -> float:
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        await coro_factory()
+    return (time.perf_counter() - start) / RUNS * 1000
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    page_size = config.HISTORY_PAGE_SIZE
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.connect()
+        await fill(database, messages)
+
+        # 预先按 keyset 走一遍，记下每页的起点
+        cursors = [None]
+        page, has_more = await database.get_user_history(USER_ID, page_size)
+        while has_more:
+            cursors.append(page[0]["id"])
+            page, has_more = await database.get_user_history(USER_ID, page_size, before=page[0]["id"])
+        pages = len(cursors)
+        print(f"用户共 {messages} 条消息，{pages} 页（每页 {page_size} 条）")
+
+        print(f"{'页码':>8} {'OFFSET':>10} {'keyset':>10}")
+        for index in (0, pages // 2, pages - 1):
+            offset = await timed(lambda: offset_page(database, index))
+            keyset = await timed(
+                lambda: database.get_user_history(USER_ID, page_size, before=cursors[index])
+            )
+            print(f"{index + 1:>8} {offset:>8.2f}ms {keyset:>8.2f}ms")
+
+        await database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,312 @@
+"""离线端到端压测：机器人通过 BOT_API_URL 连接本地模拟的 Bot API（benchmarks.fake_bot_api）
+
+不需要 Bot Token 和网络。机器人在本进程中以轮询模式完整运行（真实的 HTTP 请求、处理器、
+数据库、发件箱和发送调度），模拟服务按脚本通过 getUpdates 投递更新，接口调用可以加延迟和 429。
+流量模型：
+  steady       普通文字留言
+  spam         普通留言中夹杂多个用户同时发送的相同长文本（刷屏检测拦截）
+  albums       每个用户发 4 张图片的相册
+  admin_storm  先由用户留言生成卡片，再由管理员集中回复卡片、点击“详情”和“历史”按钮
+每个模型在单独的子进程中运行（新的数据库和模拟服务），输出：
+  条/秒       更新数 / 从第一条更新开始处理到最后一次接口调用的时间
+  p50 / p99   处理器耗时（从取出更新到处理完成，包含等待并发名额的时间）
+  写/条 提交/条 读/条  每条更新的写操作、写事务和读查询次数
+  调用/条 429  每条更新的接口调用数（不含 getUpdates）和收到的 429 次数
+用户限流和发送限速默认放开（只测处理开销），可以用同名环境变量覆盖，
+例如 SEND_CHAT_PER_SECOND=1 测 Telegram 真实限速下的表现；DB_BACKEND / DATABASE_URL 同样生效。
+运行: python -m benchmarks.load_test [模型|all] [更新数] [--rate 每秒条数，0 为一次放出]
+      [--latency-ms 0] [--jitter-ms 0] [--error-rate 0] [--retry-after 1]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import count
+
+import httpx
+
+ADMIN_ID = 1
+USERS = 500
+ALBUM_SIZE = 4
+# 刷屏模型中每批相同内容的用户数和每批的普通留言数
+SPAM_BURST = 10
+SPAM_EVERY = 40
+# 所有更新处理完、发送队列清空后，接口调用停止多少秒视为结束（大于相册收集窗口）
+QUIET_SECONDS = 1.5
+
+PROFILES = ("steady", "spam", "albums", "admin_storm")
+
+# 压测脚本依赖的设置（固定）和默认放开的限流（可以用环境变量覆盖）
+ENV = {
+    "BOT_TOKEN": "1000:bench", "ADMIN_ID": str(ADMIN_ID), "ADMIN_IDS": "", "BOTS_FILE": "",
+    "WORKERS": "0", "WEBHOOK_URL": "",
+}
+ENV_DEFAULTS = {
+    "CONCURRENT_UPDATES": "64",
+    "RATE_LIMIT_PER_MINUTE": "100000", "RATE_LIMIT_PER_DAY": "100000",
+    "SEND_GLOBAL_PER_SECOND": "1000000", "SEND_CHAT_PER_SECOND": "1000000",
+    "SEND_CHAT_BURST": "1000000",
+}
+
+
+# ===== 更新 =====
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def private_message(user_id: int, message_id: int, **fields) -> dict:
+    return {"message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"}, "from": user(user_id), **fields}}
+
+
+def photo(file_id: str) -> list[dict]:
+    return [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+
+
+def steady_updates(n: int, message_ids) -> list[dict]:
+    return [private_message(10_000 + i % USERS, next(message_ids), text=f"你好，我想咨询一下订单 {i} 的发货时间")
+            for i in range(n)]
+
+
+def spam_updates(n: int, message_ids) -> list[dict]:
+    """每 SPAM_EVERY 条普通留言后，SPAM_BURST 个用户发送同一段推广文本"""
+    updates = []
+    for i in range(n):
+        if i % (SPAM_EVERY + SPAM_BURST) < SPAM_EVERY:
+            updates.append(private_message(10_000 + i % USERS, next(message_ids),
+                                           text=f"你好，我想咨询一下订单 {i} 的发货时间"))
+        else:
+            batch = i // (SPAM_EVERY + SPAM_BURST)
+            updates.append(private_message(
+                20_000 + i % USERS, next(message_ids),
+                text=f"限时优惠！点击链接领取 {batch} 号红包，全场商品一折起，先到先得 t.me/promo{batch}"))
+    return updates
+
+
+def album_updates(n: int, message_ids) -> list[dict]:
+    updates = []
+    for i in range(n):
+        album = i // ALBUM_SIZE
+        user_id = 10_000 + album % USERS
+        fields = {"photo": photo(f"photo{i}"), "media_group_id": f"album{album}"}
+        if i % ALBUM_SIZE == 0:
+            fields["caption"] = f"相册 {album}"
+        updates.append(private_message(user_id, next(message_ids), **fields))
+    return updates
+
+
+def admin_updates(n: int, cards: list[dict], message_ids) -> list[dict]:
+    """管理员依次：回复卡片两次、点“详情”、点“历史”"""
+    admin = user(ADMIN_ID)
+    updates = []
+    for i in range(n):
+        card = cards[i % len(cards)]
+        card_message = {"message_id": card["message_id"], "date": int(time.time()),
+                        "chat": {"id": ADMIN_ID, "type": "private"},
+                        "from": {"id": 1000, "is_bot": True, "first_name": "Bench"}, "text": "卡片"}
+        if i % 4 < 2:
+            updates.append({"message": {
+                "message_id": next(message_ids), "date": int(time.time()),
+                "chat": {"id": ADMIN_ID, "type": "private"}, "from": admin,
+                "text": f"您好，订单已经安排发货（{i}）", "reply_to_message": card_message,
+            }})
+        else:
+            action = "info" if i % 4 == 2 else "history"
+            updates.append({"callback_query": {
+                "id": str(i), "from": admin, "chat_instance": "bench", "message": card_message,
+                "data": f"{action}_{card['user_id']}",
+            }})
+    return updates
+
+
+def card_targets(cards: list[dict]) -> list[dict]:
+    """管理员会话中带“回复”按钮的卡片，以及卡片对应的用户"""
+    targets = []
+    for card in cards:
+        if card["chat_id"] != ADMIN_ID:
+            continue
+        for row in card["reply_markup"].get("inline_keyboard", []):
+            for button in row:
+                data = button.get("callback_data", "")
+                if data.startswith("reply_"):
+                    targets.append({"message_id": card["message_id"], "user_id": int(data[6:])})
+    return targets
+
+
+# ===== 运行一个模型（子进程） =====
+
+class Probe:
+    """统计处理器耗时和数据库读写次数"""
+
+    def __init__(self, application, database):
+        self.latencies: list[float] = []
+        self.started: list[float] = []
+        self.running = 0
+        self.reads = 0
+        self.database = database
+
+        process_update = application.process_update
+
+        def timed(update):
+            start = time.monotonic()
+            self.running += 1
+            coroutine = process_update(update)
+
+            async def run():
+                self.started.append(start)
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+                    self.latencies.append(time.monotonic() - start)
+            return run()
+
+        application.process_update = timed
+
+        fetchall = database._fetchall
+
+        async def counted(sql, params=()):
+            self.reads += 1
+            return await fetchall(sql, params)
+
+        database._fetchall = counted
+
+    def snapshot(self) -> dict:
+        return {"handled": len(self.latencies), "reads": self.reads,
+                "writes": self.database.writer.ops, "commits": self.database.writer.batches}
+
+
+async def api_stats(client: httpx.AsyncClient) -> dict:
+    return (await client.get("/control/stats")).json()
+
+
+async def replay(client: httpx.AsyncClient, probe: Probe, updates: list[dict], rate: float) -> dict:
+    """投递 updates 并等待处理完成，返回这一阶段的统计"""
+    from bot.utils.send_scheduler import scheduler
+
+    before, stats_before = probe.snapshot(), await api_stats(client)
+    delays = [i / rate for i in range(len(updates))] if rate else [0] * len(updates)
+    await client.post("/control/script", json={"updates": updates, "delays": delays})
+
+    expected = before["handled"] + len(updates)
+    while True:
+        await asyncio.sleep(0.1)
+        if probe.snapshot()["handled"] < expected or scheduler.queue_depth or scheduler._inflight:
+            continue
+        stats = await api_stats(client)
+        if time.monotonic() - stats["last_call_at"] >= QUIET_SECONDS:
+            break
+
+    await probe.database.flush()
+    after = probe.snapshot()
+    latencies = sorted(probe.latencies[before["handled"]:])
+    elapsed = stats["last_call_at"] - min(probe.started[before["handled"]:])
+    calls = sum(stats["calls"].values()) - sum(stats_before["calls"].values())
+    n = len(updates)
+    return {
+        "updates": n,
+        "rate": n / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "writes": (after["writes"] - before["writes"]) / n,
+        "commits": (after["commits"] - before["commits"]) / n,
+        "reads": (after["reads"] - before["reads"]) / n,
+        "calls": calls / n,
+        "rejected": sum(stats["rejected"].values()) - sum(stats_before["rejected"].values()),
+        "methods": {method: total - stats_before["calls"].get(method, 0)
+                    for method, total in stats["calls"].items()
+                    if total > stats_before["calls"].get(method, 0)},
+    }
+
+
+async def run_profile(profile: str, n: int, rate: float, api_url: str) -> dict:
+    import bot.main as main
+    from bot.storage import db
+
+    application = await main.start_bot(None, None, None)
+    probe = Probe(application, db.get())
+    message_ids = count(1)
+    try:
+        async with httpx.AsyncClient(base_url=api_url) as client:
+            if profile == "admin_storm":
+                # 准备：用户留言生成卡片（不计入结果）
+                await replay(client, probe, steady_updates(min(n, USERS), message_ids), 0)
+                cards = card_targets((await client.get("/control/cards")).json())
+                updates = admin_updates(n, cards, message_ids)
+            else:
+                updates = {"steady": steady_updates, "spam": spam_updates,
+                           "albums": album_updates}[profile](n, message_ids)
+            return await replay(client, probe, updates, rate)
+    finally:
+        await main.stop_bot(application)
+        await main.scheduler.close()
+        await main.shutdown_bot(application)
+
+
+def run_child(args):
+    """启动模拟服务，在本进程中运行机器人（导入 bot 之前设置好环境变量）"""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_bot_api", "--latency-ms", str(args.latency_ms),
+         "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate),
+         "--retry-after", str(args.retry_after)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        api_url = f"http://127.0.0.1:{server.stdout.readline().strip()}"
+        os.environ["BOT_API_URL"] = api_url
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ.setdefault("DB_PATH", os.path.join(tmp, "bot.db"))
+            result = asyncio.run(run_profile(args.profile, args.updates, args.rate, api_url))
+        print(json.dumps(result, ensure_ascii=False))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端压测")
+    parser.add_argument("profile", nargs="?", default="all", choices=("all",) + PROFILES)
+    parser.add_argument("updates", nargs="?", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=0, help="每秒投递的更新数，0 为一次放出")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.update(ENV)
+    for name, value in ENV_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    if args.child:
+        run_child(args)
+        return
+
+    print(f"更新数: {args.updates}，投递速率: {args.rate or '不限'}，接口延迟: {args.latency_ms}"
+          f"+{args.jitter_ms} ms，429 比例: {args.error_rate}，存储: {os.environ.get('DB_BACKEND', 'sqlite')}")
+    print(f"{'模型':<12} {'条/秒':>8} {'p50 ms':>8} {'p99 ms':>8} {'写/条':>6} {'提交/条':>7} "
+          f"{'读/条':>6} {'调用/条':>7} {'429':>5}")
+    for profile in PROFILES if args.profile == "all" else (args.profile,):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.load_test", profile, str(args.updates), "--child",
+             "--rate", str(args.rate), "--latency-ms", str(args.latency_ms),
+             "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate),
+             "--retry-after", str(args.retry_after)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{profile:<12} {result['rate']:>8.0f} {result['p50'] * 1000:>8.1f} "
+              f"{result['p99'] * 1000:>8.1f} {result['writes']:>6.2f} {result['commits']:>7.2f} "
+              f"{result['reads']:>6.2f} {result['calls']:>7.2f} {result['rejected']:>5}")
+        print(f"{'':<12} {', '.join(f'{m} {c}' for m, c in sorted(result['methods'].items()))}")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+    main()
@@ -0,0 +1,62 @@
+"""用户留言数查询耗时：COUNT(*) 扫描 vs users.msg_count 计数列
+
+为一个用户写入越来越多的历史消息，分别测两种方式单次查询的平均耗时。
+运行: python -m benchmarks.message_count [最大消息数]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from bot.database import Database
+
+QUERIES = 200
+
+
+async def timed(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        await fn()
+    return (time.perf_counter() - start) / QUERIES * 1e6
+
+
+async def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    sizes = [n for n in (1_000, 10_000, 100_000, 1_000_000, 10_000_000) if n <= max_rows]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.connect()
+        await database.get_or_create_user(1, "heavy")
+        inserted = 0
+
+        async def count_scan():
+            cursor = await database.conn.execute(
+                "SELECT COUNT(*) AS count FROM messages WHERE user_id = ?", (1,)
+            )
+            await cursor.fetchone()
+
+        async def counter_column():
+            database.user_cache.clear()  # 每次都走数据库，不计缓存收益
+            await database.get_user_message_count(1)
+
+        print(f"{'历史消息数':>12} {'COUNT(*)':>12} {'计数列':>10}")
+        for size in sizes:
+            await database.conn.executemany(
+                "INSERT INTO messages (user_id, user_msg_id, forward_msg_id, content_type, created_at) "
+                "VALUES (1, ?, ?, 'text', 1767196800)",
+                ((i, i) for i in range(inserted, size))
+            )
+            await database.conn.execute("UPDATE users SET msg_count = ? WHERE user_id = 1", (size,))
+            await database.conn.commit()
+            inserted = size
+            scan = await timed(count_scan)
+            column = await timed(counter_column)
+            print(f"{size:>12,} {scan:>10.1f}µs {column:>8.1f}µs")
+
+        await database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
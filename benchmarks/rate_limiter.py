@@ -0,0 +1,101 @@
+"""限流判定吞吐对比：旧版逐条 SQLite 读写 vs 内存限流器
+
+运行: python -m benchmarks.rate_limiter [判定次数] [用户数]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from bot.database import Database
+from bot.utils.rate_limiter import RateLimiter, SlidingWindowPolicy, TokenBucketPolicy
+
+
+async def legacy_check_rate_limit(conn, user_id: int) -> tuple[bool, str]:
+    """原 Database.check_rate_limit 的实现，作为对照组"""
+    now = datetime.now()
+    cursor = await conn.execute("SELECT * FROM rate_limits WHERE user_id = ?", (user_id,))
+    row = await cursor.fetchone()
+    if row and row["cooldown_until"]:
+        cooldown_until = datetime.fromisoformat(row["cooldown_until"])
+        if now < cooldown_until:
+            return False, "cooldown"
+    cursor = await conn.execute(
+        "SELECT msg_count_today, last_msg_date FROM users WHERE user_id = ?", (user_id,)
+    )
+    user = await cursor.fetchone()
+    if user and user["last_msg_date"] == date.today().isoformat() and user["msg_count_today"] >= 20:
+        return False, "daily"
+    if row:
+        minute_start = datetime.fromisoformat(row["minute_start"]) if row["minute_start"] else None
+        if minute_start and (now - minute_start).total_seconds() < 60:
+            if row["minute_count"] >= 3:
+                await conn.execute(
+                    "UPDATE rate_limits SET cooldown_until = ?, minute_count = 0 WHERE user_id = ?",
+                    ((now + timedelta(minutes=5)).isoformat(), user_id))
+                await conn.commit()
+                return False, "cooldown"
+            await conn.execute(
+                "UPDATE rate_limits SET minute_count = minute_count + 1 WHERE user_id = ?",
+                (user_id,))
+        else:
+            await conn.execute(
+                "UPDATE rate_limits SET minute_count = 1, minute_start = ?, cooldown_until = NULL "
+                "WHERE user_id = ?", (now.isoformat(), user_id))
+    else:
+        await conn.execute(
+            "INSERT INTO rate_limits (user_id, minute_count, minute_start) VALUES (?, 1, ?)",
+            (user_id, now.isoformat()))
+    await conn.commit()
+    return True, ""
+
+
+async def bench_legacy(n: int, users: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.connect()
+        # 旧版的 rate_limits 表结构（迁移后已去掉按分钟计数的列）
+        await database.conn.executescript("""
+            DROP TABLE rate_limits;
+            CREATE TABLE rate_limits (
+                user_id INTEGER PRIMARY KEY,
+                minute_count INTEGER DEFAULT 0,
+                minute_start TEXT,
+                cooldown_until TEXT
+            );
+        """)
+        start = time.perf_counter()
+        for i in range(n):
+            await legacy_check_rate_limit(database.conn, i % users)
+        elapsed = time.perf_counter() - start
+        await database.close()
+    return n / elapsed
+
+
+def bench_memory(n: int, users: int, policy) -> float:
+    limiter = RateLimiter(user_policy=policy, per_day=20, cooldown_minutes=5, costs={})
+    start = time.perf_counter()
+    for i in range(n):
+        limiter.check(i % users, "text")
+    elapsed = time.perf_counter() - start
+    return n / elapsed
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    legacy = await bench_legacy(n, users)
+    window = bench_memory(n * 10, users, SlidingWindowPolicy(3, 60.0))
+    bucket = bench_memory(n * 10, users, TokenBucketPolicy(3 / 60.0, 3))
+
+    print(f"用户数 {users}")
+    print(f"旧版 SQLite:      {legacy:>12,.0f} 次/秒")
+    print(f"内存滑动窗口:     {window:>12,.0f} 次/秒  ({window / legacy:,.0f}x)")
+    print(f"内存令牌桶:       {bucket:>12,.0f} 次/秒  ({bucket / legacy:,.0f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
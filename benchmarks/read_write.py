@@ -0,0 +1,88 @@
+"""混合读写负载下管理员读操作的延迟：单连接 vs WAL + 只读连接池
+
+预先写入一批历史消息，然后若干写任务持续执行 save_message（每次等待提交），
+管理员每秒执行一次 /recount（大事务），同时一个读任务反复执行
+get_message_by_forward_id 和 get_stats，统计读操作的延迟分布。
+运行: python -m benchmarks.read_write [持续秒数] [写任务数] [历史消息数]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bot.database import Database
+
+
+def percentile(samples: list[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+async def run(duration: float, writers: int, history: int,
+              pooled: bool) -> tuple[list[float], int]:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"), read_pool_size=3 if pooled else 0)
+        await database.connect()
+        if not pooled:
+            # 旧版的默认设置：回滚日志 + 每次提交完整 fsync
+            await database.conn.execute("PRAGMA journal_mode = DELETE")
+            await database.conn.execute("PRAGMA synchronous = FULL")
+        for user_id in range(writers):
+            await database.get_or_create_user(user_id, f"user{user_id}")
+        await database.conn.executemany(
+            "INSERT INTO messages (user_id, user_msg_id, forward_msg_id, content_type, created_at) "
+            "VALUES (?, ?, ?, 'text', ?)",
+            ((i % writers, i, -i - 1, int(time.time())) for i in range(history))
+        )
+        await database.conn.commit()
+
+        deadline = time.perf_counter() + duration
+        written = 0
+        latencies: list[float] = []
+
+        async def writer(user_id: int):
+            nonlocal written
+            i = 1
+            while time.perf_counter() < deadline:
+                await database.save_message(user_id, i, user_id * 10_000_000 + i, "text",
+                                            durable=True)
+                written += 1
+                i += 1
+
+        async def maintenance():
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(1.0)
+                await database.recount_messages()
+
+        async def reader():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                if random.random() < 0.5:
+                    await database.get_message_by_forward_id(-random.randrange(1, history + 1))
+                else:
+                    await database.get_stats()
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.005)
+
+        await asyncio.gather(reader(), maintenance(), *(writer(u) for u in range(writers)))
+        await database.close()
+    return latencies, written
+
+
+async def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    history = int(sys.argv[3]) if len(sys.argv) > 3 else 200_000
+
+    print(f"{'模式':<16} {'写入/秒':>10} {'读次数':>8} {'读 p50':>10} {'读 p99':>10} {'读 max':>10}")
+    for name, pooled in (("单连接", False), ("WAL + 只读池", True)):
+        latencies, written = await run(duration, writers, history, pooled)
+        print(f"{name:<16} {written / duration:>10,.0f} {len(latencies):>8} "
+              f"{percentile(latencies, 0.5):>8.2f}ms {percentile(latencies, 0.99):>8.2f}ms "
+              f"{max(latencies):>8.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""/search 的查询延迟：对全部匹配排序 vs 只在最近 SEARCH_MAX_CANDIDATES 条匹配中排序
+
+先写入一批带正文的历史消息（同时建立 FTS5 索引），再分别测常见词、少见词和短词的
+第一页与翻页耗时。常见词匹配的条数越多，全量排序越慢，候选上限的耗时基本不变。
+运行: python -m benchmarks.search [消息数]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bot.config import config
+from bot.database import Database, build_search_terms
+
+WORDS = [
+    "你好", "请问", "订单", "什么时候", "发货", "退款", "谢谢", "客服", "这个", "那个",
+    "问题", "已经", "还没有", "收到", "麻烦", "看一下", "账号", "登录", "不了", "怎么办",
+    "hello", "order", "refund", "please", "help", "account", "today", "thanks",
+]
+QUERIES = [
+    ("常见词", "什么时候"),
+    ("两个词", "退款 还没有"),
+    ("少见词", "发票抬头"),
+    ("短词", "退款"),
+]
+PAGE_SIZE = 6
+RUNS = 5
+
+
+def random_text(rng: random.Random) -> str:
+    text = " ".join(rng.choices(WORDS, k=rng.randint(4, 16)))
+    if rng.random() < 0.001:
+        text += " 发票抬头要改一下"
+    return text
+
+
+async def fill(database: Database, messages: int):
+    rng = random.Random(1)
+    now = int(time.time())
+    batch = 50_000
+    for start in range(0, messages, batch):
+        rows = [
+            (i % 5000, i, None, "text", random_text(rng), now - messages + i)
+            for i in range(start, min(start + batch, messages))
+        ]
+        await database.conn.executemany(
+            "INSERT INTO messages (user_id, user_msg_id, forward_msg_id, content_type, text, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        await database.conn.commit()
+
+
+async def full_ranking(database: Database, query: str) -> int:
+    """对照组：对全部匹配计算相关度后取第一页"""
+    match, _ = build_search_terms(query)
+    if not match:
+        return 0
+    rows = await database._fetchall(
+        "SELECT rowid, rank FROM messages_fts WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+        (match, PAGE_SIZE)
+    )
+    return len(rows)
+
+
+async def timed(coro_factory) -> float:
+    best = float("inf")
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await coro_factory()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.connect()
+        start = time.perf_counter()
+        await fill(database, messages)
+        print(f"写入 {messages} 条消息并建立索引: {time.perf_counter() - start:.1f}s，"
+              f"候选上限 {config.SEARCH_MAX_CANDIDATES}")
+
+        max_id = await database.get_last_message_id()
+        print(f"{'查询':<10} {'匹配数':>10} {'全量排序':>10} {'第一页':>10} {'翻页':>10}")
+        for label, query in QUERIES:
+            match, _ = build_search_terms(query)
+            matches = (await database._fetchone(
+                "SELECT COUNT(*) AS n FROM messages_fts WHERE messages_fts MATCH ?", (match,)
+            ))["n"] if match else "-"
+            full = f"{await timed(lambda: full_ranking(database, query)):.1f}ms" if match else "-"
+            first = await timed(lambda: database.search_messages(query, max_id, PAGE_SIZE))
+            page = await database.search_messages(query, max_id, PAGE_SIZE)
+            after = (page[-1]["rank"], page[-1]["id"]) if page else None
+            following = await timed(lambda: database.search_messages(query, max_id, PAGE_SIZE, after))
+            print(f"{label:<10} {matches:>10} {full:>10} {first:>8.1f}ms {following:>8.1f}ms")
+
+        await database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,188 @@
+"""分片工作进程：单进程 vs 1..N 个工作进程处理用户留言的吞吐
+
+假的更新源直接把私聊留言（原始 JSON）交给 ShardPool 分发（不经过 Telegram），工作进程使用本地应答的
+Bot API（不走网络），所以测到的是处理器本身的 CPU 开销。每条留言完整经过限流、写库、
+发件箱和发送调度，以 messages 表中保存的转发记录数判断处理完成。
+同时统计主进程和工作进程每条留言的 CPU 时间，估算每个进程独占一个核时的吞吐：
+工作进程合计 workers / 工作进程耗时，但不超过主进程（分发 + 写库）的上限 1 / 主进程耗时。
+工作进程数超过 CPU 核数后实测吞吐不会再提高。
+运行: python -m benchmarks.shards [留言数] [最多工作进程数]
+"""
+import os
+import tempfile
+
+# 在导入 bot 之前设置：放开限流和发送限速，只测处理开销
+os.environ.update({
+    "BOT_TOKEN": "1000:bench", "ADMIN_ID": "1", "ADMIN_IDS": "", "BOTS_FILE": "", "WORKERS": "0",
+    "RATE_LIMIT_PER_MINUTE": "100000", "RATE_LIMIT_PER_DAY": "100000",
+    "SEND_GLOBAL_PER_SECOND": "1000000", "SEND_CHAT_PER_SECOND": "1000000",
+    "SEND_CHAT_BURST": "1000000", "SPAM_MIN_USERS": "0", "CONCURRENT_UPDATES": "64",
+})
+
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from itertools import count
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+USERS = 1000
+WARMUP = 50
+
+
+class FakeBotApi(BaseRequest):
+    """本地应答的 Bot API：发送类方法返回新的消息 ID"""
+
+    def __init__(self):
+        # 管理员会话中的消息 ID 不能重复：每个工作进程用自己的号段
+        self._message_ids = count((int(os.environ.get("WORKER_INDEX", "0")) + 1) * 10_000_000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1000, "is_bot": True, "first_name": "Bench", "username": "bench"}
+        elif endpoint == "copyMessage":
+            result = {"message_id": next(self._message_ids)}
+        elif endpoint.startswith("send"):
+            result = {"message_id": next(self._message_ids), "date": int(time.time()),
+                      "chat": {"id": int(parameters.get("chat_id", 0)), "type": "private"}}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def make_update(update_id: int) -> dict:
+    user_id = 10_000 + update_id % USERS
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()), "text": f"留言 {update_id}",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        },
+    }
+
+
+def cpu_seconds(pid: int) -> float:
+    """进程已用的 CPU 时间（用户态 + 内核态）"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def wait_for_messages(database, expected: int):
+    while True:
+        row = await database._fetchone("SELECT COUNT(*) AS n FROM messages")
+        if row["n"] >= expected:
+            return
+        await asyncio.sleep(0.02)
+
+
+async def run_sharded(workers: int, updates: int) -> dict:
+    """主进程 + workers 个工作进程：每秒处理的留言数，主进程和工作进程每条留言的 CPU 秒数"""
+    from bot.database import Database
+    from bot.shards import ShardPool
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+        database = Database(os.environ["DB_PATH"], read_pool_size=1)
+        await database.connect()
+        pool = ShardPool(database, workers,
+                         command=[sys.executable, "-m", "benchmarks.shards", "--worker"])
+        await pool.start()
+        # 预热：等所有工作进程启动完成
+        for update_id in range(WARMUP):
+            await pool.dispatch(make_update(update_id))
+        await wait_for_messages(database, WARMUP)
+
+        pids = [worker.process.pid for worker in pool.workers]
+        worker_cpu = sum(map(cpu_seconds, pids))
+        supervisor_cpu = time.process_time()
+        start = time.perf_counter()
+        for update_id in range(WARMUP, WARMUP + updates):
+            await pool.dispatch(make_update(update_id))
+        await wait_for_messages(database, WARMUP + updates)
+        elapsed = time.perf_counter() - start
+        supervisor_cpu = time.process_time() - supervisor_cpu
+        worker_cpu = sum(map(cpu_seconds, pids)) - worker_cpu
+
+        await pool.close()
+        await database.close()
+    return {"rate": updates / elapsed, "supervisor": supervisor_cpu / updates,
+            "worker": worker_cpu / updates}
+
+
+async def run_single(updates: int):
+    """不分片：一个进程接收并处理（在子进程中运行），输出每秒处理的留言数"""
+    import bot.main as main
+
+    application = main.build_application(FakeBotApi(), FakeBotApi())
+    await application.initialize()
+    await main.post_init(application)
+    await application.start()
+    for update_id in range(WARMUP):
+        await application.update_queue.put(Update.de_json(make_update(update_id), application.bot))
+    await wait_for_messages(main.db, WARMUP)
+
+    start = time.perf_counter()
+    for update_id in range(WARMUP, WARMUP + updates):
+        await application.update_queue.put(Update.de_json(make_update(update_id), application.bot))
+    await wait_for_messages(main.db, WARMUP + updates)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"rate": updates / elapsed}))
+
+    await main.stop_bot(application)
+    await main.scheduler.close()
+    await main.shutdown_bot(application)
+
+
+def single_rate(updates: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.shards", "--single", str(updates)],
+            capture_output=True, text=True, check=True,
+            env={**os.environ, "DB_PATH": os.path.join(tmp, "bench.db")},
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])["rate"]
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    cores = len(os.sched_getaffinity(0))
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(2, cores)
+    print(f"CPU 核数: {cores}，留言数: {updates}")
+
+    baseline = single_rate(updates)
+    print(f"{'':>8} {'实测 条/秒':>10} {'主进程 ms/条':>12} {'工作进程 ms/条':>14} {'每进程一核估算 条/秒':>20}")
+    print(f"{'单进程':>8} {baseline:>10.0f}")
+    for workers in range(1, max_workers + 1):
+        result = asyncio.run(run_sharded(workers, updates))
+        estimate = min(workers / result["worker"], 1 / result["supervisor"])
+        print(f"{workers:>5} 个工作进程 {result['rate']:>7.0f} {result['supervisor'] * 1000:>12.2f} "
+              f"{result['worker'] * 1000:>14.2f} {estimate:>20.0f}")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        import bot.main
+        asyncio.run(bot.main.run_worker(FakeBotApi(), FakeBotApi()))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--single":
+        asyncio.run(run_single(int(sys.argv[2])))
+    else:
+        main()
@@ -0,0 +1,92 @@
+"""刷屏检测：10 万条指纹下单次 check 的耗时、近似重复的检出率和正常留言的误判率
+
+先用随机留言填满指纹索引，再测：
+- 正常留言（各不相同）的 check 耗时和误判率
+- 多个用户发送同一模板的轻微改写（插入符号、替换个别字、加前后缀）时的检出率
+运行: python -m benchmarks.spam_filter [指纹数]
+"""
+import random
+import statistics
+import string
+import sys
+import time
+
+from bot.utils.spam_filter import SpamFilter
+
+WORDS = [
+    "你好", "请问", "订单", "什么时候", "发货", "退款", "谢谢", "客服", "这个", "那个",
+    "问题", "已经", "还没有", "收到", "麻烦", "看一下", "账号", "登录", "不了", "怎么办",
+    "hello", "order", "refund", "please", "help", "account", "today", "thanks",
+]
+SPAM_TEMPLATES = [
+    "免费领取 USDT 空投，点击链接 t.me/airdrop_bonus 立即到账，名额有限先到先得",
+    "兼职刷单日赚三百到五百，无需押金在家就能做，有意者加微信 abc12345 详聊",
+    "Limited offer! Claim your free crypto bonus now at bit.ly/free-coins before it expires",
+]
+
+
+def random_message(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(6, 20))
+    return " ".join(words) + " " + "".join(rng.choices(string.ascii_lowercase + string.digits, k=6))
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    """模拟刷屏者的改写：插入空格/符号、替换一个字、加前后缀"""
+    chars = list(text)
+    for _ in range(3):
+        chars.insert(rng.randrange(len(chars)), rng.choice(" .,!~*"))
+    i = rng.randrange(len(chars))
+    chars[i] = rng.choice("一二三四五六七八九十")
+    return rng.choice(["", "【推荐】", "hi "]) + "".join(chars) + rng.choice(["", "！！", " 😊"])
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(1)
+    clock = [0.0]
+    spam = SpamFilter(threshold=0.7, min_users=3, window=10 ** 9, max_entries=entries,
+                      min_text_length=20, clock=lambda: clock[0])
+
+    start = time.perf_counter()
+    for i in range(entries):
+        clock[0] += 0.01
+        spam.check(1_000_000 + i, random_message(rng))
+    print(f"填充 {entries} 条指纹: {time.perf_counter() - start:.1f}s，桶数 {len(spam._buckets)}")
+
+    timings = []
+    false_positives = 0
+    normal = 5000
+    for i in range(normal):
+        text = random_message(rng)
+        clock[0] += 0.01
+        t0 = time.perf_counter()
+        flagged = spam.check(2_000_000 + i, text)
+        timings.append(time.perf_counter() - t0)
+        false_positives += flagged
+
+    detected = campaigns = 0
+    spam_timings = []
+    for round_ in range(200):
+        template = rng.choice(SPAM_TEMPLATES) + str(round_)
+        for sender in range(5):
+            clock[0] += 0.01
+            t0 = time.perf_counter()
+            flagged = spam.check(3_000_000 + round_ * 10 + sender, mutate(template, rng))
+            spam_timings.append(time.perf_counter() - t0)
+            if sender >= 2:
+                campaigns += 1
+                detected += flagged
+
+    timings.sort()
+    spam_timings.sort()
+    print(f"正常留言 check: p50 {timings[len(timings) // 2] * 1e6:.0f}µs  "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f}µs  "
+          f"平均 {statistics.mean(timings) * 1e6:.0f}µs")
+    print(f"刷屏留言 check: p50 {spam_timings[len(spam_timings) // 2] * 1e6:.0f}µs  "
+          f"p99 {spam_timings[int(len(spam_timings) * 0.99)] * 1e6:.0f}µs")
+    print(f"误判率: {false_positives}/{normal} = {false_positives / normal:.2%}")
+    print(f"检出率（第 3 个及之后的发送者）: {detected}/{campaigns} = {detected / campaigns:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""存储后端：一致性检查，以及 SQLite 与 PostgreSQL 的性能对比
+
+一致性检查在每个后端的空库上依次调用 Storage 的全部方法，核对返回值和副作用
+（缓存、去重、触发器维护的统计和群发计数），新的后端实现需要全部通过。
+性能对比在同一组数据上测：并发保存留言的吞吐（等待提交）、/history 翻页、搜索、统计查询的平均耗时。
+PostgreSQL 使用 DATABASE_URL（或第一个参数）指定的数据库，在其中建临时 schema，结束后删除；
+未指定时只检查 SQLite。
+运行: python -m benchmarks.storage [DATABASE_URL] [留言数]
+"""
+import asyncio
+import gzip
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from bot.config import config
+from bot.database import Database
+
+USERS = 1000
+CONCURRENCY = 50
+RUNS = 50
+
+
+class Checks:
+    """收集不符合预期的检查项"""
+
+    def __init__(self):
+        self.count = 0
+        self.failures: list[str] = []
+
+    def equal(self, name: str, actual, expected):
+        self.count += 1
+        if actual != expected:
+            self.failures.append(f"{name}: 期望 {expected!r}，实际 {actual!r}")
+
+    def true(self, name: str, value):
+        self.equal(name, bool(value), True)
+
+
+async def check_storage(storage) -> Checks:
+    """在一个已连接的空存储上调用全部方法"""
+    checks = Checks()
+    now = time.time()
+    today = date.today().isoformat()
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+
+    # ===== 用户 =====
+    checks.equal("get_user 不存在", await storage.get_user(1), None)
+    user = await storage.get_or_create_user(1, "alice", "Alice", None)
+    checks.equal("get_or_create_user 新建", (user.user_id, user.username, user.msg_count), (1, "alice", 0))
+    await storage.get_or_create_user(1, "alice2", "Alice", "A")
+    storage.user_cache.clear()
+    user = await storage.get_user(1)
+    checks.equal("get_or_create_user 更新资料", (user.username, user.last_name), ("alice2", "A"))
+    for user_id in (2, 3):
+        await storage.get_or_create_user(user_id, f"user{user_id}", None, None)
+
+    await storage.ban_user(2, "spam")
+    checks.equal("ban_user", await storage.is_user_banned(2), True)
+    checks.equal("ban_user 计数", (await storage.get_stats())["banned_users"], 1)
+    await storage.unban_user(2)
+    checks.equal("unban_user", await storage.is_user_banned(2), False)
+    checks.equal("unban_user 计数", (await storage.get_stats())["banned_users"], 0)
+
+    await storage.assign_admin(1, 900)
+    await storage.assign_admin(2, 900)
+    await storage.flush()
+    checks.equal("get_admin_user_counts", await storage.get_admin_user_counts(), {900: 2})
+
+    # ===== 消息 =====
+    message_id = await storage.save_message(1, 10, 500, "text", "hello storage world",
+                                            durable=True, forward_chat_id=900)
+    checks.true("save_message 返回 ID", isinstance(message_id, int))
+    await storage.save_message(2, 10, 501, "photo", None, forward_chat_id=900)
+    await storage.flush()
+    checks.equal("get_user_message_count", await storage.get_user_message_count(1), 1)
+    checks.equal("get_today_msg_count", await storage.get_today_msg_count(1), 1)
+    checks.equal("get_today_msg_counts", sorted(await storage.get_today_msg_counts()), [(1, 1), (2, 1)])
+    checks.equal("get_user_id_by_forward_id", await storage.get_user_id_by_forward_id(900, 500), 1)
+    checks.equal("get_user_id_by_forward_id 其他会话", await storage.get_user_id_by_forward_id(901, 500), None)
+    message = await storage.get_message_by_forward_id(900, 500)
+    checks.equal("get_message_by_forward_id", (message["id"], message["text"]),
+                 (message_id, "hello storage world"))
+    checks.equal("get_open_conversations", sorted(await storage.get_open_conversations()),
+                 [(1, 900), (2, 900)])
+
+    await storage.save_reply(1, 11, "text", "reply text")
+    await storage.flush()
+    checks.equal("save_reply 后的未回复会话", await storage.get_open_conversations(), [(2, 900)])
+    checks.equal("save_reply 不计入留言", await storage.get_user_message_count(1), 1)
+    page, has_more = await storage.get_user_history(1, 1)
+    checks.equal("get_user_history 最新一页", ([row["text"] for row in page], has_more), (["reply text"], True))
+    reply_id = page[0]["id"]
+    page, has_more = await storage.get_user_history(1, 1, before=reply_id)
+    checks.equal("get_user_history before", ([row["id"] for row in page], has_more), ([message_id], False))
+    page, has_more = await storage.get_user_history(1, 5, after=message_id)
+    checks.equal("get_user_history after", ([row["id"] for row in page], has_more), ([reply_id], False))
+
+    checks.equal("recount_messages 无偏差", await storage.recount_messages(), 0)
+    await storage.writer.submit("UPDATE users SET msg_count = 7 WHERE user_id = ?", (1,))
+    checks.equal("recount_messages 修正", await storage.recount_messages(), 1)
+    checks.equal("recount_messages 结果", await storage.get_user_message_count(1), 1)
+
+    # ===== 频率限制 =====
+    await storage.save_cooldowns([(1, now + 60), (2, now - 60)])
+    checks.equal("get_active_cooldowns", await storage.get_active_cooldowns(now), [(1, now + 60)])
+
+    # ===== 发件箱 =====
+    item_id = await storage.add_outbox_item("k1", "forward", 900, "sendMessage", "{}", 1, user_id=1)
+    checks.true("add_outbox_item", isinstance(item_id, int))
+    checks.equal("add_outbox_item 去重", await storage.add_outbox_item(
+        "k1", "forward", 900, "sendMessage", "{}", 1, user_id=1), None)
+    due = await storage.get_due_outbox_items(now, 10)
+    checks.equal("get_due_outbox_items", [(row["id"], row["dedup_key"]) for row in due], [(item_id, "k1")])
+    checks.equal("get_due_outbox_items 本分片", len(await storage.get_due_outbox_items(now, 10, 1, 2)), 1)
+    checks.equal("get_due_outbox_items 其他分片", await storage.get_due_outbox_items(now, 10, 0, 2), [])
+    await storage.mark_outbox_retry(item_id, now + 100, "timeout")
+    checks.equal("mark_outbox_retry", await storage.get_due_outbox_items(now, 10), [])
+    row = (await storage.get_due_outbox_items(now + 200, 10))[0]
+    checks.equal("mark_outbox_retry 记录", (row["attempts"], row["last_error"]), (1, "timeout"))
+    await storage.mark_outbox_sent(item_id, 777)
+    checks.equal("mark_outbox_sent", await storage.get_due_outbox_items(now + 200, 10), [])
+    failed_id = await storage.add_outbox_item("k2", "reply", 1, "sendMessage", "{}", 0)
+    await storage.mark_outbox_failed(failed_id, "forbidden")
+    checks.equal("mark_outbox_failed", await storage.get_due_outbox_items(now + 200, 10), [])
+    await storage.purge_sent_outbox(-1)
+    await storage.flush()
+    checks.true("purge_sent_outbox 后可重新入队",
+                await storage.add_outbox_item("k1", "forward", 900, "sendMessage", "{}", 1))
+
+    # ===== 摘要 =====
+    checks.true("add_digest_pending", await storage.add_digest_pending(2, 20, '{"text": "a"}'))
+    checks.equal("add_digest_pending 重复", await storage.add_digest_pending(2, 20, "{}"), False)
+    await storage.add_digest_pending(3, 22, '{"text": "b"}')
+    checks.equal("get_digest_pending", [(row["user_id"], row["user_msg_id"], row["message"])
+                                        for row in await storage.get_digest_pending()],
+                 [(2, 20, '{"text": "a"}'), (3, 22, '{"text": "b"}')])
+    checks.equal("get_digest_pending 分片", [row["user_id"] for row in await storage.get_digest_pending(1, 2)], [3])
+    digest_id = await storage.create_digest([(2, 20, "digest first"), (3, 21, "digest second")])
+    checks.equal("create_digest 删除待汇总留言",
+                 [row["user_msg_id"] for row in await storage.get_digest_pending()], [22])
+    await storage.remove_digest_pending(3, 22)
+    await storage.flush()
+    checks.equal("remove_digest_pending", await storage.get_digest_pending(), [])
+    page, total = await storage.get_digest_page(digest_id, 1, 5)
+    checks.equal("get_digest_page", ([(row["position"], row["text"], row["user_id"]) for row in page], total),
+                 ([(1, "digest second", 3)], 2))
+    checks.equal("create_digest 计入留言", await storage.get_user_message_count(3), 1)
+    checks.equal("get_digest_page 不存在", await storage.get_digest_page(digest_id + 1, 0, 5), ([], 0))
+
+    # ===== 群发 =====
+    broadcast_id, total = await storage.create_broadcast("sendMessage", '{"text": "hi"}', 900)
+    checks.equal("create_broadcast 收件人数", total, 3)
+    checks.equal("get_broadcast", (await storage.get_broadcast(broadcast_id))["status"], "draft")
+    await storage.set_broadcast_status(broadcast_id, "running", status_msg_id=55)
+    running = await storage.get_running_broadcasts()
+    checks.equal("get_running_broadcasts", [(job["id"], job["status_msg_id"]) for job in running],
+                 [(broadcast_id, 55)])
+    checks.equal("get_broadcast_recipients", await storage.get_broadcast_recipients(broadcast_id, 0, 10),
+                 [1, 2, 3])
+    checks.equal("get_broadcast_recipients 游标", await storage.get_broadcast_recipients(broadcast_id, 1, 1),
+                 [2])
+    await storage.record_broadcast_result(broadcast_id, 1, "sent")
+    await storage.record_broadcast_result(broadcast_id, 1, "sent")
+    await storage.record_broadcast_result(broadcast_id, 2, "failed", "bad request")
+    await storage.record_broadcast_result(broadcast_id, 3, "blocked", "forbidden")
+    await storage.advance_broadcast(broadcast_id, 3)
+    job = await storage.get_broadcast(broadcast_id)
+    checks.equal("record_broadcast_result 计数", (job["sent"], job["failed"], job["blocked"], job["cursor"]),
+                 (1, 1, 1, 3))
+    checks.equal("已有结果的收件人", await storage.get_broadcast_recipients(broadcast_id, 0, 10), [])
+    await storage.set_broadcast_status(broadcast_id, "done")
+    job = await storage.get_broadcast(broadcast_id)
+    checks.true("set_broadcast_status 完成时间", job["finished_at"] and job["status_msg_id"] == 55)
+    checks.equal("屏蔽的用户不再是收件人",
+                 (await storage.create_broadcast("sendMessage", "{}", 900))[1], 2)
+
+    # ===== 搜索 =====
+    for user_msg_id, text in enumerate(("apple pie", "apple apple pie", "banana"), 30):
+        await storage.save_message(3, user_msg_id, None, "text", text)
+    await storage.flush()
+    last_id = await storage.get_last_message_id()
+    checks.equal("get_last_message_id", last_id, message_id + 7)
+    hits = await storage.search_messages("apple", last_id, 10)
+    checks.equal("search_messages 相关度排序", [row["text"] for row in hits], ["apple apple pie", "apple pie"])
+    first = await storage.search_messages("APPLE", last_id, 1)
+    rest = await storage.search_messages("apple", last_id, 10, after=(first[0]["rank"], first[0]["id"]))
+    checks.equal("search_messages 翻页", [row["text"] for row in first + rest],
+                 ["apple apple pie", "apple pie"])
+    checks.equal("search_messages 短词", [row["text"] for row in await storage.search_messages("pi", last_id, 10)],
+                 ["apple apple pie", "apple pie"])
+    checks.equal("search_messages 多个词", [row["text"] for row in
+                                             await storage.search_messages("storage wor", last_id, 10)],
+                 ["hello storage world"])
+    checks.equal("search_messages max_id", await storage.search_messages("banana", last_id - 1, 10), [])
+    checks.equal("search_messages 用户资料", hits[0]["username"], "user3")
+
+    # ===== 统计 =====
+    checks.equal("get_stats", await storage.get_stats(), {
+        "total_users": 3, "total_messages": 7, "banned_users": 0, "today_messages": 7,
+    })
+    stats = await storage.get_range_stats(today, tomorrow, top=2)
+    checks.equal("get_range_stats", (stats["total"], stats["by_type"]), (7, {"text": 6, "photo": 1}))
+    checks.equal("get_range_stats 排行", [(row["user_id"], row["count"], row["username"])
+                                          for row in stats["top_senders"]], [(3, 4, "user3"), (2, 2, "user2")])
+
+    # ===== 导出 =====
+    with tempfile.TemporaryDirectory() as tmp:
+        results = await storage.export(tmp, "jsonl")
+        checks.equal("export 行数", [rows for _, rows in results], [3, 8])
+        with gzip.open(results[1][0], "rt", encoding="utf-8") as f:
+            checks.true("export 内容", '"text": "hello storage world"' in f.read())
+    return checks
+
+
+async def fill(storage, messages: int) -> float:
+    """并发保存留言（每条等待提交），返回每秒条数"""
+    await asyncio.gather(*(storage.get_or_create_user(1000 + i, f"user{i}", "User", None)
+                           for i in range(USERS)))
+    queue = iter(range(messages))
+
+    async def sender():
+        for i in queue:
+            await storage.save_message(1000 + i % USERS, i, i, "text", f"message {i} 第 {i} 条留言",
+                                       durable=True, forward_chat_id=1)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(CONCURRENCY)))
+    return messages / (time.perf_counter() - start)
+
+
+async def timed(coro_factory) -> float:
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        await coro_factory()
+    return (time.perf_counter() - start) / RUNS * 1000
+
+
+async def measure(storage, messages: int) -> dict:
+    rate = await fill(storage, messages)
+    last_id = await storage.get_last_message_id()
+    today = date.today().isoformat()
+    return {
+        "保存留言 条/秒": rate,
+        "/history ms": await timed(lambda: storage.get_user_history(1000, config.HISTORY_PAGE_SIZE)),
+        "/search ms": await timed(lambda: storage.search_messages("第 42", last_id, 10)),
+        "/stats ms": await timed(storage.get_stats),
+        "/stats 范围 ms": await timed(lambda: storage.get_range_stats(today, "9999-12-31")),
+    }
+
+
+async def run_backend(name: str, open_storage, messages: int) -> dict:
+    storage, cleanup = await open_storage()
+    try:
+        checks = await check_storage(storage)
+    finally:
+        await storage.close()
+        await cleanup()
+    print(f"{name}: 一致性检查 {checks.count - len(checks.failures)}/{checks.count} 通过")
+    for failure in checks.failures:
+        print(f"  ✗ {failure}")
+
+    storage, cleanup = await open_storage()
+    try:
+        return await measure(storage, messages)
+    finally:
+        await storage.close()
+        await cleanup()
+
+
+def sqlite_opener(tmp: str):
+    count = 0
+
+    async def open_storage():
+        nonlocal count
+        count += 1
+        storage = Database(os.path.join(tmp, f"bench{count}.db"))
+        await storage.connect()
+
+        async def cleanup():
+            pass
+        return storage, cleanup
+    return open_storage
+
+
+def postgres_opener(url: str):
+    import asyncpg
+    from bot.postgres import PostgresDatabase, quote_ident
+
+    schema = f"bench_{os.getpid()}"
+
+    async def open_storage():
+        storage = PostgresDatabase(url, schema=schema)
+        await storage.connect()
+
+        async def cleanup():
+            conn = await asyncpg.connect(url)
+            try:
+                await conn.execute(f"DROP SCHEMA IF EXISTS {quote_ident(schema)} CASCADE")
+            finally:
+                await conn.close()
+        return storage, cleanup
+    return open_storage
+
+
+async def main():
+    args = [arg for arg in sys.argv[1:] if not arg.isdigit()]
+    numbers = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+    url = args[0] if args else config.DATABASE_URL
+    messages = numbers[0] if numbers else 5000
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results["SQLite"] = await run_backend("SQLite", sqlite_opener(tmp), messages)
+    if url:
+        results["PostgreSQL"] = await run_backend("PostgreSQL", postgres_opener(url), messages)
+    else:
+        print("未指定 DATABASE_URL，跳过 PostgreSQL")
+
+    print(f"\n{messages} 条留言，{USERS} 个用户，{CONCURRENCY} 并发")
+    print(f"{'':<16}" + "".join(f"{name:>12}" for name in results))
+    for metric in next(iter(results.values())):
+        print(f"{metric:<16}" + "".join(f"{values[metric]:>12.2f}" for values in results.values()))
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""多机器人：N 个机器人各用一个进程 vs 一个进程运行 N 个机器人的内存和启动时间
+
+子进程中用假的 Bot API（getMe / getUpdates 在本地应答）完整启动机器人：创建 Application、
+连接并迁移数据库、启动轮询和定时任务，然后读取进程的常驻内存（VmRSS）。
+运行: python -m benchmarks.tenancy [机器人数]
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from telegram.request import BaseRequest
+
+
+class LocalBotApi(BaseRequest):
+    """本地应答的 Bot API：getMe 返回 token 中的 ID，getUpdates 等待后返回空"""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        token, endpoint = url.rsplit("/", 2)[-2:]
+        bot_id = int(token[3:].split(":")[0])
+        if endpoint == "getMe":
+            result = {"id": bot_id, "is_bot": True, "first_name": "Bench", "username": f"bench{bot_id}"}
+        elif endpoint == "getUpdates":
+            await asyncio.sleep(1)
+            result = []
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def child(bots: int, data_dir: str):
+    """在一个进程中启动 bots 个机器人，输出启动耗时（含导入）和内存"""
+    start = time.perf_counter()
+    import bot.main as main
+    from bot.config import base_config
+    from bot.tenant import Tenant
+
+    tenants = [
+        Tenant(f"bot{i}", base_config.derive({
+            "BOT_TOKEN": f"{1000 + i}:token", "ADMIN_ID": "1",
+            "DB_PATH": os.path.join(data_dir, f"bot{i}.db"),
+        }))
+        for i in range(bots)
+    ]
+    request, updates_request = LocalBotApi(), LocalBotApi()
+    await asyncio.gather(*(
+        tenant.call(main.start_bot, request, updates_request, None) for tenant in tenants
+    ))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "rss": rss_mb()}))
+
+    await asyncio.gather(*(tenant.call(main.stop_bot, tenant.application) for tenant in tenants))
+    await main.scheduler.close()
+    await asyncio.gather(*(tenant.call(main.shutdown_bot, tenant.application) for tenant in tenants))
+
+
+def run_child(bots: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.tenancy", "--child", str(bots), tmp],
+            capture_output=True, text=True, check=True,
+            env={**os.environ, "BOT_TOKEN": "", "ADMIN_ID": "", "BOTS_FILE": ""},
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    bots = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    one = run_child(1)
+    shared = run_child(bots)
+    print(f"1 个进程 1 个机器人: {one['rss']:.1f} MB，启动 {one['seconds']:.2f}s")
+    print(f"{bots} 个进程各 1 个机器人: 约 {one['rss'] * bots:.1f} MB，"
+          f"启动 CPU 合计约 {one['seconds'] * bots:.2f}s")
+    print(f"1 个进程 {bots} 个机器人: {shared['rss']:.1f} MB，启动 {shared['seconds']:.2f}s，"
+          f"每增加一个机器人约 {(shared['rss'] - one['rss']) / (bots - 1):.1f} MB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        asyncio.run(child(int(sys.argv[2]), sys.argv[3]))
+    else:
+        main()
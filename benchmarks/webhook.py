@@ -0,0 +1,82 @@
+"""Webhook 吞吐和延迟：向本地 webhook 服务 POST 模拟的更新
+
+不需要 Bot Token 和网络，服务收到的更新放入队列后由一个消费者取出计数。
+运行: python -m benchmarks.webhook [每个连接的请求数] [连接数]
+"""
+import asyncio
+import json
+import sys
+import time
+
+from bot.webhook import WebhookServer
+
+SECRET = "bench-secret"
+
+
+def make_update(update_id: int, user_id: int) -> bytes:
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": "hello",
+        },
+    }).encode()
+
+
+async def client(port: int, conn_id: int, requests: int, latencies: list[float]):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for i in range(requests):
+        body = make_update(conn_id * requests + i, conn_id)
+        start = time.perf_counter()
+        writer.write(
+            f"POST /webhook HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        status = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        latencies.append(time.perf_counter() - start)
+        assert b" 200 " in status, status
+    writer.close()
+
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    connections = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    queue: asyncio.Queue = asyncio.Queue()
+    server = WebhookServer(queue, listen="127.0.0.1", port=0, path="/webhook",
+                           secret_token=SECRET, max_connections=connections)
+    await server.start()
+
+    consumed = 0
+
+    async def consumer():
+        nonlocal consumed
+        while True:
+            await queue.get()
+            consumed += 1
+
+    consumer_task = asyncio.create_task(consumer())
+    latencies: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(server.port, c, requests, latencies) for c in range(connections)))
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0)
+    consumer_task.cancel()
+    await server.stop()
+
+    latencies.sort()
+    total = requests * connections
+    print(f"{connections} 个连接 × {requests} 个请求 = {total} 个更新")
+    print(f"吞吐: {total / elapsed:,.0f} 更新/秒  已入队 {consumed}  拒绝 {server.rejected}")
+    print(f"延迟: p50 {latencies[total // 2] * 1000:.2f}ms  p99 {latencies[int(total * 0.99) - 1] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
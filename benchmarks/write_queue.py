@@ -0,0 +1,51 @@
+"""写入合并吞吐：逐条提交 vs 批量提交
+
+模拟并发处理器，每条入站消息执行 save_message（写入消息并更新计数）。
+不指定并发数时依次测 1、5、50 并发：低并发下合并提交不能比逐条提交慢。
+运行: python -m benchmarks.write_queue [消息数] [并发数]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from bot.database import Database
+
+
+async def run(messages: int, concurrency: int, batch: int) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.connect()
+        database.writer.max_batch = batch
+        for user_id in range(concurrency):
+            await database.get_or_create_user(user_id, f"user{user_id}")
+        database.writer.batches = database.writer.ops = 0
+
+        async def sender(user_id: int):
+            for i in range(messages // concurrency):
+                await database.save_message(user_id, i, user_id * 100000 + i, "text", durable=True)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(sender(u) for u in range(concurrency)))
+        await database.writer.flush()
+        elapsed = time.perf_counter() - start
+        ops_per_commit = database.writer.ops / max(database.writer.batches, 1)
+        await database.close()
+    return messages / elapsed, ops_per_commit
+
+
+async def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    levels = [int(sys.argv[2])] if len(sys.argv) > 2 else [1, 5, 50]
+
+    print(f"{messages} 条消息")
+    print(f"{'并发':>6} {'逐条提交 条/秒':>14} {'批量提交 条/秒':>14} {'倍数':>6} {'每次提交写操作':>14}")
+    for concurrency in levels:
+        single, _ = await run(messages, concurrency, batch=1)
+        grouped, per_commit = await run(messages, concurrency, batch=50)
+        print(f"{concurrency:>6} {single:>14,.0f} {grouped:>14,.0f} {grouped / single:>5.1f}x {per_commit:>14.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,29 +1,200 @@
+import copy
+import json
 import os
+import re
 from dotenv import load_dotenv
 
+from bot.tenant import Tenant, TenantLocal
+
 load_dotenv()
 
 
+def parse_ids(value) -> list[int]:
+    """逗号分隔的 ID（或 ID 列表）"""
+    if isinstance(value, (list, tuple)):
+        return [int(item) for item in value]
+    return [int(item) for item in str(value).split(",") if item.strip()]
+
+
 class Config:
     # 必需配置
     BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
-    ADMIN_ID: int = int(os.getenv("ADMIN_ID", "0"))
+    # 管理员：ADMIN_IDS 为逗号分隔的多个管理员 ID，未设置时使用 ADMIN_ID。
+    # 第一个管理员即原来的 ADMIN_ID（升级前转发的留言都在这个会话中）
+    ADMIN_IDS: list[int] = parse_ids(os.getenv("ADMIN_IDS") or os.getenv("ADMIN_ID", ""))
+    ADMIN_ID: int = ADMIN_IDS[0] if ADMIN_IDS else 0
+    # 多管理员分配方式：sticky 按用户一致性哈希，least_loaded 分给未回复会话最少的管理员
+    ADMIN_ROUTING: str = os.getenv("ADMIN_ROUTING", "sticky")
 
     # 频率限制
     RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "3"))
     RATE_LIMIT_PER_DAY: int = int(os.getenv("RATE_LIMIT_PER_DAY", "20"))
     COOLDOWN_MINUTES: int = int(os.getenv("COOLDOWN_MINUTES", "5"))
+    # 限流算法：sliding_window 或 token_bucket
+    RATE_LIMIT_ALGORITHM: str = os.getenv("RATE_LIMIT_ALGORITHM", "sliding_window")
+    # 全局每分钟上限（所有用户合计，0 表示不限制）
+    GLOBAL_RATE_LIMIT_PER_MINUTE: int = int(os.getenv("GLOBAL_RATE_LIMIT_PER_MINUTE", "0"))
+    # 不同消息类型的消耗权重，如 "photo:1,voice:2"，未列出的类型按 1 计
+    RATE_LIMIT_COSTS: str = os.getenv("RATE_LIMIT_COSTS", "")
+    # 冷却状态写入数据库的间隔（秒）
+    RATE_LIMIT_SNAPSHOT_SECONDS: int = int(os.getenv("RATE_LIMIT_SNAPSHOT_SECONDS", "30"))
+
+    # 出站发送限速：全局每秒条数 / 单个会话每秒条数 / 单个会话突发条数
+    SEND_GLOBAL_PER_SECOND: float = float(os.getenv("SEND_GLOBAL_PER_SECOND", "30"))
+    SEND_CHAT_PER_SECOND: float = float(os.getenv("SEND_CHAT_PER_SECOND", "1"))
+    SEND_CHAT_BURST: float = float(os.getenv("SEND_CHAT_BURST", "3"))
+
+    # 发件箱：最多重试次数 / 首次重试间隔秒数 / 检查间隔秒数 / 已发送记录保留小时数
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    OUTBOX_RETRY_BASE_SECONDS: float = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "2"))
+    OUTBOX_POLL_SECONDS: int = int(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+    OUTBOX_RETENTION_HOURS: int = int(os.getenv("OUTBOX_RETENTION_HOURS", "24"))
+
+    # 同时处理的更新数（1 表示逐条处理）
+    CONCURRENT_UPDATES: int = int(os.getenv("CONCURRENT_UPDATES", "1"))
+
+    # 相册收集：最后一张到达后等待多少毫秒再整组转发
+    MEDIA_GROUP_WINDOW_MS: int = int(os.getenv("MEDIA_GROUP_WINDOW_MS", "800"))
+
+    # 刷屏检测：窗口秒数内至少多少个不同用户发送相似内容时拦截（0 表示关闭）
+    SPAM_MIN_USERS: int = int(os.getenv("SPAM_MIN_USERS", "3"))
+    SPAM_SIMILARITY: float = float(os.getenv("SPAM_SIMILARITY", "0.7"))
+    SPAM_WINDOW_SECONDS: float = float(os.getenv("SPAM_WINDOW_SECONDS", "3600"))
+    SPAM_MAX_FINGERPRINTS: int = int(os.getenv("SPAM_MAX_FINGERPRINTS", "100000"))
+    # 短于此长度的文字（去掉空白和标点后）不参与检测，避免误伤“你好”之类的常见问候
+    SPAM_MIN_TEXT_LENGTH: int = int(os.getenv("SPAM_MIN_TEXT_LENGTH", "20"))
+    # 拦截后的处理：quarantine 隔离供管理员 /spam 查看，drop 直接丢弃
+    SPAM_ACTION: str = os.getenv("SPAM_ACTION", "quarantine")
+
+    # 摘要模式：窗口秒数内的文字留言合并为一条管理员消息（0 表示关闭）/ 每页条数
+    DIGEST_WINDOW_SECONDS: float = float(os.getenv("DIGEST_WINDOW_SECONDS", "0"))
+    DIGEST_PAGE_SIZE: int = int(os.getenv("DIGEST_PAGE_SIZE", "5"))
+
+    # /search：每次搜索最多在最近多少条匹配中排序 / 每页条数
+    SEARCH_MAX_CANDIDATES: int = int(os.getenv("SEARCH_MAX_CANDIDATES", "5000"))
+    SEARCH_PAGE_SIZE: int = int(os.getenv("SEARCH_PAGE_SIZE", "5"))
+    # /history 每页消息数
+    HISTORY_PAGE_SIZE: int = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+    # 导出：每次从游标读取并写入的行数
+    EXPORT_CHUNK_ROWS: int = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+    # 群发：每批读取的收件人数 / 进度消息的更新间隔（秒）
+    BROADCAST_BATCH_SIZE: int = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+    BROADCAST_PROGRESS_SECONDS: float = float(os.getenv("BROADCAST_PROGRESS_SECONDS", "5"))
 
+    # Webhook 模式（设置 WEBHOOK_URL 后启用，否则使用轮询）
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_LISTEN: str = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8443"))
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET_TOKEN: str = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+    # Bot API 服务地址（留空使用官方地址）：自建的 Bot API 服务或压测用的本地模拟服务
+    BOT_API_URL: str = os.getenv("BOT_API_URL", "")
+
+    # 存储后端：sqlite（DB_PATH）或 postgres（DATABASE_URL，需要安装 asyncpg）
+    DB_BACKEND: str = os.getenv("DB_BACKEND", "sqlite")
     # 数据库路径
     DB_PATH: str = os.getenv("DB_PATH", "data/bot.db")
+    # PostgreSQL 连接串、连接池大小和使用的 schema（多机器人时默认每个机器人一个 schema）
+    DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_SCHEMA: str = os.getenv("DB_SCHEMA", "public")
+    # 写入合并：每批最多条数（提交期间入队的写操作合并到下一批）
+    WRITE_BATCH_SIZE: int = int(os.getenv("WRITE_BATCH_SIZE", "50"))
+    # 只读连接数（WAL 模式下读操作不等待写入提交；0 表示读写共用一个连接）
+    DB_READ_POOL_SIZE: int = int(os.getenv("DB_READ_POOL_SIZE", "3"))
+    # 结构迁移重写大表时每批复制的行数（每批一个短事务）
+    MIGRATION_BATCH_SIZE: int = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+
+    # 用户资料缓存：最多缓存条数（每条约几百字节）/ 过期秒数
+    USER_CACHE_MAX_ENTRIES: int = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+    USER_CACHE_TTL_SECONDS: int = int(os.getenv("USER_CACHE_TTL_SECONDS", "600"))
+    # 用户资料缓存的内存上限（MB，按记录和字符串的大小估算；0 表示只按条数限制）
+    USER_CACHE_MAX_MB: float = float(os.getenv("USER_CACHE_MAX_MB", "16"))
+    # 回复路由缓存：最多缓存的转发消息映射条数（启动时从最近的消息预加载）
+    FORWARD_CACHE_MAX_ENTRIES: int = int(os.getenv("FORWARD_CACHE_MAX_ENTRIES", "50000"))
 
-    @classmethod
-    def validate(cls) -> bool:
-        if not cls.BOT_TOKEN:
+    # 多机器人：JSON 文件，列出每个机器人的配置，设置后在一个进程中运行其中所有机器人
+    BOTS_FILE: str = os.getenv("BOTS_FILE", "")
+
+    # 分片工作进程数（0 表示在主进程中处理）；WORKER_INDEX 由主进程传给工作进程
+    WORKERS: int = int(os.getenv("WORKERS", "0"))
+    WORKER_INDEX: int = int(os.getenv("WORKER_INDEX", "-1"))
+
+    def validate(self) -> bool:
+        if not self.BOT_TOKEN:
             raise ValueError("BOT_TOKEN 未设置")
-        if not cls.ADMIN_ID:
+        if not self.ADMIN_IDS:
             raise ValueError("ADMIN_ID 未设置")
+        if any(admin_id <= 0 for admin_id in self.ADMIN_IDS):
+            raise ValueError(f"ADMIN_ID 无效: {self.ADMIN_IDS}")
+        if self.ADMIN_ROUTING not in ("sticky", "least_loaded"):
+            raise ValueError(f"不支持的 ADMIN_ROUTING: {self.ADMIN_ROUTING}")
+        if self.WORKERS > 0 and self.BOTS_FILE:
+            raise ValueError("WORKERS 和 BOTS_FILE 不能同时使用")
+        if self.WORKERS > 0 and self.ADMIN_ROUTING == "least_loaded":
+            # 未回复数保存在各工作进程中，每个进程只能看到自己分片的会话
+            raise ValueError("ADMIN_ROUTING=least_loaded 不能与 WORKERS 同时使用")
+        if self.DB_BACKEND not in ("sqlite", "postgres"):
+            raise ValueError(f"不支持的 DB_BACKEND: {self.DB_BACKEND}")
+        if self.DB_BACKEND == "postgres" and not self.DATABASE_URL:
+            raise ValueError("DB_BACKEND=postgres 需要设置 DATABASE_URL")
+        if self.WORKERS > 0 and self.DB_BACKEND == "sqlite" and self.DB_PATH == ":memory:":
+            raise ValueError("WORKERS 需要数据库文件，工作进程无法共享内存数据库")
         return True
 
+    def derive(self, overrides: dict) -> "Config":
+        """复制配置并按 overrides 覆盖，键为配置项名（与环境变量同名）"""
+        derived = copy.copy(self)
+        for key, value in overrides.items():
+            if not key.isupper() or not hasattr(Config, key):
+                raise ValueError(f"未知的配置项: {key}")
+            if key in ("ADMIN_ID", "ADMIN_IDS"):
+                derived.ADMIN_IDS = parse_ids(value)
+                derived.ADMIN_ID = derived.ADMIN_IDS[0] if derived.ADMIN_IDS else 0
+            else:
+                setattr(derived, key, type(getattr(Config, key))(value))
+        return derived
+
+
+def load_tenants(path: str, base: Config) -> list[Tenant]:
+    """读取多机器人配置文件：[{"name": "shop", "BOT_TOKEN": "...", "ADMIN_IDS": "1,2", ...}, ...]
+
+    未列出的配置项沿用环境变量；数据库默认为 DB_PATH 同目录下的 <name>.db
+    （PostgreSQL 为名为 <name> 的 schema），webhook 的路径和 URL 默认在 WEBHOOK_PATH / WEBHOOK_URL 后加上 /<name>
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    tenants, names, tokens = [], set(), set()
+    for entry in entries:
+        overrides = dict(entry)
+        name = str(overrides.pop("name", ""))
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", name) or name in names:
+            raise ValueError(f"机器人名称无效或重复: {name!r}")
+        defaults = {
+            "DB_PATH": os.path.join(os.path.dirname(base.DB_PATH), f"{name}.db"),
+            "DB_SCHEMA": name,
+            "WEBHOOK_PATH": f"{base.WEBHOOK_PATH.rstrip('/')}/{name}",
+        }
+        if base.WEBHOOK_URL:
+            defaults["WEBHOOK_URL"] = f"{base.WEBHOOK_URL.rstrip('/')}/{name}"
+        tenant_config = base.derive({**defaults, **overrides})
+        tenant_config.validate()
+        if tenant_config.BOT_TOKEN in tokens:
+            raise ValueError(f"机器人 {name} 的 BOT_TOKEN 与其他机器人重复")
+        names.add(name)
+        tokens.add(tenant_config.BOT_TOKEN)
+        tenants.append(Tenant(name, tenant_config))
+    return tenants
+
+
+# 环境变量中的配置，只运行一个机器人时直接使用
+base_config = Config()
+Tenant.default = Tenant("default", base_config)
 
-config = Config()
+# 当前机器人（租户）的配置
+config = TenantLocal(lambda: Tenant.current().config)
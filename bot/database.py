@@ -1,257 +1,687 @@
+import asyncio
+import time
 import aiosqlite
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from typing import Optional
 from bot.config import config
+from bot.export import export_data
+from bot.migrations import migrate
+from bot.utils.forward_cache import ForwardCache
+from bot.utils.read_pool import ReadPool, WRITER_PRAGMAS, apply_pragmas
+from bot.utils.user_cache import UserCache, UserRecord
+from bot.utils.write_queue import WriteQueue, check_connection_internals
+
+# trigram 分词的最短搜索词
+MIN_FTS_TERM = 3
+
+
+def escape_like(term: str) -> str:
+    """LIKE 模式：包含 term（转义字符为反斜杠）"""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def build_search_terms(query: str) -> tuple[Optional[str], list[str]]:
+    """把搜索文本拆成 FTS5 MATCH 表达式（每个词按短语加引号，词之间为 AND）和
+    不足 3 个字、只能按 LIKE 过滤的词的模式"""
+    match, likes = [], []
+    for term in query.split():
+        if len(term) >= MIN_FTS_TERM:
+            match.append('"' + term.replace('"', '""') + '"')
+        else:
+            likes.append(escape_like(term))
+    return " ".join(match) or None, likes
 
 
 class Database:
-    def __init__(self, db_path: str = None):
+    """SQLite 存储（默认后端）：一个写连接（经 WriteQueue 合并提交）加一组只读连接；读方法走只读连接池"""
+
+    def __init__(self, db_path: str = None, read_pool_size: int = None):
         self.db_path = db_path or config.DB_PATH
+        self.read_pool_size = config.DB_READ_POOL_SIZE if read_pool_size is None else read_pool_size
         self.conn: Optional[aiosqlite.Connection] = None
-
-    async def connect(self):
-        self.conn = await aiosqlite.connect(self.db_path)
-        self.conn.row_factory = aiosqlite.Row
-        await self._create_tables()
+        self.writer: Optional[WriteQueue] = None
+        self.reader: Optional[ReadPool] = None
+        self.user_cache = UserCache(
+            max_entries=config.USER_CACHE_MAX_ENTRIES,
+            ttl=config.USER_CACHE_TTL_SECONDS,
+            max_bytes=int(config.USER_CACHE_MAX_MB * 1024 * 1024),
+        )
+        self.forward_cache = ForwardCache(max_entries=config.FORWARD_CACHE_MAX_ENTRIES)
+
+    async def connect(self, writer=None):
+        """writer 为其他进程的写入代理时（分片工作进程）不打开写连接，迁移由那个进程完成"""
+        if writer is None:
+            self.conn = await aiosqlite.connect(self.db_path)
+            self.conn.row_factory = aiosqlite.Row
+            check_connection_internals(self.conn)
+            await apply_pragmas(self.conn, WRITER_PRAGMAS)
+            await migrate(self.conn, config.MIGRATION_BATCH_SIZE)
+            writer = WriteQueue(
+                self.conn,
+                max_batch=config.WRITE_BATCH_SIZE,
+            )
+        # 内存数据库无法跨连接共享，只用写连接
+        if self.read_pool_size > 0 and self.db_path != ":memory:":
+            self.reader = ReadPool(self.db_path, self.read_pool_size)
+            await self.reader.open()
+        self.writer = writer
+        self.writer.start()
+        await self._warm_forward_cache()
 
     async def close(self):
+        if self.writer:
+            await self.writer.close()
+        if self.reader:
+            await self.reader.close()
+            self.reader = None
         if self.conn:
             await self.conn.close()
 
-    async def _create_tables(self):
-        await self.conn.executescript("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                is_banned INTEGER DEFAULT 0,
-                ban_reason TEXT,
-                msg_count INTEGER DEFAULT 0,
-                msg_count_today INTEGER DEFAULT 0,
-                last_msg_date TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                user_msg_id INTEGER,
-                forward_msg_id INTEGER,
-                content_type TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS rate_limits (
-                user_id INTEGER PRIMARY KEY,
-                minute_count INTEGER DEFAULT 0,
-                minute_start TEXT,
-                cooldown_until TEXT
-            );
-
-            CREATE INDEX IF NOT EXISTS idx_messages_forward ON messages(forward_msg_id);
-            CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id);
-        """)
-        await self.conn.commit()
+    async def flush(self):
+        """等待已入队的写操作全部提交"""
+        await self.writer.flush()
+
+    async def export(self, out_dir: str, fmt: str = "jsonl", start: int = None,
+                     end: int = None) -> list[tuple[str, int]]:
+        """导出 users 和 messages（见 bot.export）；读取和压缩在后台线程中进行，不阻塞消息处理"""
+        return await asyncio.to_thread(export_data, self.db_path, out_dir, fmt, start, end)
+
+    async def _fetchall(self, sql: str, params: tuple = ()) -> list[aiosqlite.Row]:
+        """读操作：只读连接上执行，只能看到已提交的写入"""
+        if self.reader:
+            return await self.reader.fetchall(sql, params)
+        cursor = await self.conn.execute(sql, params)
+        return await cursor.fetchall()
+
+    async def _fetchone(self, sql: str, params: tuple = ()) -> Optional[aiosqlite.Row]:
+        rows = await self._fetchall(sql, params)
+        return rows[0] if rows else None
+
+    async def _write(self, sql: str, params: tuple = (), durable: bool = False,
+                     fetch: bool = False):
+        """写操作入队合并提交；durable=True 时等待事务提交并返回 lastrowid（fetch=True 时返回结果行）"""
+        future = self.writer.submit(sql, params, fetch)
+        if durable:
+            return await future
+        future.add_done_callback(_consume_exception)
+        return None
+
+    async def _write_many(self, statements: list[tuple[str, tuple]], durable: bool = False,
+                          fetch: bool = False):
+        """多条写语句在同一事务中原子执行，返回值取自第一条语句"""
+        future = self.writer.submit_many(statements, fetch)
+        if durable:
+            return await future
+        future.add_done_callback(_consume_exception)
+        return None
 
     # ===== 用户相关 =====
 
     async def get_or_create_user(self, user_id: int, username: str = None,
-                                  first_name: str = None, last_name: str = None) -> dict:
-        cursor = await self.conn.execute(
-            "SELECT * FROM users WHERE user_id = ?", (user_id,)
-        )
-        row = await cursor.fetchone()
-
-        if row:
-            # 更新用户信息
-            await self.conn.execute("""
-                UPDATE users SET username = ?, first_name = ?, last_name = ?
-                WHERE user_id = ?
-            """, (username, first_name, last_name, user_id))
-            await self.conn.commit()
-            # 重新获取
-            cursor = await self.conn.execute(
-                "SELECT * FROM users WHERE user_id = ?", (user_id,)
-            )
-            row = await cursor.fetchone()
-        else:
-            await self.conn.execute("""
-                INSERT INTO users (user_id, username, first_name, last_name, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, username, first_name, last_name, datetime.now().isoformat()))
-            await self.conn.commit()
-            cursor = await self.conn.execute(
-                "SELECT * FROM users WHERE user_id = ?", (user_id,)
-            )
-            row = await cursor.fetchone()
-
-        return dict(row)
+                                  first_name: str = None, last_name: str = None) -> UserRecord:
+        user = await self.get_user(user_id)
+        if user and (user.username, user.first_name, user.last_name) == \
+                (username, first_name, last_name):
+            return user
+
+        # 新用户或资料有变化：一次 upsert 写入并取回整行
+        rows = await self._write("""
+            INSERT INTO users (user_id, username, first_name, last_name, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name
+            WHERE users.username IS NOT excluded.username
+               OR users.first_name IS NOT excluded.first_name
+               OR users.last_name IS NOT excluded.last_name
+            RETURNING *
+        """, (user_id, username, first_name, last_name, int(time.time())),
+            durable=True, fetch=True)
+        if rows:
+            user = UserRecord.from_row(rows[0])
+            self.user_cache.put(user)
+            return user
+        # 数据库中的资料已经是新值（只读连接还没看到这次提交，或缓存中是旧值）时 upsert 不返回行，
+        # 改在写连接上读取
+        return await self._reload_user(user_id)
+
+    async def _reload_user(self, user_id: int) -> Optional[UserRecord]:
+        """经写入队列读取用户并更新缓存：能看到所有已提交的写入"""
+        rows = await self._write("SELECT * FROM users WHERE user_id = ?", (user_id,),
+                                 durable=True, fetch=True)
+        if not rows:
+            return None
+        user = UserRecord.from_row(rows[0])
+        self.user_cache.put(user)
+        return user
 
     async def is_user_banned(self, user_id: int) -> bool:
-        cursor = await self.conn.execute(
-            "SELECT is_banned FROM users WHERE user_id = ?", (user_id,)
-        )
-        row = await cursor.fetchone()
-        return bool(row and row["is_banned"])
+        user = await self.get_user(user_id)
+        return bool(user and user.is_banned)
 
     async def ban_user(self, user_id: int, reason: str = None):
-        await self.conn.execute("""
+        await self._write("""
             UPDATE users SET is_banned = 1, ban_reason = ? WHERE user_id = ?
-        """, (reason, user_id))
-        await self.conn.commit()
+        """, (reason, user_id), durable=True)
+        self.user_cache.invalidate(user_id)
 
     async def unban_user(self, user_id: int):
-        await self.conn.execute("""
+        await self._write("""
             UPDATE users SET is_banned = 0, ban_reason = NULL WHERE user_id = ?
-        """, (user_id,))
-        await self.conn.commit()
+        """, (user_id,), durable=True)
+        self.user_cache.invalidate(user_id)
+
+    async def get_user(self, user_id: int) -> Optional[UserRecord]:
+        user = self.user_cache.get(user_id)
+        if user:
+            return user
+        row = await self._fetchone("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        if not row:
+            return None
+        user = UserRecord.from_row(row)
+        self.user_cache.put(user)
+        return user
+
+    async def assign_admin(self, user_id: int, admin_id: int):
+        await self._write(
+            "UPDATE users SET assigned_admin = ? WHERE user_id = ?", (admin_id, user_id)
+        )
+        user = self.user_cache.peek(user_id)
+        if user:
+            user.assigned_admin = admin_id
+
+    async def get_open_conversations(self) -> list[tuple[int, int]]:
+        """已分配管理员、最后一条消息是用户留言（还没有回复）的会话，返回 [(user_id, 管理员)]"""
+        rows = await self._fetchall("""
+            SELECT user_id, assigned_admin FROM users
+            WHERE assigned_admin IS NOT NULL
+              AND (SELECT is_reply FROM messages m WHERE m.user_id = users.user_id
+                   ORDER BY m.id DESC LIMIT 1) = 0
+        """)
+        return [(row["user_id"], row["assigned_admin"]) for row in rows]
+
+    async def get_admin_user_counts(self) -> dict[int, int]:
+        """每个管理员分配到的用户数"""
+        rows = await self._fetchall("""
+            SELECT assigned_admin, COUNT(*) AS n FROM users
+            WHERE assigned_admin IS NOT NULL
+            GROUP BY assigned_admin
+        """)
+        return {row["assigned_admin"]: row["n"] for row in rows}
+
+    async def get_today_msg_count(self, user_id: int) -> int:
+        user = await self.get_user(user_id)
+        if user and user.last_msg_date == date.today().isoformat():
+            return user.msg_count_today
+        return 0
 
-    async def get_user(self, user_id: int) -> Optional[dict]:
-        cursor = await self.conn.execute(
-            "SELECT * FROM users WHERE user_id = ?", (user_id,)
+    async def get_today_msg_counts(self) -> list[tuple[int, int]]:
+        """返回今天发过消息的用户及其今日计数"""
+        rows = await self._fetchall(
+            "SELECT user_id, msg_count_today FROM users WHERE last_msg_date = ?",
+            (date.today().isoformat(),)
         )
-        row = await cursor.fetchone()
-        return dict(row) if row else None
+        return [(row["user_id"], row["msg_count_today"]) for row in rows]
+
+    # ===== 消息相关 =====
 
-    async def increment_msg_count(self, user_id: int):
+    async def save_message(self, user_id: int, user_msg_id: int,
+                           forward_msg_id: int, content_type: str, text: str = None,
+                           durable: bool = False, forward_chat_id: int = None) -> Optional[int]:
+        """保存消息映射和正文并在同一事务中更新用户消息计数；durable=True 时等待提交并返回消息 ID
+
+        forward_chat_id 为转发到的管理员会话
+        """
         today = date.today().isoformat()
-        cursor = await self.conn.execute(
-            "SELECT last_msg_date FROM users WHERE user_id = ?", (user_id,)
+        message_id = await self._write_many(
+            self._message_statements(user_id, user_msg_id, forward_chat_id, forward_msg_id,
+                                     content_type, text, today),
+            durable=durable
         )
-        row = await cursor.fetchone()
 
-        if row and row["last_msg_date"] == today:
-            await self.conn.execute("""
-                UPDATE users SET msg_count = msg_count + 1, msg_count_today = msg_count_today + 1
+        if forward_msg_id is not None:
+            self.forward_cache.put((forward_chat_id, forward_msg_id), user_id)
+        self._count_cached_message(user_id, today)
+        return message_id
+
+    @staticmethod
+    def _message_statements(user_id: int, user_msg_id: int, forward_chat_id: Optional[int],
+                            forward_msg_id: Optional[int], content_type: str, text: Optional[str],
+                            today: str) -> list[tuple[str, tuple]]:
+        """写入一条消息并更新用户计数的语句（第一条为 INSERT messages，触发器同步全文索引）"""
+        return [
+            ("""
+                INSERT INTO messages (user_id, user_msg_id, forward_chat_id, forward_msg_id,
+                                      content_type, text, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, user_msg_id, forward_chat_id, forward_msg_id, content_type, text,
+                  int(time.time()))),
+            ("""
+                UPDATE users SET
+                    msg_count = msg_count + 1,
+                    msg_count_today = CASE WHEN last_msg_date = ? THEN msg_count_today + 1 ELSE 1 END,
+                    last_msg_date = ?,
+                    is_blocked = 0
                 WHERE user_id = ?
-            """, (user_id,))
+            """, (today, today, user_id)),
+        ]
+
+    async def save_reply(self, user_id: int, sent_msg_id: int, content_type: str,
+                         text: str = None):
+        """记录发给用户的管理员回复（不计入留言计数和统计）"""
+        await self._write("""
+            INSERT INTO messages (user_id, user_msg_id, content_type, text, is_reply, created_at)
+            VALUES (?, ?, ?, ?, 1, ?)
+        """, (user_id, sent_msg_id, content_type, text, int(time.time())))
+
+    async def get_user_history(self, user_id: int, limit: int, before: int = None,
+                               after: int = None) -> tuple[list[dict], bool]:
+        """按 id 翻页读取用户的会话（留言和管理员回复），返回按时间正序的一页和该方向是否还有更多
+
+        before/after 为当前页第一条/最后一条的 id，都不传时返回最新的一页。
+        """
+        if after is not None:
+            condition, order, params = "id > ?", "ASC", (user_id, after, limit + 1)
         else:
-            await self.conn.execute("""
-                UPDATE users SET msg_count = msg_count + 1, msg_count_today = 1, last_msg_date = ?
-                WHERE user_id = ?
-            """, (today, user_id))
-        await self.conn.commit()
-
-    async def get_today_msg_count(self, user_id: int) -> int:
-        today = date.today().isoformat()
-        cursor = await self.conn.execute(
-            "SELECT msg_count_today, last_msg_date FROM users WHERE user_id = ?", (user_id,)
+            condition, order = "id < ?", "DESC"
+            params = (user_id, before if before is not None else 2 ** 63 - 1, limit + 1)
+        rows = await self._fetchall(f"""
+            SELECT id, content_type, text, is_reply, created_at FROM messages
+            WHERE user_id = ? AND {condition}
+            ORDER BY id {order}
+            LIMIT ?
+        """, params)
+        rows = [dict(row) for row in rows]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if order == "DESC":
+            rows.reverse()
+        return rows, has_more
+
+    def _count_cached_message(self, user_id: int, today: str):
+        """同步缓存中的计数"""
+        user = self.user_cache.peek(user_id)
+        if user:
+            user.msg_count += 1
+            user.msg_count_today = user.msg_count_today + 1 if user.last_msg_date == today else 1
+            user.last_msg_date = today
+
+    async def _warm_forward_cache(self):
+        """启动时加载最近的消息映射，管理员回复积压的留言时不必逐条查库"""
+        rows = await self._fetchall("""
+            SELECT forward_chat_id, forward_msg_id, user_id FROM messages
+            WHERE forward_msg_id IS NOT NULL
+            ORDER BY id DESC LIMIT ?
+        """, (self.forward_cache.max_entries,))
+        self.forward_cache.load(
+            ((row["forward_chat_id"], row["forward_msg_id"]), row["user_id"]) for row in reversed(rows)
         )
-        row = await cursor.fetchone()
-        if row and row["last_msg_date"] == today:
-            return row["msg_count_today"]
-        return 0
-
-    # ===== 消息相关 =====
-
-    async def save_message(self, user_id: int, user_msg_id: int,
-                           forward_msg_id: int, content_type: str) -> int:
-        cursor = await self.conn.execute("""
-            INSERT INTO messages (user_id, user_msg_id, forward_msg_id, content_type, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, user_msg_id, forward_msg_id, content_type, datetime.now().isoformat()))
-        await self.conn.commit()
-        return cursor.lastrowid
 
-    async def get_message_by_forward_id(self, forward_msg_id: int) -> Optional[dict]:
-        cursor = await self.conn.execute(
-            "SELECT * FROM messages WHERE forward_msg_id = ?", (forward_msg_id,)
+    async def get_user_id_by_forward_id(self, chat_id: int, forward_msg_id: int) -> Optional[int]:
+        """管理员会话中的转发消息对应的用户 ID（先查缓存，未命中时走唯一索引）"""
+        key = (chat_id, forward_msg_id)
+        user_id = self.forward_cache.get(key)
+        if user_id is not None:
+            return user_id
+        row = await self._fetchone(
+            "SELECT user_id FROM messages WHERE forward_chat_id = ? AND forward_msg_id = ?", key
+        )
+        if not row:
+            return None
+        self.forward_cache.put(key, row["user_id"])
+        return row["user_id"]
+
+    async def get_message_by_forward_id(self, chat_id: int, forward_msg_id: int) -> Optional[dict]:
+        row = await self._fetchone(
+            "SELECT * FROM messages WHERE forward_chat_id = ? AND forward_msg_id = ?",
+            (chat_id, forward_msg_id)
         )
-        row = await cursor.fetchone()
         return dict(row) if row else None
 
     async def get_user_message_count(self, user_id: int) -> int:
-        cursor = await self.conn.execute(
-            "SELECT COUNT(*) as count FROM messages WHERE user_id = ?", (user_id,)
-        )
-        row = await cursor.fetchone()
-        return row["count"] if row else 0
+        """用户总留言数（读 users.msg_count 计数列，不扫描 messages 表）"""
+        user = await self.get_user(user_id)
+        return user.msg_count if user else 0
+
+    async def recount_messages(self) -> int:
+        """按 messages 表重新计算所有用户的留言计数（不含管理员回复），返回被修正的用户数"""
+        today = date.today().isoformat()
+        today_start = int(datetime.combine(date.today(), datetime.min.time()).timestamp())
+        rows = await self._write_many([
+            ("""
+                WITH counts AS (
+                    SELECT u.user_id,
+                           (SELECT COUNT(*) FROM messages m
+                            WHERE m.user_id = u.user_id AND m.is_reply = 0) AS total,
+                           (SELECT COUNT(*) FROM messages m
+                            WHERE m.user_id = u.user_id AND m.is_reply = 0
+                              AND m.created_at >= ?) AS today
+                    FROM users u
+                )
+                SELECT counts.* FROM counts JOIN users USING (user_id)
+                WHERE users.msg_count != counts.total
+                   OR (users.last_msg_date = ? AND users.msg_count_today != counts.today)
+                   OR (users.last_msg_date IS NOT ? AND counts.today > 0)
+            """, (today_start, today, today)),
+            ("""
+                UPDATE users SET
+                    msg_count = (SELECT COUNT(*) FROM messages m
+                                 WHERE m.user_id = users.user_id AND m.is_reply = 0),
+                    msg_count_today = (SELECT COUNT(*) FROM messages m
+                                       WHERE m.user_id = users.user_id AND m.is_reply = 0
+                                         AND m.created_at >= ?),
+                    last_msg_date = CASE
+                        WHEN EXISTS (SELECT 1 FROM messages m
+                                     WHERE m.user_id = users.user_id AND m.is_reply = 0
+                                       AND m.created_at >= ?)
+                        THEN ? ELSE last_msg_date END
+            """, (today_start, today_start, today)),
+        ], durable=True, fetch=True)
+        self.user_cache.clear()
+        return len(rows)
 
     # ===== 频率限制 =====
 
-    async def check_rate_limit(self, user_id: int) -> tuple[bool, str]:
-        """返回 (是否允许, 原因)"""
-        now = datetime.now()
-        cursor = await self.conn.execute(
-            "SELECT * FROM rate_limits WHERE user_id = ?", (user_id,)
+    async def get_active_cooldowns(self, now: float) -> list[tuple[int, float]]:
+        """返回尚未结束的冷却 (user_id, 结束时间戳)"""
+        rows = await self._fetchall(
+            "SELECT user_id, cooldown_until FROM rate_limits WHERE cooldown_until > ?", (now,)
         )
-        row = await cursor.fetchone()
-
-        # 检查冷却
-        if row and row["cooldown_until"]:
-            cooldown_until = datetime.fromisoformat(row["cooldown_until"])
-            if now < cooldown_until:
-                remaining = int((cooldown_until - now).total_seconds() / 60) + 1
-                return False, f"发送过于频繁，请 {remaining} 分钟后再试"
-
-        # 检查每日限制
-        today_count = await self.get_today_msg_count(user_id)
-        if today_count >= config.RATE_LIMIT_PER_DAY:
-            return False, "已达到今日消息上限，请明天再试"
-
-        # 检查每分钟限制
-        if row:
-            minute_start = datetime.fromisoformat(row["minute_start"]) if row["minute_start"] else None
-            if minute_start and (now - minute_start).total_seconds() < 60:
-                if row["minute_count"] >= config.RATE_LIMIT_PER_MINUTE:
-                    # 触发冷却
-                    from datetime import timedelta
-                    cooldown_until = now + timedelta(minutes=config.COOLDOWN_MINUTES)
-                    await self.conn.execute("""
-                        UPDATE rate_limits SET cooldown_until = ?, minute_count = 0
-                        WHERE user_id = ?
-                    """, (cooldown_until.isoformat(), user_id))
-                    await self.conn.commit()
-                    return False, f"发送过于频繁，请 {config.COOLDOWN_MINUTES} 分钟后再试"
-                else:
-                    # 增加计数
-                    await self.conn.execute("""
-                        UPDATE rate_limits SET minute_count = minute_count + 1
-                        WHERE user_id = ?
-                    """, (user_id,))
-            else:
-                # 新的一分钟
-                await self.conn.execute("""
-                    UPDATE rate_limits SET minute_count = 1, minute_start = ?, cooldown_until = NULL
-                    WHERE user_id = ?
-                """, (now.isoformat(), user_id))
-        else:
-            # 首次记录
-            await self.conn.execute("""
-                INSERT INTO rate_limits (user_id, minute_count, minute_start)
-                VALUES (?, 1, ?)
-            """, (user_id, now.isoformat()))
+        return [(row["user_id"], row["cooldown_until"]) for row in rows]
+
+    async def save_cooldowns(self, rows: list[tuple[int, float]]):
+        """批量写入冷却状态快照（一个事务，等待提交；失败时抛出异常，由调用方下次重试）"""
+        if not rows:
+            return
+        await self._write_many([("""
+                INSERT INTO rate_limits (user_id, cooldown_until) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET cooldown_until = excluded.cooldown_until
+            """, (user_id, until or None)) for user_id, until in rows], durable=True)
+
+    # ===== 发件箱 =====
+
+    async def add_outbox_item(self, dedup_key: str, kind: str, chat_id: int, method: str,
+                              payload: str, priority: int, user_id: int = None,
+                              user_msg_id: int = None, content_type: str = None,
+                              message_text: str = None) -> Optional[int]:
+        """写入待发送记录并等待落盘；dedup_key 重复时返回 None"""
+        rows = await self._write("""
+            INSERT INTO outbox (dedup_key, kind, chat_id, method, payload, priority,
+                                user_id, user_msg_id, content_type, message_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(dedup_key) DO NOTHING
+            RETURNING id
+        """, (dedup_key, kind, chat_id, method, payload, priority,
+              user_id, user_msg_id, content_type, message_text), durable=True, fetch=True)
+        return rows[0]["id"] if rows else None
+
+    async def mark_outbox_sent(self, item_id: int, sent_msg_id: int):
+        await self._write("""
+            UPDATE outbox SET status = 'sent', sent_msg_id = ?, attempts = attempts + 1
+            WHERE id = ?
+        """, (sent_msg_id, item_id), durable=True)
+
+    async def mark_outbox_retry(self, item_id: int, next_attempt_at: float, error: str):
+        await self._write("""
+            UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+            WHERE id = ?
+        """, (next_attempt_at, error, item_id), durable=True)
+
+    async def mark_outbox_failed(self, item_id: int, error: str):
+        await self._write("""
+            UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ?
+            WHERE id = ?
+        """, (error, item_id), durable=True)
+
+    async def get_due_outbox_items(self, now: float, limit: int = 100,
+                                   shard: int = 0, shards: int = 1) -> list[dict]:
+        """到期的待发送记录；分片时只取 user_id 属于本分片的（没有 user_id 的归 0 号）"""
+        rows = await self._fetchall("""
+            SELECT * FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+              AND (? = 1 OR COALESCE(user_id, 0) % ? = ?)
+            ORDER BY priority, id
+            LIMIT ?
+        """, (now, shards, shards, shard, limit))
+        return [dict(row) for row in rows]
+
+    async def purge_sent_outbox(self, hours: int):
+        """删除超过保留期的已发送记录（保留期内用于去重）"""
+        await self._write("""
+            DELETE FROM outbox
+            WHERE status != 'pending' AND created_at < ?
+        """, (int(time.time()) - hours * 3600,))
+
+    # ===== 摘要 =====
+
+    async def create_digest(self, entries: list[tuple[int, int, str]]) -> int:
+        """把 (user_id, user_msg_id, text) 写入 messages 并记为一份摘要，返回摘要 ID"""
+        today = date.today().isoformat()
+        statements = [("INSERT INTO digests (entry_count, created_at) VALUES (?, ?)",
+                       (len(entries), int(time.time())))]
+        for position, (user_id, user_msg_id, text) in enumerate(entries):
+            insert_message, update_user = self._message_statements(
+                user_id, user_msg_id, None, None, "text", text, today
+            )
+            statements += [
+                insert_message,
+                ("""
+                    INSERT INTO digest_entries (digest_id, position, message_id)
+                    VALUES ((SELECT MAX(id) FROM digests), ?, last_insert_rowid())
+                """, (position,)),
+                update_user,
+            ]
+        # 汇入摘要的留言不再等待重放，与摘要在同一事务中删除
+        statements += self._digest_pending_deletes(entries)
+        digest_id = await self._write_many(statements, durable=True)
+        for user_id, _, _ in entries:
+            self._count_cached_message(user_id, today)
+        return digest_id
+
+    @staticmethod
+    def _digest_pending_deletes(entries: list[tuple[int, int, str]]) -> list[tuple[str, tuple]]:
+        return [("DELETE FROM digest_pending WHERE user_id = ? AND user_msg_id = ?",
+                 (user_id, user_msg_id)) for user_id, user_msg_id, _ in entries]
+
+    async def add_digest_pending(self, user_id: int, user_msg_id: int, message: str) -> bool:
+        """保存等待汇总的留言并等待落盘；同一条留言已保存过时返回 False"""
+        rows = await self._write("""
+            INSERT INTO digest_pending (user_id, user_msg_id, message, created_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+        """, (user_id, user_msg_id, message, int(time.time())), durable=True, fetch=True)
+        return bool(rows)
+
+    async def remove_digest_pending(self, user_id: int, user_msg_id: int):
+        await self._write("DELETE FROM digest_pending WHERE user_id = ? AND user_msg_id = ?",
+                          (user_id, user_msg_id))
+
+    async def get_digest_pending(self, shard: int = 0, shards: int = 1) -> list[dict]:
+        """等待汇总的留言（按到达顺序）；分片时只取 user_id 属于本分片的"""
+        rows = await self._fetchall("""
+            SELECT user_id, user_msg_id, message FROM digest_pending
+            WHERE (? = 1 OR user_id % ? = ?)
+            ORDER BY created_at, user_id, user_msg_id
+        """, (shards, shards, shard))
+        return [dict(row) for row in rows]
+
+    async def get_digest_page(self, digest_id: int, offset: int, limit: int) -> tuple[list[dict], int]:
+        """返回摘要中从 offset 开始的 limit 条及摘要总条数"""
+        digest = await self._fetchone("SELECT entry_count FROM digests WHERE id = ?", (digest_id,))
+        if not digest:
+            return [], 0
+        rows = await self._fetchall("""
+            SELECT e.position, m.text, m.user_id, m.created_at,
+                   u.username, u.first_name, u.last_name
+            FROM digest_entries e
+            JOIN messages m ON m.id = e.message_id
+            LEFT JOIN users u ON u.user_id = m.user_id
+            WHERE e.digest_id = ? AND e.position >= ? AND e.position < ?
+            ORDER BY e.position
+        """, (digest_id, offset, offset + limit))
+        return [dict(row) for row in rows], digest["entry_count"]
+
+    # ===== 群发 =====
+
+    async def create_broadcast(self, method: str, payload: str, status_chat_id: int) -> tuple[int, int]:
+        """创建群发草稿，返回 (群发 ID, 收件人数)"""
+        rows = await self._write("""
+            INSERT INTO broadcasts (method, payload, total, status_chat_id)
+            SELECT ?, ?, COUNT(*), ? FROM users WHERE is_banned = 0 AND is_blocked = 0
+            RETURNING id, total
+        """, (method, payload, status_chat_id), durable=True, fetch=True)
+        return rows[0]["id"], rows[0]["total"]
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        row = await self._fetchone("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        return dict(row) if row else None
 
-        await self.conn.commit()
-        return True, ""
+    async def get_running_broadcasts(self) -> list[dict]:
+        rows = await self._fetchall("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [dict(row) for row in rows]
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str, status_msg_id: int = None):
+        finished_at = int(time.time()) if status in ("done", "cancelled") else None
+        await self._write("""
+            UPDATE broadcasts SET
+                status = ?,
+                status_msg_id = COALESCE(?, status_msg_id),
+                finished_at = COALESCE(?, finished_at)
+            WHERE id = ?
+        """, (status, status_msg_id, finished_at, broadcast_id), durable=True)
+
+    async def get_broadcast_recipients(self, broadcast_id: int, after: int, limit: int) -> list[int]:
+        """user_id 大于 after 的下一批收件人（跳过已拉黑、已屏蔽和已有结果的用户）"""
+        rows = await self._fetchall("""
+            SELECT user_id FROM users
+            WHERE user_id > ? AND is_banned = 0 AND is_blocked = 0
+              AND NOT EXISTS (SELECT 1 FROM broadcast_recipients r
+                              WHERE r.broadcast_id = ? AND r.user_id = users.user_id)
+            ORDER BY user_id
+            LIMIT ?
+        """, (after, broadcast_id, limit))
+        return [row["user_id"] for row in rows]
+
+    async def record_broadcast_result(self, broadcast_id: int, user_id: int, status: str,
+                                      error: str = None):
+        """记录一个收件人的结果（触发器更新群发计数）；屏蔽了机器人的用户同时标记 is_blocked"""
+        statements = [("""
+            INSERT INTO broadcast_recipients (broadcast_id, user_id, status, error)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+        """, (broadcast_id, user_id, status, error))]
+        if status == "blocked":
+            statements.append(("UPDATE users SET is_blocked = 1 WHERE user_id = ?", (user_id,)))
+        await self._write_many(statements)
+
+    async def advance_broadcast(self, broadcast_id: int, cursor: int):
+        """一批收件人全部有结果后推进游标"""
+        await self._write(
+            "UPDATE broadcasts SET cursor = ? WHERE id = ?", (cursor, broadcast_id), durable=True
+        )
+
+    # ===== 搜索 =====
+
+    async def get_last_message_id(self) -> int:
+        row = await self._fetchone("SELECT COALESCE(MAX(id), 0) AS id FROM messages")
+        return row["id"]
+
+    async def search_messages(self, query: str, max_id: int, limit: int,
+                              after: Optional[tuple[float, int]] = None) -> list[dict]:
+        """全文搜索留言，按相关度排序；after 为上一页最后一条的 (rank, id)
+
+        只在 id 不超过 max_id 的最近 SEARCH_MAX_CANDIDATES 条匹配中排序，匹配再多也不会
+        逐条计算相关度；翻页时沿用第一页的 max_id，新消息不会打乱顺序。
+        全部搜索词都不足 3 个字时候选为最近的消息，按时间倒序。
+        """
+        match, likes = build_search_terms(query)
+        if match:
+            candidates = """
+                SELECT rowid AS id, rank FROM messages_fts
+                WHERE messages_fts MATCH ? AND rowid <= ?
+                ORDER BY rowid DESC LIMIT ?
+            """
+            params = [match, max_id, config.SEARCH_MAX_CANDIDATES]
+        else:
+            candidates = "SELECT id, 0.0 AS rank FROM messages WHERE id <= ? ORDER BY id DESC LIMIT ?"
+            params = [max_id, config.SEARCH_MAX_CANDIDATES]
+
+        conditions = ["m.text IS NOT NULL"]
+        conditions += ["m.text LIKE ? ESCAPE '\\'"] * len(likes)
+        params += likes
+        if after:
+            conditions.append("(hits.rank > ? OR (hits.rank = ? AND m.id < ?))")
+            params += [after[0], after[0], after[1]]
+
+        rows = await self._fetchall(f"""
+            SELECT m.id, m.user_id, m.text, m.is_reply, m.created_at, hits.rank,
+                   u.username, u.first_name, u.last_name
+            FROM ({candidates}) AS hits
+            JOIN messages m ON m.id = hits.id
+            LEFT JOIN users u ON u.user_id = m.user_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY hits.rank, m.id DESC
+            LIMIT ?
+        """, (*params, limit))
+        return [dict(row) for row in rows]
 
     # ===== 统计 =====
 
     async def get_stats(self) -> dict:
-        cursor = await self.conn.execute("SELECT COUNT(*) as count FROM users")
-        total_users = (await cursor.fetchone())["count"]
-
-        cursor = await self.conn.execute("SELECT COUNT(*) as count FROM messages")
-        total_messages = (await cursor.fetchone())["count"]
-
-        cursor = await self.conn.execute("SELECT COUNT(*) as count FROM users WHERE is_banned = 1")
-        banned_users = (await cursor.fetchone())["count"]
-
-        today = date.today().isoformat()
-        cursor = await self.conn.execute(
-            "SELECT COUNT(*) as count FROM messages WHERE date(created_at) = ?", (today,)
+        rows = await self._fetchall("SELECT name, value FROM stats_counters")
+        counters = {row["name"]: row["value"] for row in rows}
+
+        today = date.today()
+        row = await self._fetchone(
+            "SELECT COALESCE(SUM(count), 0) AS count FROM message_stats_hourly "
+            "WHERE hour >= ? AND hour < ?",
+            (today.isoformat(), (today + timedelta(days=1)).isoformat())
         )
-        today_messages = (await cursor.fetchone())["count"]
+        today_messages = row["count"]
 
         return {
-            "total_users": total_users,
-            "total_messages": total_messages,
-            "banned_users": banned_users,
+            "total_users": counters.get("total_users", 0),
+            "total_messages": counters.get("total_messages", 0),
+            "banned_users": counters.get("banned_users", 0),
             "today_messages": today_messages,
         }
 
+    async def get_range_stats(self, start: str, end: str, top: int = 10) -> dict:
+        """统计 [start, end) 时间段的留言，start/end 为本地时间的 "YYYY-MM-DD" 或 "YYYY-MM-DDTHH"
+
+        只读取汇总表：按小时的消息类型分布、按天的用户留言数排行（排行按整天计算）。
+        """
+        end_day = end[:10]
+        if end[11:13] not in ("", "00"):
+            end_day = (date.fromisoformat(end_day) + timedelta(days=1)).isoformat()
+        rows = await self._fetchall("""
+            SELECT content_type, SUM(count) AS count FROM message_stats_hourly
+            WHERE hour >= ? AND hour < ?
+            GROUP BY content_type ORDER BY count DESC
+        """, (start[:13], end[:13]))
+        by_type = {row["content_type"]: row["count"] for row in rows}
+
+        rows = await self._fetchall("""
+            SELECT s.user_id, SUM(s.count) AS count, u.username, u.first_name, u.last_name
+            FROM user_stats_daily s LEFT JOIN users u ON u.user_id = s.user_id
+            WHERE s.day >= ? AND s.day < ?
+            GROUP BY s.user_id, u.username, u.first_name, u.last_name
+            ORDER BY count DESC LIMIT ?
+        """, (start[:10], end_day, top))
+        top_senders = [dict(row) for row in rows]
+
+        return {
+            "total": sum(by_type.values()),
+            "by_type": by_type,
+            "top_senders": top_senders,
+        }
+
+
+def _consume_exception(future):
+    """不等待结果的写操作：取出异常避免 "never retrieved" 警告（失败已由队列记录日志）"""
+    if not future.cancelled():
+        future.exception()
 
-# 全局数据库实例
-db = Database()
@@ -0,0 +1,130 @@
+"""导出用户和消息数据
+
+按游标每次读取 EXPORT_CHUNK_ROWS 行并写入 gzip 压缩的 JSONL 或 CSV 文件，内存占用与表大小无关。
+两张表在同一个读事务中导出，数据是同一时刻的快照。
+
+管理员命令 /export 在后台线程中导出后以文件发送；也可以直接执行:
+python -m bot.export [--format jsonl|csv] [--since 2026-10-01] [--until 2026-11-01] [--db 数据库路径] [输出目录]
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Iterable, Optional, Sequence
+
+from bot.config import config
+
+FORMATS = ("jsonl", "csv")
+
+# 表名 → (列, 全量导出的排序, 按时间范围导出的排序)；排序都与表或索引的顺序一致，不需要临时排序
+EXPORT_TABLES = {
+    "users": ("user_id, username, first_name, last_name, is_banned, ban_reason, "
+              "msg_count, created_at", "user_id", "user_id"),
+    # 按时间范围时走 idx_messages_created（rowid 隐含在索引末尾）
+    "messages": ("id, user_id, user_msg_id, forward_msg_id, content_type, is_reply, text, "
+                 "created_at", "id", "created_at, id"),
+}
+
+
+def export_query(table: str, start: Optional[int], end: Optional[int]) -> tuple[str, tuple]:
+    """导出一张表的查询和参数（? 占位符）"""
+    columns, order, range_order = EXPORT_TABLES[table]
+    if start is None and end is None:
+        return f"SELECT {columns} FROM {table} ORDER BY {order}", ()
+    return (
+        f"SELECT {columns} FROM {table} WHERE created_at >= ? AND created_at < ? "
+        f"ORDER BY {range_order}",
+        (start if start is not None else 0, end if end is not None else 2 ** 62),
+    )
+
+
+def _local_time(timestamp: Optional[int]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+class ExportFile:
+    """gzip 压缩的 JSONL/CSV 导出文件，逐块写入；created_at 后附加一列本地时间 created_time"""
+
+    def __init__(self, path: str, fmt: str, columns: list[str]):
+        self.columns = columns + ["created_time"]
+        self.time_index = columns.index("created_at")
+        self.rows = 0
+        self._out = gzip.open(path, "wt", compresslevel=6, encoding="utf-8", newline="")
+        self._csv = csv.writer(self._out) if fmt == "csv" else None
+        if self._csv:
+            self._csv.writerow(self.columns)
+
+    def write(self, chunk: Iterable[Sequence]):
+        chunk = [tuple(row) + (_local_time(row[self.time_index]),) for row in chunk]
+        if self._csv:
+            self._csv.writerows(chunk)
+        else:
+            self._out.writelines(
+                json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + "\n" for row in chunk
+            )
+        self.rows += len(chunk)
+
+    def close(self):
+        self._out.close()
+
+    def __enter__(self) -> "ExportFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def export_table(conn: sqlite3.Connection, table: str, path: str, fmt: str = "jsonl",
+                 start: int = None, end: int = None) -> int:
+    """把一张表写入 gzip 文件，返回行数"""
+    sql, params = export_query(table, start, end)
+    cursor = conn.execute(sql, params)
+    with ExportFile(path, fmt, [column[0] for column in cursor.description]) as out:
+        while True:
+            chunk = cursor.fetchmany(config.EXPORT_CHUNK_ROWS)
+            if not chunk:
+                break
+            out.write(chunk)
+    return out.rows
+
+
+def export_path(out_dir: str, table: str, fmt: str, stamp: str) -> str:
+    return os.path.join(out_dir, f"{table}-{stamp}.{fmt}.gz")
+
+
+def export_data(db_path: str, out_dir: str, fmt: str = "jsonl", start: int = None,
+                end: int = None) -> list[tuple[str, int]]:
+    """导出 users 和 messages 到 out_dir，返回 [(文件路径, 行数)]；start/end 为时间戳，左闭右开"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的格式: {fmt}")
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        conn.execute("BEGIN")
+        results = []
+        for table in EXPORT_TABLES:
+            path = export_path(out_dir, table, fmt, stamp)
+            results.append((path, export_table(conn, table, path, fmt, start, end)))
+        return results
+    finally:
+        conn.close()
+
+
+def _parse_date(value: str) -> int:
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出用户和消息（gzip 压缩）")
+    parser.add_argument("out_dir", nargs="?", default=".", help="输出目录")
+    parser.add_argument("--db", default=config.DB_PATH, help="数据库路径")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--since", type=_parse_date, help="开始时间（含），如 2026-10-01")
+    parser.add_argument("--until", type=_parse_date, help="结束时间（不含），如 2026-11-01")
+    args = parser.parse_args()
+    for path, rows in export_data(args.db, args.out_dir, args.format, args.since, args.until):
+        print(f"{path}: {rows} 行，{os.path.getsize(path) / 1024:.1f} KB")
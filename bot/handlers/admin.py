@@ -1,10 +1,24 @@
-from datetime import datetime
+import html
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import Optional
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
 
 from bot.config import config
-from bot.database import db
+from bot.storage import db
+from bot.export import FORMATS
+from bot.utils.outbox import outbox, is_retryable, KIND_REPLY
+from bot.utils.digest import build_digest_page
+from bot.utils.spam_filter import spam_snapshot
+from bot.utils.broadcast import broadcaster, format_progress
+from bot.utils.admin_router import admin_router
+from bot.utils.send_scheduler import scheduler, PRIORITY_REPLY, PRIORITY_FORWARD
+from bot.shards import current_shard
 
 # 会话状态
 WAITING_REPLY = 1
@@ -12,7 +26,15 @@ WAITING_REPLY = 1
 
 def is_admin(user_id: int) -> bool:
     """检查是否是管理员"""
-    return user_id == config.ADMIN_ID
+    return user_id in config.ADMIN_IDS
+
+
+def shard_note(what: str) -> str:
+    """分片时注明 what 只统计了本进程（不分片时为空）"""
+    shard, shards = current_shard()
+    if shards == 1:
+        return ""
+    return f"\n🧩 以上{what}只含 {shard} 号分片（共 {shards} 个）"
 
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -29,6 +51,21 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     parts = data.split("_", 1)
     action = parts[0]
+    if action == "digest":
+        digest_id, page = map(int, parts[1].split("_"))
+        await handle_digest_page(query, digest_id, page)
+        return
+    if action == "broadcast":
+        operation, broadcast_id = parts[1].split("_")
+        await handle_broadcast_button(query, operation, int(broadcast_id))
+        return
+    if action == "history":
+        await handle_history_callback(query, parts[1])
+        return
+    if action == "search":
+        search_id, page, rank, last_id = parts[1].split("_")
+        await handle_search_page(query, context, int(search_id), int(page), (float(rank), int(last_id)))
+        return
     target_user_id = int(parts[1]) if len(parts) > 1 else None
 
     if action == "reply":
@@ -43,6 +80,61 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_cancel_reply(query, context)
 
 
+async def handle_digest_page(query, digest_id: int, page: int):
+    """摘要翻页：原地编辑消息"""
+    result = await build_digest_page(digest_id, page)
+    if not result:
+        await query.message.reply_text("❌ 摘要不存在")
+        return
+    text, keyboard = result
+    await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+async def handle_search_page(query, context: ContextTypes.DEFAULT_TYPE, search_id: int,
+                             page: int, after: tuple[float, int]):
+    """搜索结果翻页：从上一页最后一条之后继续，原地编辑消息"""
+    search = context.user_data.get("searches", {}).get(search_id)
+    if not search:
+        await query.message.reply_text("❌ 搜索已过期，请重新 /search")
+        return
+    text, keyboard = await build_search_page(search_id, search[0], search[1], page, after)
+    await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+async def handle_broadcast_button(query, operation: str, broadcast_id: int):
+    """群发草稿的确认/取消按钮和发送中的停止按钮"""
+    job = await db.get_broadcast(broadcast_id)
+    if not job or job["status"] in ("done", "cancelled"):
+        await query.edit_message_reply_markup(reply_markup=None)
+        return
+    if operation == "start" and job["status"] == "draft":
+        await db.set_broadcast_status(broadcast_id, "running", query.message.message_id)
+        job["status"] = "running"
+        text, keyboard = format_progress(job)
+        await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+        broadcaster.launch(broadcast_id)
+    elif operation == "cancel":
+        if await broadcaster.cancel(broadcast_id):
+            return
+        job = await db.get_broadcast(broadcast_id)
+        text, keyboard = format_progress(job)
+        await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+async def handle_history_callback(query, data: str):
+    """“📜 历史”按钮发送会话第一页；翻页按钮（history_<用户>_older|newer_<id>）原地编辑"""
+    if "_" not in data:
+        text, keyboard = await build_history_page(int(data))
+        await query.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+        return
+    user_id, direction, message_id = data.split("_")
+    if direction == "older":
+        text, keyboard = await build_history_page(int(user_id), before=int(message_id))
+    else:
+        text, keyboard = await build_history_page(int(user_id), after=int(message_id))
+    await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
 async def handle_reply_button(query, context: ContextTypes.DEFAULT_TYPE, target_user_id: int):
     """处理回复按钮"""
     # 保存目标用户 ID 到 context
@@ -52,7 +144,7 @@ async def handle_reply_button(query, context: ContextTypes.DEFAULT_TYPE, target_
     # 获取用户信息
     user_info = await db.get_user(target_user_id)
     if user_info:
-        name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() or "未知"
+        name = user_info.display_name or "未知"
     else:
         name = "未知用户"
 
@@ -74,14 +166,14 @@ async def handle_ban_button(query, context: ContextTypes.DEFAULT_TYPE, target_us
         await query.message.reply_text("❌ 用户不存在")
         return
 
-    if user_info.get("is_banned"):
+    if user_info.is_banned:
         await query.message.reply_text("⚠️ 该用户已被拉黑")
         return
 
     # 拉黑用户
     await db.ban_user(target_user_id, "管理员手动拉黑")
 
-    name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() or "未知"
+    name = user_info.display_name or "未知"
 
     keyboard = [[InlineKeyboardButton("✅ 解除拉黑", callback_data=f"unban_{target_user_id}")]]
 
@@ -100,13 +192,13 @@ async def handle_unban_button(query, context: ContextTypes.DEFAULT_TYPE, target_
         await query.message.reply_text("❌ 用户不存在")
         return
 
-    if not user_info.get("is_banned"):
+    if not user_info.is_banned:
         await query.message.reply_text("⚠️ 该用户未被拉黑")
         return
 
     await db.unban_user(target_user_id)
 
-    name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() or "未知"
+    name = user_info.display_name or "未知"
 
     await query.message.reply_text(
         f"✅ 已解除拉黑用户 <b>{name}</b> (ID: <code>{target_user_id}</code>)",
@@ -125,12 +217,13 @@ async def handle_info_button(query, context: ContextTypes.DEFAULT_TYPE, target_u
     msg_count = await db.get_user_message_count(target_user_id)
     today_count = await db.get_today_msg_count(target_user_id)
 
-    name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() or "未知"
-    username = user_info.get('username')
+    name = user_info.display_name or "未知"
+    username = user_info.username
     username_display = f"@{username}" if username else "无"
-    banned_status = "🚫 已拉黑" if user_info.get("is_banned") else "✅ 正常"
-    ban_reason = user_info.get("ban_reason") or "无"
-    created_at = user_info.get("created_at", "未知")
+    banned_status = "🚫 已拉黑" if user_info.is_banned else "✅ 正常"
+    ban_reason = user_info.ban_reason or "无"
+    created_at = datetime.fromtimestamp(user_info.created_at).strftime("%Y-%m-%d %H:%M") \
+        if user_info.created_at else "未知"
 
     # 生成私聊链接
     if username:
@@ -151,11 +244,11 @@ async def handle_info_button(query, context: ContextTypes.DEFAULT_TYPE, target_u
 ━━━━━━━━━━━━━━
 📌 状态: {banned_status}"""
 
-    if user_info.get("is_banned"):
+    if user_info.is_banned:
         info_text += f"\n📝 拉黑原因: {ban_reason}"
 
     # 根据状态显示不同按钮
-    if user_info.get("is_banned"):
+    if user_info.is_banned:
         keyboard = [[InlineKeyboardButton("✅ 解除拉黑", callback_data=f"unban_{target_user_id}")]]
     else:
         keyboard = [
@@ -164,6 +257,7 @@ async def handle_info_button(query, context: ContextTypes.DEFAULT_TYPE, target_u
                 InlineKeyboardButton("🚫 拉黑", callback_data=f"ban_{target_user_id}"),
             ]
         ]
+    keyboard.append([InlineKeyboardButton("📜 历史", callback_data=f"history_{target_user_id}")])
 
     await query.message.reply_text(
         info_text,
@@ -190,23 +284,31 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # 检查是否在回复模式
     reply_to_user = context.user_data.get("reply_to_user")
+    # 发件箱去重键：同一条管理员消息只发送一次
+    reply_key = f"{KIND_REPLY}:{message.chat_id}:{message.message_id}"
 
     if reply_to_user:
         # 发送回复给用户
         try:
             if message.text:
-                await context.bot.send_message(
+                await outbox.deliver(
+                    reply_key, KIND_REPLY, "send_message",
+                    user_id=reply_to_user, content_type="text", message_text=message.text,
                     chat_id=reply_to_user,
                     text=f"📩 收到回复：\n\n{message.text}"
                 )
             elif message.photo:
-                await context.bot.send_photo(
+                await outbox.deliver(
+                    reply_key, KIND_REPLY, "send_photo",
+                    user_id=reply_to_user, content_type="photo", message_text=message.caption,
                     chat_id=reply_to_user,
                     photo=message.photo[-1].file_id,
                     caption=f"📩 收到回复：\n\n{message.caption or ''}"
                 )
             elif message.video:
-                await context.bot.send_video(
+                await outbox.deliver(
+                    reply_key, KIND_REPLY, "send_video",
+                    user_id=reply_to_user, content_type="video", message_text=message.caption,
                     chat_id=reply_to_user,
                     video=message.video.file_id,
                     caption=f"📩 收到回复：\n\n{message.caption or ''}"
@@ -218,30 +320,34 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
             # 清除回复状态
             context.user_data.pop("reply_to_user", None)
             context.user_data.pop("reply_info_msg_id", None)
+            admin_router.resolve(reply_to_user)
 
             await message.reply_text("✅ 回复已发送")
 
         except Exception as e:
-            await message.reply_text(f"❌ 发送失败：{e}")
+            await message.reply_text(f"❌ 发送失败：{e}" + ("（稍后自动重试）" if is_retryable(e) else ""))
 
     # 如果是回复转发的消息
     elif message.reply_to_message:
         # 尝试通过回复的消息找到原用户
         reply_msg_id = message.reply_to_message.message_id
 
-        # 查找消息映射
-        msg_record = await db.get_message_by_forward_id(reply_msg_id)
+        # 查找消息映射（消息 ID 只在当前管理员的会话内唯一）
+        target_user_id = await db.get_user_id_by_forward_id(message.chat_id, reply_msg_id)
 
-        if msg_record:
-            target_user_id = msg_record["user_id"]
+        if target_user_id:
             try:
                 if message.text:
-                    await context.bot.send_message(
+                    await outbox.deliver(
+                        reply_key, KIND_REPLY, "send_message",
+                        user_id=target_user_id, content_type="text", message_text=message.text,
                         chat_id=target_user_id,
                         text=f"📩 收到回复：\n\n{message.text}"
                     )
                 elif message.photo:
-                    await context.bot.send_photo(
+                    await outbox.deliver(
+                        reply_key, KIND_REPLY, "send_photo",
+                        user_id=target_user_id, content_type="photo", message_text=message.caption,
                         chat_id=target_user_id,
                         photo=message.photo[-1].file_id,
                         caption=f"📩 收到回复：\n\n{message.caption or ''}"
@@ -250,10 +356,11 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     await message.reply_text("❌ 暂不支持此类型的回复")
                     return
 
+                admin_router.resolve(target_user_id)
                 await message.reply_text("✅ 回复已发送")
 
             except Exception as e:
-                await message.reply_text(f"❌ 发送失败：{e}")
+                await message.reply_text(f"❌ 发送失败：{e}" + ("（稍后自动重试）" if is_retryable(e) else ""))
 
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -262,7 +369,12 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(user.id):
         return
 
+    if context.args:
+        await range_stats_command(update, context)
+        return
+
     stats = await db.get_stats()
+    spam = await spam_snapshot()
 
     text = f"""📊 <b>统计信息</b>
 ━━━━━━━━━━━━━━
@@ -271,11 +383,349 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📅 今日留言: {stats['today_messages']}
 🚫 已拉黑用户: {stats['banned_users']}
 ━━━━━━━━━━━━━━
+🧠 用户缓存: {len(db.user_cache)} 条 / {db.user_cache.bytes / 1048576:.1f} MB，命中率 {db.user_cache.hit_rate:.1%}
+↩️ 回复路由缓存: {len(db.forward_cache)} 条，命中 {db.forward_cache.hits} / 未命中 {db.forward_cache.misses}
+📤 发送队列: {scheduler.queue_depth} 条待发（回复 {scheduler.pending[PRIORITY_REPLY]} / 转发 {scheduler.pending[PRIORITY_FORWARD]}）
+📮 已发送 {scheduler.sent} / 失败 {scheduler.failed} / 限流重试 {scheduler.retry_after_hits}
+📦 发件箱处理中: {outbox.inflight} 条{shard_note("缓存和发送计数")}
+🛡 刷屏检测: 已检查 {spam['checked']} / 拦截 {spam['flagged']}，指纹 {spam['fingerprints']} 条
+━━━━━━━━━━━━━━
 ⏰ 统计时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
 
     await update.message.reply_text(text, parse_mode=ParseMode.HTML)
 
 
+def parse_stats_range(arg: str) -> Optional[tuple[str, str, str]]:
+    """解析 /stats 的时间范围参数，返回 (开始, 结束, 标题)；开始和结束为本地时间前缀，左闭右开
+
+    支持: 7d（近 7 天）、24h（近 24 小时）、2026-10（整月）、2026-10-05（单日）
+    """
+    now = datetime.now()
+    today = now.date()
+    try:
+        if arg.endswith("d") and arg[:-1].isdigit():
+            days = int(arg[:-1])
+            start = today - timedelta(days=days - 1)
+            return start.isoformat(), (today + timedelta(days=1)).isoformat(), f"近 {days} 天"
+        if arg.endswith("h") and arg[:-1].isdigit():
+            hours = int(arg[:-1])
+            end = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            start = end - timedelta(hours=hours)
+            return start.strftime("%Y-%m-%dT%H"), end.strftime("%Y-%m-%dT%H"), f"近 {hours} 小时"
+        if len(arg) == 7:
+            month = date.fromisoformat(arg + "-01")
+            next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return month.isoformat(), next_month.isoformat(), arg
+        if len(arg) == 10:
+            day = date.fromisoformat(arg)
+            return day.isoformat(), (day + timedelta(days=1)).isoformat(), arg
+    except ValueError:
+        pass
+    return None
+
+
+async def range_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """按时间范围查看统计：/stats 7d、/stats 2026-10"""
+    parsed = parse_stats_range(context.args[0])
+    if not parsed:
+        await update.message.reply_text("用法: /stats [7d | 24h | 2026-10 | 2026-10-05]")
+        return
+    start, end, label = parsed
+
+    stats = await db.get_range_stats(start, end)
+
+    text = f"""📊 <b>统计信息 · {label}</b>
+━━━━━━━━━━━━━━
+💬 留言数: {stats['total']}"""
+
+    if stats["by_type"]:
+        text += "\n━━━━━━━━━━━━━━\n📂 <b>消息类型</b>"
+        for content_type, count in stats["by_type"].items():
+            text += f"\n• {content_type}: {count}"
+
+    if stats["top_senders"]:
+        text += "\n━━━━━━━━━━━━━━\n🏆 <b>留言最多的用户</b>"
+        for i, sender in enumerate(stats["top_senders"], 1):
+            name = f"{sender['first_name'] or ''} {sender['last_name'] or ''}".strip() \
+                or sender["username"] or "未知"
+            text += f"\n{i}. {html.escape(name)} (<code>{sender['user_id']}</code>): {sender['count']}"
+
+    text += "\n━━━━━━━━━━━━━━"
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
+
+async def recount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """按消息记录重新计算用户留言计数"""
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+
+    await update.message.reply_text("⏳ 正在重新统计留言数...")
+    fixed = await db.recount_messages()
+    await update.message.reply_text(f"✅ 统计完成，修正了 {fixed} 个用户的计数")
+
+
+async def spam_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """查看最近被刷屏检测隔离的消息"""
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+
+    spam = await spam_snapshot()
+    if not spam["enabled"]:
+        await update.message.reply_text("刷屏检测未开启（SPAM_MIN_USERS=0）")
+        return
+    if not spam["quarantined"]:
+        await update.message.reply_text(f"✅ 暂无隔离消息（已拦截 {spam['flagged']} 条）")
+        return
+
+    lines = [f"🛡 <b>最近隔离的消息</b>（共拦截 {spam['flagged']} 条）", "━━━━━━━━━━━━━━"]
+    keyboard = []
+    user_ids = []
+    # 只显示最近 15 条，避免超过单条消息长度上限
+    for flagged_at, user_id, name, preview in spam["quarantined"][:-16:-1]:
+        sent_at = datetime.fromtimestamp(flagged_at).strftime("%m-%d %H:%M")
+        lines.append(f"👤 {html.escape(name)} (<code>{user_id}</code>) · {sent_at}")
+        lines.append(f"💬「{html.escape(preview)}」")
+        if user_id not in user_ids and len(user_ids) < 10:
+            user_ids.append(user_id)
+            keyboard.append([
+                InlineKeyboardButton(f"👤 {name[:16]}", callback_data=f"info_{user_id}"),
+                InlineKeyboardButton("🚫 拉黑", callback_data=f"ban_{user_id}"),
+            ])
+
+    await update.message.reply_text(
+        "\n".join(lines),
+        parse_mode=ParseMode.HTML,
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+# 会话历史中每条消息最多显示的字数
+HISTORY_TEXT_LIMIT = 200
+
+
+async def admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """查看各管理员分配到的用户数和未回复会话数"""
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+
+    user_counts = await db.get_admin_user_counts()
+    text = f"""👮 <b>管理员</b>（分配方式: {admin_router.strategy}）
+━━━━━━━━━━━━━━"""
+    for admin_id in admin_router.admins:
+        me = "（我）" if admin_id == user.id else ""
+        text += (f"\n• <code>{admin_id}</code>{me}: 用户 {user_counts.get(admin_id, 0)}，"
+                 f"未回复 {admin_router.outstanding[admin_id]}")
+    text += shard_note("未回复数")
+    removed = sum(count for admin_id, count in user_counts.items() if admin_id not in admin_router.admins)
+    if removed:
+        text += f"\n• 已移除管理员的用户: {removed}（下次留言时重新分配）"
+    text += "\n━━━━━━━━━━━━━━"
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
+
+async def build_history_page(user_id: int, before: int = None,
+                             after: int = None) -> tuple[str, InlineKeyboardMarkup]:
+    """生成用户会话的一页（按时间正序），上一页/下一页按当前页首尾消息的 id 翻页"""
+    messages, has_more = await db.get_user_history(
+        user_id, config.HISTORY_PAGE_SIZE, before=before, after=after
+    )
+    # 从某一页翻过来时，来的方向一定还有消息
+    has_older = has_more if after is None else True
+    has_newer = has_more if after is not None else before is not None
+
+    user_info = await db.get_user(user_id)
+    name = (user_info.display_name if user_info else None) or "未知用户"
+    lines = [f"📜 <b>{html.escape(name)}</b> (<code>{user_id}</code>) 的会话", "━━━━━━━━━━━━━━"]
+    if not messages:
+        lines.append("暂无消息记录")
+    for message in messages:
+        sent_at = datetime.fromtimestamp(message["created_at"]).strftime("%m-%d %H:%M")
+        sender = "↩️ 管理员" if message["is_reply"] else "👤 用户"
+        text = message["text"] or ""
+        if len(text) > HISTORY_TEXT_LIMIT:
+            text = text[:HISTORY_TEXT_LIMIT] + "…"
+        if message["content_type"] not in ("text", None):
+            text = f"[{message['content_type']}] {text}".rstrip()
+        lines.append(f"<b>{sender}</b> · {sent_at}")
+        lines.append(html.escape(text) or "（无文字）")
+        lines.append("")
+
+    nav = []
+    if messages and has_older:
+        nav.append(InlineKeyboardButton(
+            "◀️ 更早", callback_data=f"history_{user_id}_older_{messages[0]['id']}"
+        ))
+    if messages and has_newer:
+        nav.append(InlineKeyboardButton(
+            "较新 ▶️", callback_data=f"history_{user_id}_newer_{messages[-1]['id']}"
+        ))
+    keyboard = [nav] if nav else []
+    keyboard.append([
+        InlineKeyboardButton("💬 回复", callback_data=f"reply_{user_id}"),
+        InlineKeyboardButton("👤 详情", callback_data=f"info_{user_id}"),
+    ])
+    return "\n".join(lines).rstrip(), InlineKeyboardMarkup(keyboard)
+
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """查看用户的会话历史：/history <用户ID>"""
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+
+    if not context.args:
+        await update.message.reply_text("用法: /history <用户ID>")
+        return
+
+    try:
+        target_user_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ 无效的用户 ID")
+        return
+
+    text, keyboard = await build_history_page(target_user_id)
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+def search_excerpt(text: str, query: str, width: int = 40) -> str:
+    """截取第一个搜索词附近的文字并加粗（返回 HTML）"""
+    lower = text.lower()
+    for term in query.split():
+        pos = lower.find(term.lower())
+        if pos >= 0:
+            start = max(0, pos - width)
+            end = min(len(text), pos + len(term) + width)
+            return (("…" if start else "") + html.escape(text[start:pos])
+                    + f"<b>{html.escape(text[pos:pos + len(term)])}</b>"
+                    + html.escape(text[pos + len(term):end]) + ("…" if end < len(text) else ""))
+    return html.escape(text[:width * 2]) + ("…" if len(text) > width * 2 else "")
+
+
+async def build_search_page(search_id: int, query: str, max_id: int, page: int,
+                            after: Optional[tuple[float, int]] = None) -> tuple[str, InlineKeyboardMarkup]:
+    """生成一页搜索结果，每条结果一个查看用户详情的按钮，按上一页最后一条翻页"""
+    page_size = config.SEARCH_PAGE_SIZE
+    results = await db.search_messages(query, max_id, page_size + 1, after)
+    has_more = len(results) > page_size
+    results = results[:page_size]
+
+    if not results:
+        return f"🔍 没有找到「{html.escape(query)}」相关的留言", InlineKeyboardMarkup([])
+
+    lines = [f"🔍 <b>搜索「{html.escape(query)}」</b>（第 {page + 1} 页）", "━━━━━━━━━━━━━━"]
+    buttons = []
+    for i, row in enumerate(results, page * page_size + 1):
+        name = f"{row['first_name'] or ''} {row['last_name'] or ''}".strip() or "未知用户"
+        username = f" @{row['username']}" if row["username"] else ""
+        sent_at = datetime.fromtimestamp(row["created_at"]).strftime("%Y-%m-%d %H:%M")
+        sender = "↩️ 回复" if row["is_reply"] else "👤"
+        lines.append(f"<b>{i}.</b> {sender} {html.escape(name)}{html.escape(username)} · {sent_at}")
+        lines.append(f"💬 {search_excerpt(row['text'], query)}")
+        lines.append("")
+        buttons.append(InlineKeyboardButton(f"👤 {i}", callback_data=f"info_{row['user_id']}"))
+
+    keyboard = [buttons]
+    if has_more:
+        last = results[-1]
+        keyboard.append([InlineKeyboardButton(
+            "下一页 ▶️", callback_data=f"search_{search_id}_{page + 1}_{last['rank']!r}_{last['id']}"
+        )])
+    return "\n".join(lines).rstrip(), InlineKeyboardMarkup(keyboard)
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """全文搜索留言：/search 关键词"""
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+
+    query = " ".join(context.args).strip()
+    if not query:
+        await update.message.reply_text("用法: /search <关键词>（多个关键词用空格分隔，需同时包含）")
+        return
+
+    # 翻页需要的搜索条件保存在会话中，按钮里只放编号；只保留最近 20 次搜索
+    searches = context.user_data.setdefault("searches", {})
+    search_id = max(searches, default=0) + 1
+    max_id = await db.get_last_message_id()
+    searches[search_id] = (query, max_id)
+    for old in sorted(searches)[:-20]:
+        del searches[old]
+
+    text, keyboard = await build_search_page(search_id, query, max_id, 0)
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """群发：/broadcast 文字，或回复一条消息发送 /broadcast 群发该消息（确认后开始）"""
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+
+    message = update.message
+    if message.reply_to_message:
+        # 任意类型的消息都用 copy_message 原样发送
+        method = "copy_message"
+        payload = {"from_chat_id": message.chat_id, "message_id": message.reply_to_message.message_id}
+    elif context.args:
+        method = "send_message"
+        payload = {"text": message.text.split(None, 1)[1]}
+    else:
+        await message.reply_text("用法: /broadcast <内容>，或回复一条消息发送 /broadcast")
+        return
+
+    broadcast_id, total = await db.create_broadcast(method, json.dumps(payload, ensure_ascii=False),
+                                                   message.chat_id)
+    job = await db.get_broadcast(broadcast_id)
+    text, keyboard = format_progress(job)
+    await message.reply_text(
+        text + f"\n\n将发送给 {total} 个用户（不含已拉黑和已屏蔽机器人的用户），确认开始？",
+        parse_mode=ParseMode.HTML,
+        reply_markup=keyboard
+    )
+
+
+# Bot API 上传文件的大小上限
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """导出用户和消息：/export [jsonl|csv] [7d | 24h | 2026-10 | 2026-10-05]"""
+    user = update.effective_user
+    if not is_admin(user.id):
+        return
+
+    fmt, start, end = "jsonl", None, None
+    for arg in context.args:
+        if arg in FORMATS:
+            fmt = arg
+            continue
+        parsed = parse_stats_range(arg)
+        if not parsed:
+            await update.message.reply_text(
+                "用法: /export [jsonl|csv] [7d | 24h | 2026-10 | 2026-10-05]"
+            )
+            return
+        start = int(datetime.fromisoformat(parsed[0]).timestamp())
+        end = int(datetime.fromisoformat(parsed[1]).timestamp())
+
+    await update.message.reply_text("⏳ 正在导出...")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = await db.export(tmp, fmt, start, end)
+        for path, rows in results:
+            name = os.path.basename(path)
+            if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+                await update.message.reply_text(
+                    f"❌ {name} 超过 50MB，请缩小时间范围或在服务器上执行 python -m bot.export"
+                )
+                continue
+            with open(path, "rb") as f:
+                await update.message.reply_document(f, filename=name, caption=f"{rows} 行")
+
+
 async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """拉黑用户命令"""
     user = update.effective_user
@@ -301,7 +751,7 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await db.ban_user(target_user_id, reason)
 
-    name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() or "未知"
+    name = user_info.display_name or "未知"
 
     keyboard = [[InlineKeyboardButton("✅ 解除拉黑", callback_data=f"unban_{target_user_id}")]]
 
@@ -335,7 +785,7 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await db.unban_user(target_user_id)
 
-    name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}".strip() or "未知"
+    name = user_info.display_name or "未知"
 
     await update.message.reply_text(
         f"✅ 已解除拉黑用户 <b>{name}</b> (ID: <code>{target_user_id}</code>)",
@@ -1,16 +1,66 @@
+import json
+import logging
+import time
 from datetime import datetime, timezone, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, User, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Message
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 
 from bot.config import config
-from bot.database import db
+from bot.storage import db
+from bot.utils.rate_limiter import rate_limiter
+from bot.utils.outbox import outbox, KIND_FORWARD, KIND_ATTACHMENT, KIND_DIGEST
+from bot.utils.digest import digest_buffer, build_digest_page
+from bot.utils.media_group import media_groups
+from bot.utils.spam_filter import spam_filter
+from bot.utils.admin_router import admin_router
+from bot.shards import current_shard
 
+logger = logging.getLogger(__name__)
 
-# 允许的消息类型
-ALLOWED_TYPES = {"text", "photo", "animation", "voice", "video_note", "sticker"}
-# 禁止的类型（文件、视频）
-BLOCKED_TYPES = {"document", "video"}
+
+# 转发方式
+FORWARD_TEXT = "text"        # send_message，信息卡片中包含文字内容
+FORWARD_CAPTION = "caption"  # copy_message，用信息卡片替换说明文字
+FORWARD_BUTTONS = "buttons"  # copy_message，不支持说明文字的类型把用户信息写在按钮上
+
+REJECT_FILE = "❌ 暂不支持发送文件或视频。"
+REJECT_UNSUPPORTED = "❌ 不支持的消息类型。"
+
+
+class ContentPolicy:
+    """一种消息类型的处理方式：forward 为转发方式，为 None 时回复 reject 拒绝
+
+    fingerprint 表示按文件参与刷屏检测（贴纸、语音等各人常发相同文件，不参与）
+    """
+
+    __slots__ = ("name", "forward", "reject", "fingerprint")
+
+    def __init__(self, name: str, forward: str = None, reject: str = REJECT_UNSUPPORTED,
+                 fingerprint: bool = False):
+        self.name = name
+        self.forward = forward
+        self.reject = reject
+        self.fingerprint = fingerprint
+
+
+# 消息类型策略表，按顺序匹配 Message 上第一个非空的同名属性
+# （动图消息同时带有 document，所以 animation 要排在 document 之前）
+CONTENT_POLICIES = (
+    ContentPolicy("text", FORWARD_TEXT),
+    ContentPolicy("photo", FORWARD_CAPTION, fingerprint=True),
+    ContentPolicy("video", reject=REJECT_FILE, fingerprint=True),
+    ContentPolicy("animation", FORWARD_CAPTION, fingerprint=True),
+    ContentPolicy("voice", FORWARD_CAPTION),
+    ContentPolicy("video_note", FORWARD_BUTTONS),
+    ContentPolicy("sticker", FORWARD_BUTTONS),
+    ContentPolicy("document", reject=REJECT_FILE, fingerprint=True),
+    ContentPolicy("audio"),
+)
+UNKNOWN_POLICY = ContentPolicy("unknown")
+
+# 相册整组转发时计入限流和统计的类型
+MEDIA_GROUP_TYPE = "media_group"
 
 
 def get_user_display_name(user) -> str:
@@ -79,7 +129,12 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
 
     # 忽略管理员的消息（在这个 handler 中）
-    if user.id == config.ADMIN_ID:
+    if user.id in config.ADMIN_IDS:
+        return
+
+    # 刷屏检测：多个用户发送相似内容时静默拦截，不写数据库也不调用接口
+    policy = get_content_policy(message)
+    if spam_filter.enabled and is_spam(message, user, policy):
         return
 
     # 获取或创建用户
@@ -95,137 +150,227 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         await message.reply_text("⚠️ 您已被限制发送消息。")
         return
 
-    # 检查消息类型
-    content_type = get_content_type(message)
-    if content_type in BLOCKED_TYPES:
-        await message.reply_text("❌ 暂不支持发送文件或视频。")
+    # 相册的每张图片是单独的更新，收齐后整组转发
+    if message.media_group_id:
+        media_groups.add(message, forward_media_group)
         return
 
-    if content_type not in ALLOWED_TYPES:
-        await message.reply_text("❌ 不支持的消息类型。")
+    # 检查消息类型
+    if policy.forward is None:
+        await message.reply_text(policy.reject)
         return
 
     # 检查频率限制
-    allowed, reason = await db.check_rate_limit(user.id)
+    allowed, reason = rate_limiter.check(user.id, policy.name)
     if not allowed:
         await message.reply_text(f"⚠️ {reason}")
         return
 
-    # 转发消息给管理员
+    # 摘要模式：文字留言攒成一批，合并为一条消息发给管理员
+    if digest_buffer.enabled and policy.forward == FORWARD_TEXT:
+        # 先落库再确认收到：摘要发出前进程重启，留言会在启动时重新放入缓冲
+        if await db.add_digest_pending(user.id, message.message_id, message.to_json()):
+            digest_buffer.add(message, send_digest)
+        await message.reply_text("✅ 消息已送达，请耐心等待回复。")
+        return
+
+    # 转发消息给管理员（写入发件箱后即返回，由发送队列异步发送）
     try:
         # 构建用户信息
         msg_count = await db.get_user_message_count(user.id)
         user_info = build_user_info_text(user, msg_count + 1, message.text or message.caption)
 
-        # 根据消息类型发送（合并为一条消息）
-        if content_type == "text":
-            # 纯文字消息
-            sent_msg = await context.bot.send_message(
-                chat_id=config.ADMIN_ID,
-                text=user_info,
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_action_keyboard(user.id)
-            )
-        elif content_type == "photo":
-            # 图片消息
-            sent_msg = await context.bot.send_photo(
-                chat_id=config.ADMIN_ID,
-                photo=message.photo[-1].file_id,
-                caption=user_info,
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_action_keyboard(user.id)
-            )
-        elif content_type == "voice":
-            # 语音消息
-            sent_msg = await context.bot.send_voice(
-                chat_id=config.ADMIN_ID,
-                voice=message.voice.file_id,
-                caption=user_info,
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_action_keyboard(user.id)
-            )
-        elif content_type == "sticker":
-            # 贴纸：先发信息卡片，再发贴纸
-            sent_msg = await context.bot.send_message(
-                chat_id=config.ADMIN_ID,
-                text=user_info + "\n\n⬇️ 贴纸如下：",
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_action_keyboard(user.id)
-            )
-            await context.bot.send_sticker(
-                chat_id=config.ADMIN_ID,
-                sticker=message.sticker.file_id
-            )
-        elif content_type == "animation":
-            # GIF 动图
-            sent_msg = await context.bot.send_animation(
-                chat_id=config.ADMIN_ID,
-                animation=message.animation.file_id,
-                caption=user_info,
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_action_keyboard(user.id)
-            )
-        elif content_type == "video_note":
-            # 视频圈：先发信息卡片，再发视频圈
-            sent_msg = await context.bot.send_message(
-                chat_id=config.ADMIN_ID,
-                text=user_info + "\n\n⬇️ 视频圈如下：",
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_action_keyboard(user.id)
-            )
-            await context.bot.send_video_note(
-                chat_id=config.ADMIN_ID,
-                video_note=message.video_note.file_id
-            )
-        else:
-            sent_msg = await context.bot.send_message(
-                chat_id=config.ADMIN_ID,
-                text=user_info,
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_action_keyboard(user.id)
-            )
-
-        # 保存消息映射
-        await db.save_message(
-            user_id=user.id,
-            user_msg_id=message.message_id,
-            forward_msg_id=sent_msg.message_id,
-            content_type=content_type
-        )
-
-        # 更新消息计数
-        await db.increment_msg_count(user.id)
+        await forward_message(message, user, policy, msg_count + 1, user_info)
 
         # 通知用户
         await message.reply_text("✅ 消息已送达，请耐心等待回复。")
 
-    except Exception as e:
+    except Exception:
         await message.reply_text("❌ 消息发送失败，请稍后再试。")
-        print(f"Error forwarding message: {e}")
-
-
-def get_content_type(message) -> str:
-    """获取消息内容类型"""
-    if message.text:
-        return "text"
-    elif message.photo:
-        return "photo"
-    elif message.video:
-        return "video"
-    elif message.animation:
-        return "animation"
-    elif message.voice:
-        return "voice"
-    elif message.video_note:
-        return "video_note"
-    elif message.sticker:
-        return "sticker"
-    elif message.document:
-        return "document"
-    elif message.audio:
-        return "audio"
+        logger.exception("转发消息失败 (user %s)", user.id)
+
+
+async def forward_to_admin(user, user_msg_id: int, content_type: str, method: str,
+                           kind: str = KIND_FORWARD, message_text: str = None, **kwargs):
+    """写入发件箱，由发送队列异步发给分配到的管理员；message_text 为转发成功后保存的留言正文"""
+    await outbox.enqueue(
+        f"{kind}:{user.id}:{user_msg_id}", kind, method,
+        user_id=user.id, user_msg_id=user_msg_id, content_type=content_type,
+        message_text=message_text, chat_id=await admin_router.route(user.id), **kwargs
+    )
+
+
+async def forward_message(message, user, policy: ContentPolicy, msg_count: int, user_info: str):
+    """按内容策略把一条消息转发给管理员，每条消息只调用一次 API"""
+    message_text = message.text or message.caption
+    if policy.forward == FORWARD_TEXT:
+        await forward_to_admin(
+            user, message.message_id, policy.name, "send_message",
+            message_text=message_text,
+            text=user_info,
+            parse_mode=ParseMode.HTML,
+            reply_markup=build_action_keyboard(user.id)
+        )
+        return
+
+    kwargs = {}
+    if policy.forward == FORWARD_CAPTION:
+        kwargs = {"caption": user_info, "parse_mode": ParseMode.HTML}
+        keyboard = build_action_keyboard(user.id)
     else:
-        return "unknown"
+        keyboard = build_action_keyboard(user.id, build_user_summary(user, msg_count))
+    await forward_to_admin(
+        user, message.message_id, policy.name, "copy_message",
+        message_text=message_text,
+        from_chat_id=message.chat_id,
+        message_id=message.message_id,
+        reply_markup=keyboard,
+        **kwargs
+    )
+
+
+async def send_digest(messages: list):
+    """按用户分配到的管理员分组，每个管理员收到自己用户的摘要"""
+    groups = {}
+    for message in messages:
+        admin_id = await admin_router.route(message.from_user.id)
+        groups.setdefault(admin_id, []).append(message)
+    for admin_id, group in groups.items():
+        await send_admin_digest(admin_id, group)
+
+
+async def restore_digest_buffer(bot):
+    """启动时把上次已确认收到、还没有汇总的留言重新放入摘要缓冲（分片时只取本分片的用户）"""
+    rows = await db.get_digest_pending(*current_shard())
+    for row in rows:
+        digest_buffer.add(Message.de_json(json.loads(row["message"]), bot), send_digest)
+    return len(rows)
+
+
+async def send_admin_digest(admin_id: int, messages: list):
+    """发送一批文字留言：只有一条时按普通卡片转发，否则保存为摘要并发送第一页"""
+    if len(messages) == 1:
+        message = messages[0]
+        user = message.from_user
+        msg_count = await db.get_user_message_count(user.id)
+        user_info = build_user_info_text(user, msg_count + 1, message.text)
+        await forward_message(message, user, get_content_policy(message), msg_count + 1, user_info)
+        await db.remove_digest_pending(user.id, message.message_id)
+        return
+
+    digest_id = await db.create_digest(
+        [(message.from_user.id, message.message_id, message.text) for message in messages]
+    )
+    text, keyboard = await build_digest_page(digest_id, 0)
+    await outbox.enqueue(
+        f"{KIND_DIGEST}:{digest_id}", KIND_DIGEST, "send_message",
+        # 一份摘要的用户都在同一分片，按第一个用户决定由哪个工作进程重发
+        user_id=messages[0].from_user.id,
+        chat_id=admin_id,
+        text=text,
+        parse_mode=ParseMode.HTML,
+        reply_markup=keyboard
+    )
+
+
+async def forward_media_group(messages: list):
+    """整组转发相册：只计一次限流，先发一张信息卡片，再用一次 send_media_group 发送图片"""
+    first = messages[0]
+    user = first.from_user
+
+    photos = [m for m in messages if get_content_policy(m).name == "photo"]
+    skipped = len(messages) - len(photos)
+    if skipped:
+        await first.reply_text(f"❌ 暂不支持发送文件或视频，相册中 {skipped} 项已忽略。")
+    if not photos:
+        return
+
+    allowed, reason = rate_limiter.check(user.id, MEDIA_GROUP_TYPE)
+    if not allowed:
+        await first.reply_text(f"⚠️ {reason}")
+        return
+
+    try:
+        msg_count = await db.get_user_message_count(user.id)
+        caption = next((m.caption for m in photos if m.caption), None)
+        user_info = build_user_info_text(user, msg_count + 1, caption)
+
+        await forward_to_admin(
+            user, first.message_id, MEDIA_GROUP_TYPE, "send_message",
+            message_text=caption,
+            text=user_info + f"\n\n⬇️ 相册（{len(photos)} 张）如下：",
+            parse_mode=ParseMode.HTML,
+            reply_markup=build_action_keyboard(user.id)
+        )
+        await forward_to_admin(
+            user, first.message_id, MEDIA_GROUP_TYPE, "send_media_group", KIND_ATTACHMENT,
+            media=[InputMediaPhoto(m.photo[-1].file_id) for m in photos]
+        )
+
+        await first.reply_text("✅ 消息已送达，请耐心等待回复。")
+
+    except Exception:
+        await first.reply_text("❌ 消息发送失败，请稍后再试。")
+        logger.exception("转发相册失败 (user %s)", user.id)
+
+
+def get_content_policy(message) -> ContentPolicy:
+    """获取消息类型对应的策略"""
+    for policy in CONTENT_POLICIES:
+        if getattr(message, policy.name, None):
+            return policy
+    return UNKNOWN_POLICY
+
+
+def is_spam(message, user, policy: ContentPolicy) -> bool:
+    """检查消息是否为刷屏内容，按 SPAM_ACTION 隔离或丢弃"""
+    text = message.text or message.caption
+    file_id = None
+    if policy.fingerprint:
+        media = getattr(message, policy.name)
+        if policy.name == "photo":
+            media = media[-1]
+        file_id = media.file_unique_id
+    if not spam_filter.check(user.id, text, file_id):
+        return False
+    quarantine(user, text, policy)
+    return True
+
+
+def is_spam_update(data: dict) -> bool:
+    """分片主进程分发前的刷屏检测：与 handle_user_message 中的检查相同，但直接读原始 JSON"""
+    message = data.get("message")
+    if not message or message["chat"]["type"] != "private":
+        return False
+    user = message.get("from")
+    if not user or user["id"] in config.ADMIN_IDS:
+        return False
+    # 命令不经过 handle_user_message（filters.COMMAND）
+    entities = message.get("entities")
+    if entities and entities[0]["type"] == "bot_command" and entities[0]["offset"] == 0:
+        return False
+
+    policy = next((p for p in CONTENT_POLICIES if message.get(p.name)), UNKNOWN_POLICY)
+    file_id = None
+    if policy.fingerprint:
+        media = message[policy.name]
+        if policy.name == "photo":
+            media = media[-1]
+        file_id = media["file_unique_id"]
+    text = message.get("text") or message.get("caption")
+    if not spam_filter.check(user["id"], text, file_id):
+        return False
+    quarantine(User.de_json(user, None), text, policy)
+    return True
+
+
+def quarantine(user, text, policy: ContentPolicy):
+    """SPAM_ACTION=quarantine 时把拦截的消息记入隔离列表"""
+    if config.SPAM_ACTION == "quarantine":
+        preview = text or f"[{policy.name}]"
+        spam_filter.quarantined.append(
+            (time.time(), user.id, get_user_display_name(user), preview[:100])
+        )
 
 
 def build_user_info_text(user, msg_count: int, text_content: str = None) -> str:
@@ -251,8 +396,13 @@ def build_user_info_text(user, msg_count: int, text_content: str = None) -> str:
     return info
 
 
-def build_action_keyboard(user_id: int) -> InlineKeyboardMarkup:
-    """构建操作按钮"""
+def build_user_summary(user, msg_count: int) -> str:
+    """按钮上显示的简要用户信息（用于贴纸等不能带说明文字的消息）"""
+    return f"📨 {get_user_display_name(user)} · {get_username_display(user)} · 第 {msg_count} 条"
+
+
+def build_action_keyboard(user_id: int, summary: str = None) -> InlineKeyboardMarkup:
+    """构建操作按钮，summary 不为空时在最上方加一行用户信息"""
     keyboard = [
         [InlineKeyboardButton("💬 回复", callback_data=f"reply_{user_id}")],
         [
@@ -260,4 +410,6 @@ def build_action_keyboard(user_id: int) -> InlineKeyboardMarkup:
             InlineKeyboardButton("🚫 拉黑", callback_data=f"ban_{user_id}"),
         ],
     ]
+    if summary:
+        keyboard.insert(0, [InlineKeyboardButton(summary, callback_data=f"info_{user_id}")])
     return InlineKeyboardMarkup(keyboard)
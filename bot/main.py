@@ -1,7 +1,9 @@
 import asyncio
 import logging
 import os
+import signal
 from pathlib import Path
+from typing import Optional
 
 from telegram import Update
 from telegram.ext import (
@@ -9,20 +11,50 @@ from telegram.ext import (
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ContextTypes,
     filters,
 )
+from telegram.request import BaseRequest, HTTPXRequest
 
-from bot.config import config
-from bot.database import db
-from bot.handlers.user import start_command, help_command, handle_user_message
+from bot.config import config, base_config, load_tenants
+from bot.tenant import Tenant
+from bot.storage import db
+from bot.utils.rate_limiter import rate_limiter
+from bot.utils.outbox import outbox
+from bot.utils.media_group import media_groups
+from bot.utils.digest import digest_buffer
+from bot.utils.broadcast import broadcaster
+from bot.utils.admin_router import admin_router
+from bot.utils.spam_filter import spam_filter
+from bot.utils.send_scheduler import scheduler
+from bot.utils.update_processor import PerUserUpdateProcessor
+from bot.shards import ShardPool, UpdatePoller, supervisor_link, is_worker, current_shard
+from bot.webhook import WebhookServer, run_webhook
+from bot.handlers.user import (
+    start_command, help_command, handle_user_message, restore_digest_buffer, is_spam_update
+)
 from bot.handlers.admin import (
     handle_callback,
     handle_admin_message,
     stats_command,
+    recount_command,
+    spam_command,
+    admins_command,
+    search_command,
+    history_command,
+    export_command,
+    broadcast_command,
     ban_command,
     unban_command,
 )
 
+# 各类处理器需要的更新类型
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: Update.MESSAGE,
+    MessageHandler: Update.MESSAGE,
+    CallbackQueryHandler: Update.CALLBACK_QUERY,
+}
+
 # 配置日志
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -37,35 +69,119 @@ async def post_init(application: Application):
     db_dir = Path(config.DB_PATH).parent
     db_dir.mkdir(parents=True, exist_ok=True)
 
-    # 连接数据库
-    await db.connect()
+    # 连接数据库（分片工作进程的写操作交给主进程）
+    await db.connect(writer=supervisor_link if is_worker() else None)
     logger.info("数据库已连接")
+    await admin_router.load()
+
+    # 启动发送调度，并重发上次未完成的发件箱记录
+    scheduler.start()
+    outbox.start(application.bot)
+    await outbox.drain()
+    broadcaster.start(application.bot)
+    # 群发和清理不按用户分片，只在 0 号工作进程中执行
+    first_shard = current_shard()[0] == 0
+    if first_shard:
+        await broadcaster.resume()
+    application.job_queue.run_repeating(
+        drain_outbox,
+        interval=config.OUTBOX_POLL_SECONDS,
+        first=config.OUTBOX_POLL_SECONDS,
+    )
+    if first_shard:
+        application.job_queue.run_repeating(purge_outbox, interval=3600, first=3600)
+    restored = await restore_digest_buffer(application.bot)
+    if restored:
+        logger.info("摘要模式：恢复 %s 条未汇总的留言", restored)
+
+    # 恢复限流状态并定期快照
+    await rate_limiter.restore(db)
+    application.job_queue.run_repeating(
+        snapshot_rate_limits,
+        interval=config.RATE_LIMIT_SNAPSHOT_SECONDS,
+        first=config.RATE_LIMIT_SNAPSHOT_SECONDS,
+    )
+
+
+async def snapshot_rate_limits(context: ContextTypes.DEFAULT_TYPE):
+    """定时保存限流状态"""
+    await rate_limiter.snapshot(db)
+
+
+async def drain_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """定时重发到期的发件箱记录"""
+    await outbox.drain()
+
+
+async def purge_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """定时清理过期的已发送记录"""
+    await db.purge_sent_outbox(config.OUTBOX_RETENTION_HOURS)
+
+
+async def post_stop(application: Application):
+    """应用停止后、关闭 HTTP 连接前执行：发完队列中的消息"""
+    await flush_buffers()
+    await scheduler.close()
+    await outbox.close()
+
+
+async def flush_buffers():
+    """把还在收集的相册、摘要和进行中的群发交给发送队列（群发重启后继续）"""
+    await media_groups.close()
+    await digest_buffer.close()
+    await broadcaster.close()
 
 
 async def post_shutdown(application: Application):
     """应用关闭时执行"""
+    await rate_limiter.snapshot(db)
     await db.close()
     logger.info("数据库已关闭")
 
 
-def main():
-    """主函数"""
-    # 验证配置
-    config.validate()
+def get_allowed_updates(application: Application) -> list[str]:
+    """根据已注册的处理器计算需要订阅的更新类型"""
+    allowed = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            update_type = HANDLER_UPDATE_TYPES.get(type(handler))
+            if update_type is None:
+                return Update.ALL_TYPES
+            allowed.add(update_type)
+    return sorted(allowed)
 
-    # 创建应用
-    application = (
+
+def build_application(request: BaseRequest = None,
+                      get_updates_request: BaseRequest = None) -> Application:
+    """按当前机器人的配置创建 Application 并注册处理器；多个机器人可以传入共用的 HTTP 连接池"""
+    builder = (
         Application.builder()
         .token(config.BOT_TOKEN)
         .post_init(post_init)
+        .post_stop(post_stop)
         .post_shutdown(post_shutdown)
-        .build()
     )
+    if request:
+        builder = builder.request(request).get_updates_request(get_updates_request)
+    if config.BOT_API_URL:
+        api_url = config.BOT_API_URL.rstrip("/")
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    if config.CONCURRENT_UPDATES > 1:
+        # 并发处理，同一用户的消息仍按顺序处理
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(config.CONCURRENT_UPDATES))
+    application = builder.build()
 
     # 注册命令处理器
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("recount", recount_command))
+    application.add_handler(CommandHandler("spam", spam_command))
+    application.add_handler(CommandHandler("admins", admins_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
     application.add_handler(CommandHandler("ban", ban_command))
     application.add_handler(CommandHandler("unban", unban_command))
 
@@ -75,7 +191,7 @@ def main():
     # 管理员消息处理器（优先级高）
     application.add_handler(
         MessageHandler(
-            filters.Chat(config.ADMIN_ID) & ~filters.COMMAND,
+            filters.Chat(config.ADMIN_IDS) & ~filters.COMMAND,
             handle_admin_message
         )
     )
@@ -87,10 +203,207 @@ def main():
             handle_user_message
         )
     )
+    return application
+
+
+async def start_bot(request: BaseRequest, get_updates_request: BaseRequest,
+                    server: Optional[WebhookServer]) -> Application:
+    """在当前租户的上下文中创建并启动一个机器人（轮询，或在共用的 webhook 服务上注册路径）"""
+    application = build_application(request, get_updates_request)
+    Tenant.current().application = application
+    allowed_updates = get_allowed_updates(application)
+    await application.initialize()
+    await post_init(application)
+    if server:
+        server.add_route(config.WEBHOOK_PATH, application.update_queue, application.bot,
+                         config.WEBHOOK_SECRET_TOKEN)
+        await application.bot.set_webhook(
+            url=config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET_TOKEN or None,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        await application.updater.start_polling(allowed_updates=allowed_updates)
+    await application.start()
+    logger.info("机器人 %s 已启动 (@%s)", Tenant.current().name, application.bot.username)
+    return application
+
+
+async def stop_bot(application: Application):
+    """停止接收更新，把缓冲中的消息交给发送队列"""
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await flush_buffers()
+
+
+async def shutdown_bot(application: Application):
+    await outbox.close()
+    await application.shutdown()
+    await post_shutdown(application)
+
+
+async def run_bots(tenants: list[Tenant]):
+    """在一个事件循环中运行多个机器人：共用发送调度器、HTTP 连接池和 webhook 端口，
+    每个机器人有自己的配置、数据库文件和各模块实例（见 bot.tenant）"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    request = HTTPXRequest(connection_pool_size=256)
+    # 每个机器人的长轮询各占一个连接
+    get_updates_request = HTTPXRequest(connection_pool_size=len(tenants))
+    server = None
+    if base_config.WEBHOOK_URL:
+        server = WebhookServer(
+            None,
+            listen=base_config.WEBHOOK_LISTEN,
+            port=base_config.WEBHOOK_PORT,
+            path=base_config.WEBHOOK_PATH,
+            max_connections=base_config.WEBHOOK_MAX_CONNECTIONS,
+        )
+        await server.start()
+
+    started = []
+    try:
+        results = await asyncio.gather(
+            *(tenant.call(start_bot, request, get_updates_request, server) for tenant in tenants),
+            return_exceptions=True,
+        )
+        started = [tenant for tenant, result in zip(tenants, results)
+                   if not isinstance(result, BaseException)]
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        logger.info("%s 个机器人运行中", len(started))
+        await stop_event.wait()
+    finally:
+        if server:
+            await server.stop()
+        # 停止轮询要等正在进行的 getUpdates 返回，各机器人同时停止
+        await asyncio.gather(*(tenant.call(stop_bot, tenant.application) for tenant in started))
+        # 所有机器人的缓冲都交给发送队列后再关闭共用的调度器
+        await scheduler.close()
+        await asyncio.gather(*(tenant.call(shutdown_bot, tenant.application) for tenant in started))
+
+
+async def run_supervisor():
+    """分片模式的主进程：接收更新并分发给 WORKERS 个工作进程，执行它们的写操作（见 bot.shards）"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    Path(config.DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+    await db.connect()
+    # 刷屏检测要看到所有用户的消息，在分发前进行
+    pool = ShardPool(db, config.WORKERS, screen=is_spam_update if spam_filter.enabled else None)
+    pool.queries["spam"] = spam_filter.snapshot
+    await pool.start()
+
+    # 处理器在工作进程中运行，这里只用 bot 调用接口；更新不解析，原样分发
+    application = build_application()
+    allowed_updates = get_allowed_updates(application)
+    await application.bot.initialize()
+    updates: asyncio.Queue = asyncio.Queue()
+    dispatcher = asyncio.create_task(pool.run(updates))
+    server = poller = None
+    try:
+        if config.WEBHOOK_URL:
+            server = WebhookServer(
+                None,
+                listen=config.WEBHOOK_LISTEN,
+                port=config.WEBHOOK_PORT,
+                path=config.WEBHOOK_PATH,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            )
+            server.add_route(config.WEBHOOK_PATH, updates, secret_token=config.WEBHOOK_SECRET_TOKEN,
+                             raw=True)
+            await server.start()
+            await application.bot.set_webhook(
+                url=config.WEBHOOK_URL,
+                secret_token=config.WEBHOOK_SECRET_TOKEN or None,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=allowed_updates,
+            )
+        else:
+            await application.bot.delete_webhook()
+            poller = UpdatePoller(application.bot, updates, allowed_updates)
+            poller.start()
+        logger.info("机器人启动中（%s 个工作进程）...", config.WORKERS)
+        await stop_event.wait()
+    finally:
+        if server:
+            await server.stop()
+        if poller:
+            await poller.stop()
+        # 已收到的更新分发完再通知工作进程停止
+        await updates.put(None)
+        await dispatcher
+        await pool.close()
+        await application.bot.shutdown()
+        await db.close()
+        logger.info("数据库已关闭")
+
+
+async def run_worker(request: BaseRequest = None, get_updates_request: BaseRequest = None):
+    """分片工作进程：处理主进程分发来的更新，直到主进程要求停止"""
+    # Ctrl+C 会发给整个进程组，停止顺序由主进程控制
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    await supervisor_link.connect()
+    application = build_application(request, get_updates_request)
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    logger.info("工作进程 %s/%s 已启动", config.WORKER_INDEX, config.WORKERS)
+    try:
+        while True:
+            data = await supervisor_link.updates.get()
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await stop_bot(application)
+        await scheduler.close()
+        await shutdown_bot(application)
+
+
+def main():
+    """主函数"""
+    # 多机器人：读取 BOTS_FILE 中的配置，在一个进程中运行
+    if base_config.BOTS_FILE:
+        tenants = load_tenants(base_config.BOTS_FILE, base_config)
+        logger.info("多机器人模式: %s", ", ".join(tenant.name for tenant in tenants))
+        asyncio.run(run_bots(tenants))
+        return
+
+    # 分片工作进程（由主进程启动）
+    if is_worker():
+        asyncio.run(run_worker())
+        return
+
+    # 验证配置
+    config.validate()
+
+    # 分片模式：本进程只接收更新，处理交给工作进程
+    if config.WORKERS > 0:
+        asyncio.run(run_supervisor())
+        return
+
+    # 创建应用
+    application = build_application()
 
     # 启动机器人
-    logger.info("机器人启动中...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    allowed_updates = get_allowed_updates(application)
+    if config.WEBHOOK_URL:
+        logger.info("机器人启动中（webhook 模式）...")
+        asyncio.run(run_webhook(application, allowed_updates))
+    else:
+        logger.info("机器人启动中...")
+        application.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == "__main__":
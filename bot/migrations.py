@@ -0,0 +1,589 @@
+"""数据库结构版本管理
+
+当前版本记录在 PRAGMA user_version 中，启动时依次执行缺少的迁移。
+每个迁移的最后一步和版本号更新在同一个事务里提交；大表重写先分批复制到新表，
+每批单独提交，中断后重新启动会从已复制的位置继续。
+
+也可以在部署前单独执行: python -m bot.migrations [数据库路径]
+"""
+import asyncio
+import logging
+import sys
+from typing import Awaitable, Callable
+
+import aiosqlite
+
+from bot.config import config
+
+logger = logging.getLogger(__name__)
+
+
+# ===== 版本 1：基线（user_version 引入之前的结构，时间为 ISO 文本） =====
+
+BASELINE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_banned INTEGER DEFAULT 0,
+        ban_reason TEXT,
+        msg_count INTEGER DEFAULT 0,
+        msg_count_today INTEGER DEFAULT 0,
+        last_msg_date TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        user_msg_id INTEGER,
+        forward_msg_id INTEGER,
+        content_type TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        user_id INTEGER PRIMARY KEY,
+        minute_count INTEGER DEFAULT 0,
+        minute_start TEXT,
+        cooldown_until TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dedup_key TEXT UNIQUE,
+        kind TEXT NOT NULL,
+        chat_id INTEGER NOT NULL,
+        method TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER DEFAULT 1,
+        user_id INTEGER,
+        user_msg_id INTEGER,
+        content_type TEXT,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at REAL DEFAULT 0,
+        sent_msg_id INTEGER,
+        last_error TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_messages_forward ON messages(forward_msg_id);
+    CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id);
+    CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(status, next_attempt_at);
+
+    -- 统计汇总表，由触发器在写入时增量维护
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS message_stats_hourly (
+        hour TEXT NOT NULL,
+        content_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, content_type)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS user_stats_daily (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS trg_users_insert_stats AFTER INSERT ON users
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_users';
+        UPDATE stats_counters SET value = value + 1
+        WHERE name = 'banned_users' AND NEW.is_banned = 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_users_ban_stats AFTER UPDATE OF is_banned ON users
+    WHEN OLD.is_banned != NEW.is_banned
+    BEGIN
+        UPDATE stats_counters SET value = value + (CASE WHEN NEW.is_banned THEN 1 ELSE -1 END)
+        WHERE name = 'banned_users';
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_messages_insert_stats AFTER INSERT ON messages
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_messages';
+        INSERT INTO message_stats_hourly (hour, content_type, count)
+        VALUES (substr(replace(NEW.created_at, ' ', 'T'), 1, 13),
+                coalesce(NEW.content_type, 'unknown'), 1)
+        ON CONFLICT (hour, content_type) DO UPDATE SET count = count + 1;
+        INSERT INTO user_stats_daily (day, user_id, count)
+        VALUES (substr(NEW.created_at, 1, 10), NEW.user_id, 1)
+        ON CONFLICT (day, user_id) DO UPDATE SET count = count + 1;
+    END;
+"""
+
+# 统计汇总表为空时（新建或从更早版本升级）按现有数据一次性生成
+BACKFILL_STATS = """
+    INSERT INTO stats_counters (name, value)
+    SELECT 'total_users', COUNT(*) FROM users;
+    INSERT INTO stats_counters (name, value)
+    SELECT 'banned_users', COUNT(*) FROM users WHERE is_banned = 1;
+    INSERT INTO stats_counters (name, value)
+    SELECT 'total_messages', COUNT(*) FROM messages;
+
+    DELETE FROM message_stats_hourly;
+    INSERT INTO message_stats_hourly (hour, content_type, count)
+    SELECT substr(replace(created_at, ' ', 'T'), 1, 13), coalesce(content_type, 'unknown'),
+           COUNT(*)
+    FROM messages GROUP BY 1, 2;
+
+    DELETE FROM user_stats_daily;
+    INSERT INTO user_stats_daily (day, user_id, count)
+    SELECT substr(created_at, 1, 10), user_id, COUNT(*)
+    FROM messages GROUP BY 1, 2;
+"""
+
+
+async def _v1_baseline(conn: aiosqlite.Connection, version: int, batch_size: int):
+    await conn.executescript(BASELINE_SCHEMA)
+    cursor = await conn.execute("SELECT COUNT(*) FROM stats_counters")
+    backfill = BACKFILL_STATS if (await cursor.fetchone())[0] == 0 else ""
+    await _finish(conn, version, backfill)
+
+
+# ===== 版本 2：时间改为整数时间戳，补充覆盖索引 =====
+
+# 新表与最终结构相同；索引在复制前建好，随分批复制逐步维护
+EPOCH_TABLES = """
+    CREATE TABLE IF NOT EXISTS users_v2 (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_banned INTEGER DEFAULT 0,
+        ban_reason TEXT,
+        msg_count INTEGER DEFAULT 0,
+        msg_count_today INTEGER DEFAULT 0,
+        last_msg_date TEXT,
+        created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+    );
+
+    CREATE TABLE IF NOT EXISTS messages_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        user_msg_id INTEGER,
+        forward_msg_id INTEGER,
+        content_type TEXT,
+        created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS rate_limits_v2 (
+        user_id INTEGER PRIMARY KEY,
+        cooldown_until REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS outbox_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dedup_key TEXT UNIQUE,
+        kind TEXT NOT NULL,
+        chat_id INTEGER NOT NULL,
+        method TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER DEFAULT 1,
+        user_id INTEGER,
+        user_msg_id INTEGER,
+        content_type TEXT,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at REAL DEFAULT 0,
+        sent_msg_id INTEGER,
+        last_error TEXT,
+        created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+    );
+
+    -- get_message_by_forward_id：唯一索引，一次查找
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_forward_msg ON messages_v2(forward_msg_id);
+    -- recount_messages：按用户计数、按用户统计今日条数，只读索引
+    CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages_v2(user_id, created_at);
+    -- 按时间范围查询消息
+    CREATE INDEX IF NOT EXISTS idx_messages_created ON messages_v2(created_at);
+    -- get_today_msg_counts：覆盖索引（user_id 即 rowid）
+    CREATE INDEX IF NOT EXISTS idx_users_today ON users_v2(last_msg_date, msg_count_today);
+    -- get_active_cooldowns：覆盖索引
+    CREATE INDEX IF NOT EXISTS idx_rate_limits_cooldown ON rate_limits_v2(cooldown_until);
+    -- get_due_outbox_items / purge_sent_outbox
+    CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox_v2(status, next_attempt_at);
+    CREATE INDEX IF NOT EXISTS idx_outbox_created ON outbox_v2(created_at);
+"""
+
+# 旧的 ISO 文本按本地时间写入（outbox.created_at 来自 CURRENT_TIMESTAMP，是 UTC）
+LOCAL_TEXT_TO_EPOCH = "CAST(strftime('%s', {0}, 'utc') AS INTEGER)"
+
+EPOCH_COPIES = [
+    ("users", "users_v2",
+     "user_id, username, first_name, last_name, is_banned, ban_reason, msg_count, "
+     "msg_count_today, last_msg_date, created_at",
+     "user_id, username, first_name, last_name, is_banned, ban_reason, msg_count, "
+     "msg_count_today, last_msg_date, " + LOCAL_TEXT_TO_EPOCH.format("created_at")),
+    # 旧数据中重复的 forward_msg_id 只保留最新一条的映射
+    ("messages", "messages_v2",
+     "id, user_id, user_msg_id, forward_msg_id, content_type, created_at",
+     "id, user_id, user_msg_id, "
+     "CASE WHEN EXISTS (SELECT 1 FROM messages newer WHERE newer.forward_msg_id = "
+     "messages.forward_msg_id AND newer.id > messages.id) THEN NULL ELSE forward_msg_id END, "
+     "content_type, COALESCE(" + LOCAL_TEXT_TO_EPOCH.format("created_at") + ", 0)"),
+    ("rate_limits", "rate_limits_v2",
+     "user_id, cooldown_until",
+     "user_id, (julianday(cooldown_until, 'utc') - 2440587.5) * 86400.0"),
+    ("outbox", "outbox_v2",
+     "id, dedup_key, kind, chat_id, method, payload, priority, user_id, user_msg_id, "
+     "content_type, status, attempts, next_attempt_at, sent_msg_id, last_error, created_at",
+     "id, dedup_key, kind, chat_id, method, payload, priority, user_id, user_msg_id, "
+     "content_type, status, attempts, next_attempt_at, sent_msg_id, last_error, "
+     "CAST(strftime('%s', created_at) AS INTEGER)"),
+]
+
+EPOCH_TRIGGERS = """
+    CREATE TRIGGER trg_users_insert_stats AFTER INSERT ON users
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_users';
+        UPDATE stats_counters SET value = value + 1
+        WHERE name = 'banned_users' AND NEW.is_banned = 1;
+    END;
+
+    CREATE TRIGGER trg_users_ban_stats AFTER UPDATE OF is_banned ON users
+    WHEN OLD.is_banned != NEW.is_banned
+    BEGIN
+        UPDATE stats_counters SET value = value + (CASE WHEN NEW.is_banned THEN 1 ELSE -1 END)
+        WHERE name = 'banned_users';
+    END;
+
+    CREATE TRIGGER trg_messages_insert_stats AFTER INSERT ON messages
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_messages';
+        INSERT INTO message_stats_hourly (hour, content_type, count)
+        VALUES (strftime('%Y-%m-%dT%H', NEW.created_at, 'unixepoch', 'localtime'),
+                coalesce(NEW.content_type, 'unknown'), 1)
+        ON CONFLICT (hour, content_type) DO UPDATE SET count = count + 1;
+        INSERT INTO user_stats_daily (day, user_id, count)
+        VALUES (strftime('%Y-%m-%d', NEW.created_at, 'unixepoch', 'localtime'), NEW.user_id, 1)
+        ON CONFLICT (day, user_id) DO UPDATE SET count = count + 1;
+    END;
+"""
+
+
+async def _v2_epoch_timestamps(conn: aiosqlite.Connection, version: int, batch_size: int):
+    await conn.executescript(EPOCH_TABLES)
+    for source, target, columns, select in EPOCH_COPIES:
+        await copy_in_batches(conn, source, target, columns, select, batch_size)
+
+    # 切换：旧表连同其索引、触发器一起删除，新表改名；AUTOINCREMENT 序号沿用旧表
+    swap = []
+    for source, target, _, _ in EPOCH_COPIES:
+        swap.append(f"""
+            DELETE FROM sqlite_sequence WHERE name = '{target}';
+            UPDATE sqlite_sequence SET name = '{target}' WHERE name = '{source}';
+            DROP TABLE {source};
+            ALTER TABLE {target} RENAME TO {source};
+        """)
+    swap.append(EPOCH_TRIGGERS)
+    await _finish(conn, version, "".join(swap))
+
+
+# ===== 版本 3：摘要模式 =====
+
+DIGEST_TABLES = """
+    CREATE TABLE IF NOT EXISTS digests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        entry_count INTEGER NOT NULL,
+        created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+    );
+
+    -- 每条留言仍写入 messages（forward_msg_id 为空），这里记录它在摘要中的位置
+    -- （版本 4 起正文保存在 messages.text）
+    CREATE TABLE IF NOT EXISTS digest_entries (
+        digest_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        text TEXT,
+        PRIMARY KEY (digest_id, position)
+    ) WITHOUT ROWID;
+"""
+
+
+async def _v3_digests(conn: aiosqlite.Connection, version: int, batch_size: int):
+    await _finish(conn, version, DIGEST_TABLES)
+
+
+# ===== 版本 4：消息正文和全文搜索 =====
+
+SEARCH_SCHEMA = """
+    ALTER TABLE messages ADD COLUMN text TEXT;
+    -- 发件箱记录转发成功后写入 messages.text 的正文（text 已被 send_message 参数占用）
+    ALTER TABLE outbox ADD COLUMN message_text TEXT;
+
+    -- 外部内容表：只存倒排索引，正文仍在 messages.text。trigram 分词不依赖空格，
+    -- 中文也能按子串搜索（每个搜索词至少 3 个字）
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        text, content='messages', content_rowid='id', tokenize='trigram'
+    );
+
+    CREATE TRIGGER trg_messages_fts_insert AFTER INSERT ON messages
+    WHEN NEW.text IS NOT NULL
+    BEGIN
+        INSERT INTO messages_fts (rowid, text) VALUES (NEW.id, NEW.text);
+    END;
+
+    CREATE TRIGGER trg_messages_fts_delete AFTER DELETE ON messages
+    WHEN OLD.text IS NOT NULL
+    BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+    END;
+
+    CREATE TRIGGER trg_messages_fts_update AFTER UPDATE OF text ON messages
+    BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text)
+        SELECT 'delete', OLD.id, OLD.text WHERE OLD.text IS NOT NULL;
+        INSERT INTO messages_fts (rowid, text)
+        SELECT NEW.id, NEW.text WHERE NEW.text IS NOT NULL;
+    END;
+
+    -- 此前只有摘要模式保存了正文，移到 messages.text 并建立索引
+    UPDATE messages SET text = (SELECT text FROM digest_entries WHERE message_id = messages.id)
+    WHERE id IN (SELECT message_id FROM digest_entries);
+    ALTER TABLE digest_entries DROP COLUMN text;
+"""
+
+
+async def _v4_search(conn: aiosqlite.Connection, version: int, batch_size: int):
+    await _finish(conn, version, SEARCH_SCHEMA)
+
+
+# ===== 版本 5：管理员回复记入会话 =====
+
+THREAD_SCHEMA = """
+    -- 管理员回复也写入 messages（is_reply = 1，user_msg_id 为用户聊天中的消息 ID），
+    -- 与留言按 id 排成同一个会话；回复不计入留言统计
+    ALTER TABLE messages ADD COLUMN is_reply INTEGER NOT NULL DEFAULT 0;
+
+    -- get_user_history：按 (user_id, id) 翻页（rowid 隐含在索引末尾）
+    CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id);
+    -- recount_messages 只数留言，is_reply 加入覆盖索引
+    DROP INDEX IF EXISTS idx_messages_user_created;
+    CREATE INDEX idx_messages_user_created ON messages(user_id, is_reply, created_at);
+
+    DROP TRIGGER trg_messages_insert_stats;
+    CREATE TRIGGER trg_messages_insert_stats AFTER INSERT ON messages
+    WHEN NEW.is_reply = 0
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_messages';
+        INSERT INTO message_stats_hourly (hour, content_type, count)
+        VALUES (strftime('%Y-%m-%dT%H', NEW.created_at, 'unixepoch', 'localtime'),
+                coalesce(NEW.content_type, 'unknown'), 1)
+        ON CONFLICT (hour, content_type) DO UPDATE SET count = count + 1;
+        INSERT INTO user_stats_daily (day, user_id, count)
+        VALUES (strftime('%Y-%m-%d', NEW.created_at, 'unixepoch', 'localtime'), NEW.user_id, 1)
+        ON CONFLICT (day, user_id) DO UPDATE SET count = count + 1;
+    END;
+"""
+
+
+async def _v5_threads(conn: aiosqlite.Connection, version: int, batch_size: int):
+    await _finish(conn, version, THREAD_SCHEMA)
+
+
+# ===== 版本 6：群发 =====
+
+BROADCAST_SCHEMA = """
+    -- 发送时返回 Forbidden（用户屏蔽了机器人）时标记，用户再次留言时清除；群发跳过这些用户
+    ALTER TABLE users ADD COLUMN is_blocked INTEGER NOT NULL DEFAULT 0;
+
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL DEFAULT 'draft',   -- draft / running / done / cancelled
+        method TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        cursor INTEGER NOT NULL DEFAULT 0,      -- 已处理完的最大 user_id（keyset 游标）
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        status_chat_id INTEGER,
+        status_msg_id INTEGER,
+        created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        finished_at INTEGER
+    );
+
+    -- 每个收件人的结果；重启后跳过已有结果的用户
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,                   -- sent / failed / blocked
+        error TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER trg_broadcast_recipients_insert AFTER INSERT ON broadcast_recipients
+    BEGIN
+        UPDATE broadcasts SET
+            sent = sent + (NEW.status = 'sent'),
+            failed = failed + (NEW.status = 'failed'),
+            blocked = blocked + (NEW.status = 'blocked')
+        WHERE id = NEW.broadcast_id;
+    END;
+"""
+
+
+async def _v6_broadcasts(conn: aiosqlite.Connection, version: int, batch_size: int):
+    await _finish(conn, version, BROADCAST_SCHEMA)
+
+
+# ===== 版本 7：多管理员 =====
+
+ADMIN_ROUTING_SCHEMA = """
+    -- 用户分配到的管理员（为空或已不在 ADMIN_IDS 中时重新分配）
+    ALTER TABLE users ADD COLUMN assigned_admin INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_users_assigned_admin ON users(assigned_admin);
+
+    -- 消息 ID 只在同一个会话内唯一，回复路由按 (管理员会话, 转发消息 ID) 查找
+    DROP INDEX IF EXISTS idx_messages_forward_msg;
+    CREATE UNIQUE INDEX idx_messages_forward_msg ON messages(forward_chat_id, forward_msg_id);
+"""
+
+
+async def _v7_admin_routing(conn: aiosqlite.Connection, version: int, batch_size: int):
+    cursor = await conn.execute("PRAGMA table_info(messages)")
+    if "forward_chat_id" not in [row[1] for row in await cursor.fetchall()]:
+        await conn.execute("ALTER TABLE messages ADD COLUMN forward_chat_id INTEGER")
+        await conn.commit()
+    # 升级前的转发都发给了唯一的管理员，即 ADMIN_IDS 中的第一个
+    admin_id = config.ADMIN_IDS[0] if config.ADMIN_IDS else 0
+    cursor = await conn.execute(
+        "SELECT 1 FROM messages WHERE forward_msg_id IS NOT NULL AND forward_chat_id IS NULL LIMIT 1"
+    )
+    if await cursor.fetchone() and admin_id <= 0:
+        # 填成 0 的话，管理员回复升级前转发的留言时找不到对应用户
+        raise RuntimeError("迁移到版本 7 需要设置 ADMIN_ID（升级前接收转发的管理员）")
+    await update_in_batches(
+        conn, "messages", "forward_chat_id = ?",
+        "forward_msg_id IS NOT NULL AND forward_chat_id IS NULL", (admin_id,), batch_size
+    )
+    await _finish(conn, version, ADMIN_ROUTING_SCHEMA)
+
+
+# ===== 版本 8：摘要模式的待汇总留言 =====
+
+DIGEST_PENDING_SCHEMA = """
+    -- 摘要模式下已确认收到、还没有生成摘要的留言（Message 的 JSON），
+    -- 生成摘要或单独转发后删除；重启后重新放入摘要缓冲
+    CREATE TABLE IF NOT EXISTS digest_pending (
+        user_id INTEGER NOT NULL,
+        user_msg_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        PRIMARY KEY (user_id, user_msg_id)
+    ) WITHOUT ROWID;
+"""
+
+
+async def _v8_digest_pending(conn: aiosqlite.Connection, version: int, batch_size: int):
+    await _finish(conn, version, DIGEST_PENDING_SCHEMA)
+
+
+async def copy_in_batches(conn: aiosqlite.Connection, source: str, target: str,
+                          columns: str, select: str, batch_size: int):
+    """按 rowid 顺序每次复制 batch_size 行并提交；从 target 中已有的最大 rowid 之后继续"""
+    cursor = await conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {target}")
+    last = (await cursor.fetchone())[0]
+    while True:
+        cursor = await conn.execute(
+            f"SELECT MAX(rowid) FROM (SELECT rowid FROM {source} WHERE rowid > ? "
+            f"ORDER BY rowid LIMIT ?)", (last, batch_size)
+        )
+        upper = (await cursor.fetchone())[0]
+        if upper is None:
+            break
+        await conn.execute(
+            f"INSERT INTO {target} ({columns}) SELECT {select} FROM {source} "
+            f"WHERE rowid > ? AND rowid <= ?", (last, upper)
+        )
+        await conn.commit()
+        last = upper
+        logger.info("迁移 %s: 已复制到 rowid %s", source, last)
+        # 让出事件循环，迁移期间其他协程仍可运行
+        await asyncio.sleep(0)
+
+
+async def update_in_batches(conn: aiosqlite.Connection, table: str, assignment: str,
+                            condition: str, params: tuple, batch_size: int):
+    """按 rowid 范围每次更新 batch_size 行并提交（params 为 assignment 的参数）；
+    condition 需排除已更新的行，中断后重新执行时跳过"""
+    last = 0
+    while True:
+        cursor = await conn.execute(
+            f"SELECT MAX(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? "
+            f"ORDER BY rowid LIMIT ?)", (last, batch_size)
+        )
+        upper = (await cursor.fetchone())[0]
+        if upper is None:
+            break
+        await conn.execute(
+            f"UPDATE {table} SET {assignment} WHERE rowid > ? AND rowid <= ? AND {condition}",
+            (*params, last, upper)
+        )
+        await conn.commit()
+        last = upper
+        logger.info("迁移 %s: 已更新到 rowid %s", table, last)
+        await asyncio.sleep(0)
+
+
+async def _finish(conn: aiosqlite.Connection, version: int, script: str):
+    """在一个事务里执行迁移的最后一步并更新版本号"""
+    try:
+        await conn.executescript(f"BEGIN; {script} PRAGMA user_version = {version}; COMMIT;")
+    except Exception:
+        await conn.rollback()
+        raise
+
+
+MIGRATIONS: list[Callable[[aiosqlite.Connection, int, int], Awaitable[None]]] = [
+    _v1_baseline,
+    _v2_epoch_timestamps,
+    _v3_digests,
+    _v4_search,
+    _v5_threads,
+    _v6_broadcasts,
+    _v7_admin_routing,
+    _v8_digest_pending,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def get_version(conn: aiosqlite.Connection) -> int:
+    cursor = await conn.execute("PRAGMA user_version")
+    return (await cursor.fetchone())[0]
+
+
+async def migrate(conn: aiosqlite.Connection, batch_size: int = None) -> int:
+    """把数据库升级到最新版本，返回升级前的版本号"""
+    batch_size = batch_size or config.MIGRATION_BATCH_SIZE
+    current = await get_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"数据库版本 {current} 高于程序支持的版本 {SCHEMA_VERSION}")
+    for version in range(current + 1, SCHEMA_VERSION + 1):
+        migration = MIGRATIONS[version - 1]
+        logger.info("数据库迁移到版本 %s (%s)", version, migration.__name__)
+        await migration(conn, version, batch_size)
+    return current
+
+
+async def _main(db_path: str):
+    async with aiosqlite.connect(db_path) as conn:
+        before = await migrate(conn)
+        print(f"{db_path}: 版本 {before} -> {SCHEMA_VERSION}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else config.DB_PATH))
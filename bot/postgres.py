@@ -0,0 +1,500 @@
+"""PostgreSQL 存储后端（DB_BACKEND=postgres，需要安装 asyncpg）
+
+方法和缓存逻辑沿用 bot.database.Database，只替换连接和方言不同的 SQL：
+读操作走 asyncpg 连接池；写操作仍经写入合并队列，每批从池中取一个连接在一个事务里提交，
+提交顺序与 SQLite 后端相同。SQL 中的 ? 占位符在执行前换成 $1, $2...。
+结构版本记在 schema_version 表中，每个机器人的表在各自的 schema（DB_SCHEMA）里。
+搜索用 ILIKE 子串匹配，数据库安装了 pg_trgm 扩展时由 trigram 索引加速。
+"""
+import asyncio
+import logging
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Optional
+
+import asyncpg
+
+from bot.config import config
+from bot.database import MIN_FTS_TERM, Database, escape_like
+from bot.export import EXPORT_TABLES, FORMATS, ExportFile, export_path, export_query
+from bot.utils.user_cache import UserRecord
+from bot.utils.write_queue import WriteOp, WriteQueue
+
+logger = logging.getLogger(__name__)
+
+
+# ===== 版本 1：与 SQLite 版本 7 相同的结构 =====
+
+SCHEMA = """
+    CREATE TABLE users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_banned INTEGER NOT NULL DEFAULT 0,
+        ban_reason TEXT,
+        msg_count INTEGER NOT NULL DEFAULT 0,
+        msg_count_today INTEGER NOT NULL DEFAULT 0,
+        last_msg_date TEXT,
+        created_at BIGINT NOT NULL DEFAULT EXTRACT(EPOCH FROM now())::BIGINT,
+        is_blocked INTEGER NOT NULL DEFAULT 0,
+        assigned_admin BIGINT
+    );
+    CREATE INDEX idx_users_today ON users(last_msg_date, msg_count_today);
+    CREATE INDEX idx_users_assigned_admin ON users(assigned_admin);
+
+    CREATE TABLE messages (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        user_msg_id BIGINT,
+        forward_chat_id BIGINT,
+        forward_msg_id BIGINT,
+        content_type TEXT,
+        text TEXT,
+        is_reply INTEGER NOT NULL DEFAULT 0,
+        created_at BIGINT NOT NULL DEFAULT EXTRACT(EPOCH FROM now())::BIGINT
+    );
+    CREATE UNIQUE INDEX idx_messages_forward_msg ON messages(forward_chat_id, forward_msg_id);
+    CREATE INDEX idx_messages_user ON messages(user_id, id);
+    CREATE INDEX idx_messages_user_created ON messages(user_id, is_reply, created_at);
+    CREATE INDEX idx_messages_created ON messages(created_at, id);
+
+    CREATE TABLE rate_limits (
+        user_id BIGINT PRIMARY KEY,
+        cooldown_until DOUBLE PRECISION
+    );
+    CREATE INDEX idx_rate_limits_cooldown ON rate_limits(cooldown_until);
+
+    CREATE TABLE outbox (
+        id BIGSERIAL PRIMARY KEY,
+        dedup_key TEXT UNIQUE,
+        kind TEXT NOT NULL,
+        chat_id BIGINT NOT NULL,
+        method TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER DEFAULT 1,
+        user_id BIGINT,
+        user_msg_id BIGINT,
+        content_type TEXT,
+        message_text TEXT,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at DOUBLE PRECISION DEFAULT 0,
+        sent_msg_id BIGINT,
+        last_error TEXT,
+        created_at BIGINT DEFAULT EXTRACT(EPOCH FROM now())::BIGINT
+    );
+    CREATE INDEX idx_outbox_due ON outbox(status, next_attempt_at);
+    CREATE INDEX idx_outbox_created ON outbox(created_at);
+
+    CREATE TABLE digests (
+        id BIGSERIAL PRIMARY KEY,
+        entry_count INTEGER NOT NULL,
+        created_at BIGINT NOT NULL DEFAULT EXTRACT(EPOCH FROM now())::BIGINT
+    );
+
+    CREATE TABLE digest_entries (
+        digest_id BIGINT NOT NULL,
+        position INTEGER NOT NULL,
+        message_id BIGINT NOT NULL,
+        PRIMARY KEY (digest_id, position)
+    );
+
+    CREATE TABLE broadcasts (
+        id BIGSERIAL PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'draft',
+        method TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        cursor BIGINT NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        status_chat_id BIGINT,
+        status_msg_id BIGINT,
+        created_at BIGINT NOT NULL DEFAULT EXTRACT(EPOCH FROM now())::BIGINT,
+        finished_at BIGINT
+    );
+
+    CREATE TABLE broadcast_recipients (
+        broadcast_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    );
+
+    -- 统计汇总表，由触发器在写入时增量维护；按小时和天分组用会话时区（即本进程的本地时间）
+    CREATE TABLE stats_counters (
+        name TEXT PRIMARY KEY,
+        value BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO stats_counters (name, value)
+    VALUES ('total_users', 0), ('banned_users', 0), ('total_messages', 0);
+
+    CREATE TABLE message_stats_hourly (
+        hour TEXT NOT NULL,
+        content_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, content_type)
+    );
+
+    CREATE TABLE user_stats_daily (
+        day TEXT NOT NULL,
+        user_id BIGINT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id)
+    );
+
+    CREATE FUNCTION trg_users_insert_stats() RETURNS trigger AS $$
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_users';
+        UPDATE stats_counters SET value = value + 1
+        WHERE name = 'banned_users' AND NEW.is_banned = 1;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+    CREATE TRIGGER trg_users_insert_stats AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION trg_users_insert_stats();
+
+    CREATE FUNCTION trg_users_ban_stats() RETURNS trigger AS $$
+    BEGIN
+        UPDATE stats_counters SET value = value + (CASE WHEN NEW.is_banned = 1 THEN 1 ELSE -1 END)
+        WHERE name = 'banned_users';
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+    CREATE TRIGGER trg_users_ban_stats AFTER UPDATE OF is_banned ON users
+    FOR EACH ROW WHEN (OLD.is_banned != NEW.is_banned) EXECUTE FUNCTION trg_users_ban_stats();
+
+    CREATE FUNCTION trg_messages_insert_stats() RETURNS trigger AS $$
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'total_messages';
+        INSERT INTO message_stats_hourly (hour, content_type, count)
+        VALUES (to_char(to_timestamp(NEW.created_at), 'YYYY-MM-DD"T"HH24'),
+                coalesce(NEW.content_type, 'unknown'), 1)
+        ON CONFLICT (hour, content_type) DO UPDATE SET count = message_stats_hourly.count + 1;
+        INSERT INTO user_stats_daily (day, user_id, count)
+        VALUES (to_char(to_timestamp(NEW.created_at), 'YYYY-MM-DD'), NEW.user_id, 1)
+        ON CONFLICT (day, user_id) DO UPDATE SET count = user_stats_daily.count + 1;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+    CREATE TRIGGER trg_messages_insert_stats AFTER INSERT ON messages
+    FOR EACH ROW WHEN (NEW.is_reply = 0) EXECUTE FUNCTION trg_messages_insert_stats();
+
+    CREATE FUNCTION trg_broadcast_recipients_insert() RETURNS trigger AS $$
+    BEGIN
+        UPDATE broadcasts SET
+            sent = sent + (NEW.status = 'sent')::INTEGER,
+            failed = failed + (NEW.status = 'failed')::INTEGER,
+            blocked = blocked + (NEW.status = 'blocked')::INTEGER
+        WHERE id = NEW.broadcast_id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+    CREATE TRIGGER trg_broadcast_recipients_insert AFTER INSERT ON broadcast_recipients
+    FOR EACH ROW EXECUTE FUNCTION trg_broadcast_recipients_insert();
+"""
+
+# 摘要模式下已确认收到、还没有生成摘要的留言（见 bot.migrations 版本 8）
+DIGEST_PENDING_SCHEMA = """
+    CREATE TABLE digest_pending (
+        user_id BIGINT NOT NULL,
+        user_msg_id BIGINT NOT NULL,
+        message TEXT NOT NULL,
+        created_at BIGINT NOT NULL DEFAULT EXTRACT(EPOCH FROM now())::BIGINT,
+        PRIMARY KEY (user_id, user_msg_id)
+    );
+"""
+
+# 第 n 个脚本把结构升级到版本 n
+MIGRATIONS = [SCHEMA, DIGEST_PENDING_SCHEMA]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+@lru_cache(maxsize=1024)
+def numbered(sql: str) -> str:
+    """把 ? 占位符换成 $1, $2...（本项目的 SQL 中字符串常量不含问号）"""
+    parts = sql.split("?")
+    return parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+
+
+def local_timezone() -> str:
+    """本进程当前的 UTC 偏移（POSIX 格式，方向与 ISO 相反：东八区为 UTC-08:00），
+    作为连接的会话时区，统计触发器按本地时间分小时和天，与 SQLite 的 'localtime' 一致"""
+    offset = time.localtime().tm_gmtoff
+    sign = "-" if offset >= 0 else "+"
+    return f"UTC{sign}{abs(offset) // 3600:02d}:{abs(offset) % 3600 // 60:02d}"
+
+
+async def migrate(conn: asyncpg.Connection, schema: str) -> int:
+    """把 schema 升级到最新版本，返回升级前的版本号"""
+    async with conn.transaction():
+        # 多个进程同时启动时只有一个执行迁移，其他的等它提交后看到最新版本
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", schema)
+        await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {quote_ident(schema)}")
+        await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        if current > SCHEMA_VERSION:
+            raise RuntimeError(f"数据库版本 {current} 高于程序支持的版本 {SCHEMA_VERSION}")
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            logger.info("数据库迁移到版本 %s", version)
+            await conn.execute(MIGRATIONS[version - 1])
+            await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", version)
+    await _create_trigram_index(conn)
+    return current
+
+
+async def _create_trigram_index(conn: asyncpg.Connection):
+    """数据库可以安装 pg_trgm 扩展时为 messages.text 建 trigram 索引，搜索的 ILIKE 走索引"""
+    try:
+        await conn.execute("""
+            CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public;
+            CREATE INDEX IF NOT EXISTS idx_messages_text_trgm
+            ON messages USING gin (text public.gin_trgm_ops);
+        """)
+    except asyncpg.PostgresError as e:
+        logger.warning("未启用 pg_trgm（%s），搜索只扫描最近的消息", e)
+
+
+class PostgresWriteQueue(WriteQueue):
+    """写入合并队列的 PostgreSQL 实现：conn 为连接池，每批取一个连接在一个事务里提交"""
+
+    async def _execute_batch(self, batch: list[WriteOp]) -> list[Any]:
+        try:
+            async with self.conn.acquire() as conn:
+                try:
+                    async with conn.transaction():
+                        return [await self._execute_op(conn, op) for op in batch]
+                except asyncpg.PostgresError:
+                    # 一条语句出错整个事务就失效了：回滚后逐个写操作在各自的保存点中重做，
+                    # 只有出错的写操作失败
+                    return await self._execute_isolated(conn, batch)
+        except Exception as e:
+            logger.exception("批量提交失败")
+            return [e] * len(batch)
+
+    async def _execute_isolated(self, conn: asyncpg.Connection, batch: list[WriteOp]) -> list[Any]:
+        results: list[Any] = []
+        async with conn.transaction():
+            for op in batch:
+                try:
+                    async with conn.transaction():
+                        results.append(await self._execute_op(conn, op))
+                except asyncpg.PostgresError as e:
+                    logger.error("写入失败: %s (%s)", e, op.statements[0][0].strip().splitlines()[0])
+                    results.append(e)
+        return results
+
+    @staticmethod
+    async def _execute_op(conn: asyncpg.Connection, op: WriteOp) -> Any:
+        result = None
+        for i, (sql, params) in enumerate(op.statements):
+            rows = await conn.fetch(numbered(sql), *params)
+            if i == 0:
+                # 没有 lastrowid：插入语句用 RETURNING id 返回新行的 ID
+                result = rows if op.fetch else (rows[0][0] if rows else None)
+        return result
+
+
+class PostgresDatabase(Database):
+    """PostgreSQL 存储：asyncpg 连接池，写操作经 PostgresWriteQueue 合并提交"""
+
+    def __init__(self, dsn: str = None, pool_size: int = None, schema: str = None):
+        super().__init__(read_pool_size=0)
+        self.dsn = dsn or config.DATABASE_URL
+        self.pool_size = pool_size or config.DB_POOL_SIZE
+        self.schema = schema or config.DB_SCHEMA
+        self.pool: Optional[asyncpg.Pool] = None
+
+    async def connect(self, writer=None):
+        """writer 为其他进程的写入代理时（分片工作进程）不迁移，连接池只用于读"""
+        self.pool = await asyncpg.create_pool(
+            self.dsn, min_size=1, max_size=self.pool_size,
+            # 与 migrate 中创建 schema 时一样加引号：机器人名称可以有大写字母和连字符
+            server_settings={"search_path": quote_ident(self.schema), "timezone": local_timezone()},
+        )
+        if writer is None:
+            async with self.pool.acquire() as conn:
+                await migrate(conn, self.schema)
+            writer = PostgresWriteQueue(
+                self.pool,
+                max_batch=config.WRITE_BATCH_SIZE,
+            )
+        self.writer = writer
+        self.writer.start()
+        await self._warm_forward_cache()
+
+    async def close(self):
+        if self.writer:
+            await self.writer.close()
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+    async def _fetchall(self, sql: str, params: tuple = ()) -> list[asyncpg.Record]:
+        return await self.pool.fetch(numbered(sql), *params)
+
+    async def export(self, out_dir: str, fmt: str = "jsonl", start: int = None,
+                     end: int = None) -> list[tuple[str, int]]:
+        """导出 users 和 messages（见 bot.export）：两张表在同一个只读快照事务中按游标分块读取，
+        压缩在后台线程中进行"""
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的格式: {fmt}")
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        results = []
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                for table in EXPORT_TABLES:
+                    sql, params = export_query(table, start, end)
+                    statement = await conn.prepare(numbered(sql))
+                    cursor = await statement.cursor(*params)
+                    path = export_path(out_dir, table, fmt, stamp)
+                    columns = [attribute.name for attribute in statement.get_attributes()]
+                    with ExportFile(path, fmt, columns) as out:
+                        while True:
+                            chunk = await cursor.fetch(config.EXPORT_CHUNK_ROWS)
+                            if not chunk:
+                                break
+                            await asyncio.to_thread(out.write, chunk)
+                    results.append((path, out.rows))
+        return results
+
+    # ===== 方言不同的方法 =====
+
+    async def get_or_create_user(self, user_id: int, username: str = None,
+                                 first_name: str = None, last_name: str = None) -> UserRecord:
+        user = await self.get_user(user_id)
+        if user and (user.username, user.first_name, user.last_name) == \
+                (username, first_name, last_name):
+            return user
+
+        rows = await self._write("""
+            INSERT INTO users (user_id, username, first_name, last_name, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name
+            WHERE users.username IS DISTINCT FROM excluded.username
+               OR users.first_name IS DISTINCT FROM excluded.first_name
+               OR users.last_name IS DISTINCT FROM excluded.last_name
+            RETURNING *
+        """, (user_id, username, first_name, last_name, int(time.time())),
+            durable=True, fetch=True)
+        if rows:
+            user = UserRecord.from_row(rows[0])
+            self.user_cache.put(user)
+            return user
+        return await self._reload_user(user_id)
+
+    @staticmethod
+    def _message_statements(user_id: int, user_msg_id: int, forward_chat_id: Optional[int],
+                            forward_msg_id: Optional[int], content_type: str, text: Optional[str],
+                            today: str) -> list[tuple[str, tuple]]:
+        (insert_sql, insert_params), update_user = Database._message_statements(
+            user_id, user_msg_id, forward_chat_id, forward_msg_id, content_type, text, today
+        )
+        return [(insert_sql + "RETURNING id", insert_params), update_user]
+
+    async def recount_messages(self) -> int:
+        today = date.today().isoformat()
+        today_start = int(datetime.combine(date.today(), datetime.min.time()).timestamp())
+        rows = await self._write_many([
+            ("""
+                WITH counts AS (
+                    SELECT u.user_id,
+                           (SELECT COUNT(*) FROM messages m
+                            WHERE m.user_id = u.user_id AND m.is_reply = 0) AS total,
+                           (SELECT COUNT(*) FROM messages m
+                            WHERE m.user_id = u.user_id AND m.is_reply = 0
+                              AND m.created_at >= ?) AS today
+                    FROM users u
+                )
+                SELECT counts.* FROM counts JOIN users USING (user_id)
+                WHERE users.msg_count != counts.total
+                   OR (users.last_msg_date = ? AND users.msg_count_today != counts.today)
+                   OR (users.last_msg_date IS DISTINCT FROM ? AND counts.today > 0)
+            """, (today_start, today, today)),
+            ("""
+                UPDATE users SET
+                    msg_count = (SELECT COUNT(*) FROM messages m
+                                 WHERE m.user_id = users.user_id AND m.is_reply = 0),
+                    msg_count_today = (SELECT COUNT(*) FROM messages m
+                                       WHERE m.user_id = users.user_id AND m.is_reply = 0
+                                         AND m.created_at >= ?),
+                    last_msg_date = CASE
+                        WHEN EXISTS (SELECT 1 FROM messages m
+                                     WHERE m.user_id = users.user_id AND m.is_reply = 0
+                                       AND m.created_at >= ?)
+                        THEN ? ELSE last_msg_date END
+            """, (today_start, today_start, today)),
+        ], durable=True, fetch=True)
+        self.user_cache.clear()
+        return len(rows)
+
+    async def create_digest(self, entries: list[tuple[int, int, str]]) -> int:
+        today = date.today().isoformat()
+        statements = [("INSERT INTO digests (entry_count, created_at) VALUES (?, ?) RETURNING id",
+                       (len(entries), int(time.time())))]
+        for position, (user_id, user_msg_id, text) in enumerate(entries):
+            insert_message, update_user = self._message_statements(
+                user_id, user_msg_id, None, None, "text", text, today
+            )
+            # currval 是本连接刚插入的 ID，不受其他连接并发插入影响
+            statements += [
+                insert_message,
+                ("""
+                    INSERT INTO digest_entries (digest_id, position, message_id)
+                    VALUES (currval('digests_id_seq'), ?, currval('messages_id_seq'))
+                """, (position,)),
+                update_user,
+            ]
+        statements += self._digest_pending_deletes(entries)
+        digest_id = await self._write_many(statements, durable=True)
+        for user_id, _, _ in entries:
+            self._count_cached_message(user_id, today)
+        return digest_id
+
+    async def search_messages(self, query: str, max_id: int, limit: int,
+                              after: Optional[tuple[float, int]] = None) -> list[dict]:
+        """全文搜索留言：候选为 id 不超过 max_id、包含全部搜索词的最近 SEARCH_MAX_CANDIDATES 条
+
+        相关度为至少 3 个字的搜索词在正文中所占的比例（取负数，与 SQLite 的 rank 一样越小越相关），
+        都不足 3 个字时按时间倒序。
+        """
+        terms = query.split()
+        long_terms = [term.lower() for term in terms if len(term) >= MIN_FTS_TERM]
+        if long_terms:
+            covered = " + ".join(
+                ["(length(lower(text)) - length(replace(lower(text), ?, '')))"] * len(long_terms)
+            )
+            rank = f"-({covered})::float8 / GREATEST(length(text), 1)"
+        else:
+            rank = "0.0::float8"
+        params = [*long_terms, max_id, [escape_like(term) for term in terms],
+                  config.SEARCH_MAX_CANDIDATES]
+
+        conditions = ["m.text IS NOT NULL"]
+        if after:
+            conditions.append("(hits.rank > ? OR (hits.rank = ? AND m.id < ?))")
+            params += [after[0], after[0], after[1]]
+
+        rows = await self._fetchall(f"""
+            SELECT m.id, m.user_id, m.text, m.is_reply, m.created_at, hits.rank,
+                   u.username, u.first_name, u.last_name
+            FROM (
+                SELECT id, {rank} AS rank FROM messages
+                WHERE id <= ? AND text ILIKE ALL(?::text[])
+                ORDER BY id DESC LIMIT ?
+            ) AS hits
+            JOIN messages m ON m.id = hits.id
+            LEFT JOIN users u ON u.user_id = m.user_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY hits.rank, m.id DESC
+            LIMIT ?
+        """, (*params, limit))
+        return [dict(row) for row in rows]
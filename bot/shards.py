@@ -0,0 +1,430 @@
+"""分片工作进程：主进程接收更新，按用户 ID 分发给多个工作进程处理
+
+一个事件循环处理消息的能力受限于单核。设置 WORKERS 后，主进程（supervisor）只负责
+接收更新（轮询或 webhook）和执行写操作，WORKERS 个工作进程各自运行完整的处理器：
+user_id % WORKERS 决定由哪个进程处理，同一用户的消息总在同一进程，限流、摘要缓冲、
+用户缓存等按用户的内存状态不需要跨进程同步。管理员的按钮和回复发给目标用户所在的进程。
+
+主进程不把更新解析成 Update 对象，只从原始 JSON 中取出分发需要的几个字段，解析留给工作进程。
+跨用户的刷屏检测需要看到所有用户的消息，在主进程中分发前进行（screen），工作进程不再检测。
+SQLite 只有主进程一个写连接：工作进程的写操作经 socketpair 发给主进程的 WriteQueue，
+与其他进程的写入合并提交；读操作在工作进程自己的只读连接上执行（WAL）。
+"""
+import asyncio
+import logging
+import os
+import pickle
+import socket
+import struct
+import sys
+from typing import Callable, Optional
+
+from telegram.error import TelegramError
+
+from bot.config import config
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+
+# 回调数据 <action>_<user_id>... 中的 action，按目标用户分发
+USER_CALLBACKS = ("reply", "ban", "unban", "info", "history")
+# 第一个参数是用户 ID 的管理员命令
+USER_COMMANDS = ("/ban", "/unban", "/history")
+# 回复模式下工作进程会发送并退出回复模式的消息类型（与 handle_admin_message 一致）
+REPLY_CONTENT = ("text", "photo", "video")
+
+
+def shard_of(user_id: int, shards: int) -> int:
+    return user_id % shards
+
+
+def is_worker() -> bool:
+    return config.WORKER_INDEX >= 0
+
+
+def current_shard() -> tuple[int, int]:
+    """(本进程的分片编号, 分片数)，不分片时为 (0, 1)"""
+    if is_worker():
+        return config.WORKER_INDEX, config.WORKERS
+    return 0, 1
+
+
+def _portable(error: Exception) -> Exception:
+    """传回工作进程的异常：不能序列化的换成 RuntimeError"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+class Channel:
+    """主进程和工作进程之间的连接：消息为 长度 + pickle
+
+    send() 不立即写 socket，同一轮事件循环中的消息合并成一次发送，
+    减少系统调用和对方进程被唤醒的次数。
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._buffer: list[bytes] = []
+
+    @classmethod
+    async def open(cls, sock: socket.socket) -> "Channel":
+        return cls(*await asyncio.open_connection(sock=sock))
+
+    @property
+    def closed(self) -> bool:
+        return self.writer.is_closing()
+
+    def send(self, message: tuple):
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        if not self._buffer:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._buffer.append(_HEADER.pack(len(data)))
+        self._buffer.append(data)
+
+    async def drain(self):
+        """等待发送缓冲排空（对方处理不过来时在这里等待）"""
+        self._flush()
+        await self.writer.drain()
+
+    async def receive(self) -> Optional[tuple]:
+        """读取一条消息，连接关闭时返回 None"""
+        try:
+            header = await self.reader.readexactly(_HEADER.size)
+            return pickle.loads(await self.reader.readexactly(_HEADER.unpack(header)[0]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+    def _flush(self):
+        if self._buffer and not self.writer.is_closing():
+            self.writer.write(b"".join(self._buffer))
+        self._buffer.clear()
+
+
+class RemoteWriteQueue:
+    """工作进程一侧的写入队列：接口与 WriteQueue 相同，写操作交给主进程执行
+
+    同一连接还接收主进程分发来的原始更新（updates 队列，主进程要求停止时放入 None）。
+    """
+
+    def __init__(self):
+        self.channel: Optional[Channel] = None
+        self.updates: asyncio.Queue[Optional[dict]] = asyncio.Queue()
+        self._pending: dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self, fd: int = None):
+        """连接主进程传来的 socket（文件描述符在环境变量 WORKER_FD 中）"""
+        sock = socket.socket(fileno=fd if fd is not None else int(os.environ["WORKER_FD"]))
+        self.channel = await Channel.open(sock)
+        self._task = asyncio.create_task(self._run())
+
+    def start(self):
+        pass
+
+    def submit(self, sql: str, params: tuple = (), fetch: bool = False) -> asyncio.Future:
+        return self.submit_many([(sql, params)], fetch)
+
+    def submit_many(self, statements: list[tuple[str, tuple]],
+                    fetch: bool = False) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._next_id += 1
+        self._pending[self._next_id] = future
+        self.channel.send(("write", self._next_id, statements, fetch))
+        return future
+
+    async def flush(self):
+        await self.submit("SELECT 1")
+
+    def query(self, name: str) -> asyncio.Future:
+        """读取主进程中的状态（ShardPool.queries 中注册的名称），如刷屏检测的统计"""
+        future = asyncio.get_running_loop().create_future()
+        self._next_id += 1
+        self._pending[self._next_id] = future
+        self.channel.send(("query", self._next_id, name))
+        return future
+
+    async def close(self):
+        """等待已提交的写操作完成后断开（主进程看到连接关闭即认为本进程已退出）"""
+        if self._pending:
+            await asyncio.gather(*self._pending.values(), return_exceptions=True)
+        if self.channel:
+            self.channel.close()
+
+    async def _run(self):
+        while True:
+            message = await self.channel.receive()
+            if message is None:
+                break
+            if message[0] == "result":
+                _, op_id, error, value = message
+                future = self._pending.pop(op_id, None)
+                # 本进程中已取消（如停止时）的请求不再设置结果
+                if future is None or future.done():
+                    continue
+                if error:
+                    future.set_exception(value)
+                else:
+                    future.set_result(value)
+            elif message[0] == "update":
+                self.updates.put_nowait(message[1])
+            elif message[0] == "stop":
+                self.updates.put_nowait(None)
+        # 主进程已退出：未完成的写操作不会再有结果
+        self.updates.put_nowait(None)
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("与主进程的连接已断开"))
+        self._pending.clear()
+
+
+class UpdatePoller:
+    """长轮询 getUpdates，把原始更新（dict）放入队列，不在主进程中解析"""
+
+    def __init__(self, bot, update_queue: asyncio.Queue, allowed_updates: list[str],
+                 timeout: int = 10):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.allowed_updates = allowed_updates
+        self.timeout = timeout
+        self.offset = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止轮询，并向 Telegram 确认已收到的更新（否则重启后会再次收到）"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.offset:
+            await self._get_updates(timeout=0, limit=1)
+
+    async def _run(self):
+        delay = 1.0
+        while True:
+            try:
+                updates = await self._get_updates(timeout=self.timeout)
+            except TelegramError as e:
+                logger.warning("获取更新失败，%.0f 秒后重试: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            delay = 1.0
+            for data in updates:
+                self.offset = data["update_id"] + 1
+                await self.update_queue.put(data)
+
+    async def _get_updates(self, timeout: int, limit: int = 100) -> list[dict]:
+        # Bot API 的方法名不区分大小写；不用 Bot.get_updates 是为了拿到未解析的 JSON
+        return await self.bot.do_api_request(
+            "getupdates",
+            api_kwargs={"offset": self.offset, "timeout": timeout, "limit": limit,
+                        "allowed_updates": self.allowed_updates},
+            read_timeout=timeout + 10,
+        )
+
+
+class Worker:
+    """主进程中的一个工作进程及其连接"""
+
+    __slots__ = ("index", "process", "channel", "task")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.channel: Optional[Channel] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class ShardPool:
+    """主进程一侧：启动工作进程，按用户分发更新，执行工作进程提交的写操作
+
+    工作进程意外退出时自动重启；已发给它但还没处理完的更新会丢失，
+    已写入发件箱的消息由新进程在下次检查时重发。
+    """
+
+    def __init__(self, db, workers: int, command: list[str] = None,
+                 screen: Callable[[dict], bool] = None):
+        self.db = db
+        self.workers = [Worker(index) for index in range(workers)]
+        self.command = command or [sys.executable, "-m", "bot.main"]
+        # 分发前检查原始更新，返回 True 的更新直接丢弃（刷屏检测）
+        self.screen = screen
+        # 工作进程可以通过 query() 读取的主进程状态
+        self.queries: dict[str, Callable[[], object]] = {}
+        # 处于回复模式的管理员 → 回复对象（回复模式的状态保存在目标用户所在的进程）
+        self._replying: dict[int, int] = {}
+        self._closing = False
+        self.dispatched = 0
+        self.screened = 0
+        self.writes = 0
+
+    async def start(self):
+        await asyncio.gather(*(self._spawn(worker) for worker in self.workers))
+        logger.info("已启动 %s 个工作进程", len(self.workers))
+
+    async def run(self, update_queue: asyncio.Queue):
+        """把 update_queue 中的原始更新分发给工作进程，取到 None 时返回"""
+        while True:
+            data = await update_queue.get()
+            if data is None:
+                return
+            await self.dispatch(data)
+
+    async def dispatch(self, data: dict):
+        if self.screen and self.screen(data):
+            self.screened += 1
+            return
+        worker = self.workers[await self.route(data)]
+        while worker.channel is None or worker.channel.closed:
+            # 正在重启
+            await asyncio.sleep(0.1)
+        self.dispatched += 1
+        worker.channel.send(("update", data))
+        try:
+            await worker.channel.drain()
+        except ConnectionError:
+            logger.warning("工作进程 %s 已断开，更新 %s 可能丢失", worker.index, data.get("update_id"))
+
+    async def route(self, data: dict) -> int:
+        """更新应由哪个工作进程处理：用户的更新按用户，管理员的按操作的目标用户，其余给 0 号"""
+        # 更新中除 update_id 外只有一个字段：message、callback_query 等
+        payload = next((value for value in data.values() if isinstance(value, dict)), {})
+        user = payload.get("from") or payload.get("user")
+        if not user:
+            return 0
+        if user["id"] not in config.ADMIN_IDS:
+            return shard_of(user["id"], len(self.workers))
+        target = await self._admin_target(user["id"], data)
+        return shard_of(target, len(self.workers)) if target else 0
+
+    async def _admin_target(self, admin_id: int, data: dict) -> Optional[int]:
+        query = data.get("callback_query")
+        if query:
+            action, _, arg = (query.get("data") or "").partition("_")
+            if action == "cancelreply":
+                return self._replying.pop(admin_id, None)
+            if action in USER_CALLBACKS:
+                target = int(arg.split("_", 1)[0])
+                if action == "reply":
+                    self._replying[admin_id] = target
+                return target
+            return None
+
+        message = data.get("message")
+        if message is None:
+            return None
+        text = message.get("text", "")
+        if text.startswith("/"):
+            command, *args = text.split()
+            if command.split("@", 1)[0] in USER_COMMANDS and args and args[0].isdigit():
+                return int(args[0])
+            return None
+        if admin_id in self._replying:
+            target = self._replying[admin_id]
+            if any(key in message for key in REPLY_CONTENT):
+                del self._replying[admin_id]
+            return target
+        if "reply_to_message" in message:
+            return await self.db.get_user_id_by_forward_id(
+                message["chat"]["id"], message["reply_to_message"]["message_id"]
+            )
+        return None
+
+    async def close(self):
+        """通知工作进程停止，等它们处理完手上的更新、发完队列中的消息并退出"""
+        self._closing = True
+        for worker in self.workers:
+            if worker.channel and not worker.channel.closed:
+                worker.channel.send(("stop",))
+        await asyncio.gather(*(worker.task for worker in self.workers if worker.task))
+
+    def _worker_env(self, worker: Worker, fd: int) -> dict[str, str]:
+        """工作进程的环境变量：分片编号，以及按进程数平分的全局限额"""
+        count = len(self.workers)
+        env = dict(os.environ)
+        env.update({
+            "WORKERS": str(count),
+            "WORKER_INDEX": str(worker.index),
+            "WORKER_FD": str(fd),
+            # 同一个 token 的发送限额由所有进程共享
+            "SEND_GLOBAL_PER_SECOND": str(config.SEND_GLOBAL_PER_SECOND / count),
+            "SEND_CHAT_PER_SECOND": str(config.SEND_CHAT_PER_SECOND / count),
+            "SEND_CHAT_BURST": str(max(1.0, config.SEND_CHAT_BURST / count)),
+            "GLOBAL_RATE_LIMIT_PER_MINUTE": str(-(-config.GLOBAL_RATE_LIMIT_PER_MINUTE // count)),
+            # 工作进程没有写连接，读操作必须走只读连接
+            "DB_READ_POOL_SIZE": str(max(1, config.DB_READ_POOL_SIZE)),
+            # PostgreSQL 的连接数由所有进程共享
+            "DB_POOL_SIZE": str(max(1, config.DB_POOL_SIZE // count)),
+            # 刷屏检测已在主进程中完成
+            "SPAM_MIN_USERS": "0",
+        })
+        return env
+
+    async def _spawn(self, worker: Worker):
+        parent, child = socket.socketpair()
+        try:
+            worker.process = await asyncio.create_subprocess_exec(
+                *self.command, env=self._worker_env(worker, child.fileno()),
+                pass_fds=(child.fileno(),),
+            )
+        finally:
+            child.close()
+        worker.channel = await Channel.open(parent)
+        worker.task = asyncio.create_task(self._serve(worker))
+
+    async def _serve(self, worker: Worker):
+        """执行工作进程提交的写操作和查询，直到它断开连接；意外退出时重启"""
+        channel = worker.channel
+        while True:
+            message = await channel.receive()
+            if message is None:
+                break
+            if message[0] == "query":
+                _, op_id, name = message
+                channel.send(("result", op_id, False, self.queries[name]()))
+                continue
+            _, op_id, statements, fetch = message
+            self.writes += 1
+            future = self.db.writer.submit_many(statements, fetch)
+            future.add_done_callback(lambda f, op_id=op_id: self._reply(channel, op_id, f))
+        channel.close()
+        returncode = await worker.process.wait()
+        if not self._closing:
+            logger.error("工作进程 %s 意外退出（%s），重新启动", worker.index, returncode)
+            await self._spawn(worker)
+
+    @staticmethod
+    def _reply(channel: Channel, op_id: int, future: asyncio.Future):
+        """把写操作的结果传回工作进程"""
+        if channel.closed:
+            return
+        if future.cancelled():
+            # 主进程停止时写入队列取消了未执行的写操作；future.exception() 会抛出 CancelledError
+            channel.send(("result", op_id, True, RuntimeError("写操作已取消")))
+            return
+        error = future.exception()
+        if error:
+            channel.send(("result", op_id, True, _portable(error)))
+            return
+        value = future.result()
+        # 结果行（RETURNING）转成字典，工作进程按列名读取
+        if isinstance(value, list):
+            value = [dict(row) for row in value]
+        channel.send(("result", op_id, False, value))
+
+
+# 工作进程与主进程的连接（只在工作进程中使用）
+supervisor_link = RemoteWriteQueue()
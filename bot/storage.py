@@ -0,0 +1,111 @@
+"""存储后端接口
+
+处理器和各模块只通过 Storage 的方法读写数据，不直接执行 SQL。后端由 DB_BACKEND 选择：
+sqlite（默认，bot.database.Database）或 postgres（bot.postgres.PostgresDatabase，需要 asyncpg）。
+新的实现需要通过 python -m benchmarks.storage 中的一致性检查。
+"""
+from typing import Optional, Protocol
+
+from bot.config import config
+from bot.tenant import TenantLocal
+from bot.utils.forward_cache import ForwardCache
+from bot.utils.user_cache import UserCache, UserRecord
+from bot.utils.write_queue import WriteQueue
+
+
+class Storage(Protocol):
+    """数据访问接口；写方法默认只入队（durable=True 或返回值依赖写入结果的方法会等待提交）"""
+
+    user_cache: UserCache
+    forward_cache: ForwardCache
+    # 合并写入队列：分片主进程用它执行工作进程发来的写操作（见 bot.shards）
+    writer: WriteQueue
+
+    async def connect(self, writer=None): ...
+    async def close(self): ...
+    async def flush(self): ...
+    async def export(self, out_dir: str, fmt: str = "jsonl", start: int = None,
+                     end: int = None) -> list[tuple[str, int]]: ...
+
+    # ===== 用户 =====
+    async def get_or_create_user(self, user_id: int, username: str = None,
+                                 first_name: str = None, last_name: str = None) -> UserRecord: ...
+    async def is_user_banned(self, user_id: int) -> bool: ...
+    async def ban_user(self, user_id: int, reason: str = None): ...
+    async def unban_user(self, user_id: int): ...
+    async def get_user(self, user_id: int) -> Optional[UserRecord]: ...
+    async def assign_admin(self, user_id: int, admin_id: int): ...
+    async def get_open_conversations(self) -> list[tuple[int, int]]: ...
+    async def get_admin_user_counts(self) -> dict[int, int]: ...
+    async def get_today_msg_count(self, user_id: int) -> int: ...
+    async def get_today_msg_counts(self) -> list[tuple[int, int]]: ...
+
+    # ===== 消息 =====
+    async def save_message(self, user_id: int, user_msg_id: int,
+                           forward_msg_id: int, content_type: str, text: str = None,
+                           durable: bool = False, forward_chat_id: int = None) -> Optional[int]: ...
+    async def save_reply(self, user_id: int, sent_msg_id: int, content_type: str,
+                         text: str = None): ...
+    async def get_user_history(self, user_id: int, limit: int, before: int = None,
+                               after: int = None) -> tuple[list[dict], bool]: ...
+    async def get_user_id_by_forward_id(self, chat_id: int, forward_msg_id: int) -> Optional[int]: ...
+    async def get_message_by_forward_id(self, chat_id: int, forward_msg_id: int) -> Optional[dict]: ...
+    async def get_user_message_count(self, user_id: int) -> int: ...
+    async def recount_messages(self) -> int: ...
+
+    # ===== 频率限制 =====
+    async def get_active_cooldowns(self, now: float) -> list[tuple[int, float]]: ...
+    async def save_cooldowns(self, rows: list[tuple[int, float]]): ...
+
+    # ===== 发件箱 =====
+    async def add_outbox_item(self, dedup_key: str, kind: str, chat_id: int, method: str,
+                              payload: str, priority: int, user_id: int = None,
+                              user_msg_id: int = None, content_type: str = None,
+                              message_text: str = None) -> Optional[int]: ...
+    async def mark_outbox_sent(self, item_id: int, sent_msg_id: int): ...
+    async def mark_outbox_retry(self, item_id: int, next_attempt_at: float, error: str): ...
+    async def mark_outbox_failed(self, item_id: int, error: str): ...
+    async def get_due_outbox_items(self, now: float, limit: int = 100,
+                                   shard: int = 0, shards: int = 1) -> list[dict]: ...
+    async def purge_sent_outbox(self, hours: int): ...
+
+    # ===== 摘要 =====
+    async def create_digest(self, entries: list[tuple[int, int, str]]) -> int: ...
+    async def get_digest_page(self, digest_id: int, offset: int,
+                              limit: int) -> tuple[list[dict], int]: ...
+    async def add_digest_pending(self, user_id: int, user_msg_id: int, message: str) -> bool: ...
+    async def remove_digest_pending(self, user_id: int, user_msg_id: int): ...
+    async def get_digest_pending(self, shard: int = 0, shards: int = 1) -> list[dict]: ...
+
+    # ===== 群发 =====
+    async def create_broadcast(self, method: str, payload: str,
+                               status_chat_id: int) -> tuple[int, int]: ...
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]: ...
+    async def get_running_broadcasts(self) -> list[dict]: ...
+    async def set_broadcast_status(self, broadcast_id: int, status: str,
+                                   status_msg_id: int = None): ...
+    async def get_broadcast_recipients(self, broadcast_id: int, after: int,
+                                       limit: int) -> list[int]: ...
+    async def record_broadcast_result(self, broadcast_id: int, user_id: int, status: str,
+                                      error: str = None): ...
+    async def advance_broadcast(self, broadcast_id: int, cursor: int): ...
+
+    # ===== 搜索和统计 =====
+    async def get_last_message_id(self) -> int: ...
+    async def search_messages(self, query: str, max_id: int, limit: int,
+                              after: Optional[tuple[float, int]] = None) -> list[dict]: ...
+    async def get_stats(self) -> dict: ...
+    async def get_range_stats(self, start: str, end: str, top: int = 10) -> dict: ...
+
+
+def create_storage() -> Storage:
+    """按当前配置创建存储（只导入用到的后端，没有安装 asyncpg 时 SQLite 照常可用）"""
+    if config.DB_BACKEND == "postgres":
+        from bot.postgres import PostgresDatabase
+        return PostgresDatabase()
+    from bot.database import Database
+    return Database()
+
+
+# 全局存储实例（每个机器人一份）
+db: Storage = TenantLocal(create_storage)
@@ -0,0 +1,67 @@
+"""多机器人（租户）：一个进程、一个事件循环运行多个机器人
+
+每个机器人是一个租户，有自己的配置、数据库文件和各模块的全局实例（发件箱、限流器等）。
+各模块的全局实例是 TenantLocal 代理，按当前租户取出（首次使用时创建）真正的对象，
+所以处理器代码不需要知道自己属于哪个机器人。当前租户保存在 contextvar 中，
+在租户上下文中创建的任务、定时器都会继承。只运行一个机器人时使用默认租户，行为与之前相同。
+"""
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+
+class Tenant:
+    """一个机器人的配置和它的各模块实例"""
+
+    __slots__ = ("name", "config", "instances", "application")
+
+    # 单机器人运行时的租户（由 bot.config 创建）
+    default: Optional["Tenant"] = None
+
+    def __init__(self, name: str, config):
+        self.name = name
+        self.config = config
+        self.instances: dict["TenantLocal", Any] = {}
+        self.application = None
+
+    @staticmethod
+    def current() -> "Tenant":
+        return current_tenant.get(Tenant.default)
+
+    async def call(self, func: Callable, *args):
+        """在这个租户的上下文中执行 func(*args) 并等待结果（其中创建的任务也属于这个租户）"""
+        async def run():
+            current_tenant.set(self)
+            return await func(*args)
+        return await asyncio.create_task(run())
+
+
+current_tenant: ContextVar[Tenant] = ContextVar("current_tenant")
+
+
+class TenantLocal:
+    """每个租户各一份的对象：属性访问转发给当前租户的实例，首次访问时用 factory 创建"""
+
+    __slots__ = ("_factory",)
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+
+    def get(self) -> Any:
+        tenant = Tenant.current()
+        instance = tenant.instances.get(self)
+        if instance is None:
+            instance = tenant.instances[self] = self._factory()
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        if name in TenantLocal.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.get(), name, value)
+
+    def __len__(self) -> int:
+        return len(self.get())
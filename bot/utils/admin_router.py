@@ -0,0 +1,90 @@
+import bisect
+import hashlib
+import logging
+from collections import Counter
+
+from bot.config import config
+from bot.tenant import TenantLocal
+from bot.storage import db as default_db
+
+logger = logging.getLogger(__name__)
+
+# 每个管理员在哈希环上的虚拟节点数，越多分配越均匀
+RING_REPLICAS = 400
+
+
+def _hash(key: str) -> int:
+    # 不用内置 hash()：字符串哈希每次启动都不同，环上的位置要跨进程稳定
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class AdminRouter:
+    """把用户分配给管理员，同一用户的留言始终发给同一个管理员
+
+    首次留言（或原管理员已从 ADMIN_IDS 中移除）时按策略选择并写入 users.assigned_admin：
+    sticky 在一致性哈希环上查找，增删管理员只影响环上相邻的一段用户；
+    least_loaded 选未回复会话最少的管理员。未回复会话在转发时计入、任一管理员回复后移除。
+    每个管理员是单独的会话，发送调度器按会话限速，管理员越多转发吞吐越高。
+    """
+
+    def __init__(self, db=None, admins: list[int] = None, strategy: str = None):
+        self.db = db or default_db
+        self.admins = list(admins or config.ADMIN_IDS)
+        if not self.admins:
+            # 否则要到第一条留言转发时才在环查找 / min() 中出错
+            raise ValueError("没有可分配的管理员（ADMIN_IDS 未设置）")
+        self.strategy = strategy or config.ADMIN_ROUTING
+        points = sorted(
+            (_hash(f"{admin_id}#{i}"), admin_id)
+            for admin_id in self.admins for i in range(RING_REPLICAS)
+        )
+        self._ring_keys = [point for point, _ in points]
+        self._ring_admins = [admin_id for _, admin_id in points]
+        # 未回复的会话：用户 → 管理员，以及每个管理员的未回复数
+        self._open: dict[int, int] = {}
+        self.outstanding: Counter[int] = Counter()
+
+    async def load(self):
+        """启动时从数据库恢复未回复的会话"""
+        for user_id, admin_id in await self.db.get_open_conversations():
+            self._mark_open(user_id, admin_id)
+        logger.info("未回复会话: %s", dict(self.outstanding))
+
+    async def route(self, user_id: int) -> int:
+        """用户的留言应发给的管理员会话，并记为未回复"""
+        user = await self.db.get_user(user_id)
+        admin_id = user.assigned_admin if user else None
+        if admin_id not in self.admins:
+            admin_id = self._choose(user_id)
+            await self.db.assign_admin(user_id, admin_id)
+        self._mark_open(user_id, admin_id)
+        return admin_id
+
+    def resolve(self, user_id: int):
+        """管理员已回复，会话不再计入未回复数"""
+        admin_id = self._open.pop(user_id, None)
+        if admin_id is not None:
+            self.outstanding[admin_id] -= 1
+
+    def ring_lookup(self, user_id: int) -> int:
+        """一致性哈希环上顺时针找到的第一个管理员"""
+        index = bisect.bisect(self._ring_keys, _hash(str(user_id))) % len(self._ring_keys)
+        return self._ring_admins[index]
+
+    def _choose(self, user_id: int) -> int:
+        if self.strategy == "least_loaded":
+            return min(self.admins, key=lambda admin_id: self.outstanding[admin_id])
+        return self.ring_lookup(user_id)
+
+    def _mark_open(self, user_id: int, admin_id: int):
+        previous = self._open.get(user_id)
+        if previous == admin_id:
+            return
+        if previous is not None:
+            self.outstanding[previous] -= 1
+        self._open[user_id] = admin_id
+        self.outstanding[admin_id] += 1
+
+
+# 全局路由实例（每个机器人一份）
+admin_router = TenantLocal(AdminRouter)
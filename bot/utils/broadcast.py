@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import Forbidden
+
+from bot.config import config
+from bot.tenant import TenantLocal
+from bot.storage import db as default_db
+from bot.utils.send_scheduler import scheduler as default_scheduler, PRIORITY_BROADCAST, PRIORITY_REPLY
+
+logger = logging.getLogger(__name__)
+
+STATUS_LABELS = {
+    "draft": "待确认",
+    "running": "发送中",
+    "done": "已完成",
+    "cancelled": "已停止",
+}
+
+
+def format_progress(job: dict) -> tuple[str, InlineKeyboardMarkup]:
+    """群发状态消息的文字和按钮"""
+    done = job["sent"] + job["failed"] + job["blocked"]
+    total = job["total"] or 1
+    text = (f"📢 <b>群发 #{job['id']}</b>\n"
+            f"━━━━━━━━━━━━━━\n"
+            f"状态: {STATUS_LABELS[job['status']]}\n"
+            f"进度: {done}/{job['total']} ({done / total:.0%})\n"
+            f"✅ 成功 {job['sent']}  🚫 已屏蔽 {job['blocked']}  ❌ 失败 {job['failed']}")
+    if job["status"] == "draft":
+        keyboard = [[
+            InlineKeyboardButton("✅ 开始发送", callback_data=f"broadcast_start_{job['id']}"),
+            InlineKeyboardButton("❌ 取消", callback_data=f"broadcast_cancel_{job['id']}"),
+        ]]
+    elif job["status"] == "running":
+        keyboard = [[InlineKeyboardButton("⏹ 停止", callback_data=f"broadcast_cancel_{job['id']}")]]
+    else:
+        keyboard = []
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+class Broadcaster:
+    """群发：按 user_id keyset 分批读取收件人，以 PRIORITY_BROADCAST 交给发送调度器
+
+    发送速度由调度器的全局令牌桶决定（回复和转发优先），同时在途的发送不超过 window 条。
+    每个收件人的结果写入 broadcast_recipients，一批全部有结果后推进游标；
+    进程重启后从游标继续，并跳过已有结果的用户。
+    """
+
+    def __init__(self, db=None, scheduler=None, batch_size: int = None, window: int = None):
+        self.db = db or default_db
+        self.scheduler = scheduler or default_scheduler
+        self.batch_size = batch_size or config.BROADCAST_BATCH_SIZE
+        # 默认约 2 秒的发送量，保证调度器始终有可发的群发消息
+        self.window = window or max(1, int(self.scheduler.global_policy.rate * 2))
+        self.bot = None
+        self._jobs: dict[int, asyncio.Task] = {}
+        self._stopping: set[int] = set()
+
+    def start(self, bot):
+        self.bot = bot
+
+    async def resume(self):
+        """继续上次未完成的群发"""
+        for job in await self.db.get_running_broadcasts():
+            logger.info("继续群发 #%s（游标 %s）", job["id"], job["cursor"])
+            self.launch(job["id"])
+
+    def launch(self, broadcast_id: int):
+        if broadcast_id in self._jobs:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._jobs[broadcast_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(broadcast_id, None))
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """停止群发：不再发出新的消息，已在途的发送完成后结束
+
+        返回是否有正在运行的任务（任务结束时会自己更新状态消息）
+        """
+        await self.db.set_broadcast_status(broadcast_id, "cancelled")
+        task = self._jobs.get(broadcast_id)
+        if not task:
+            return False
+        self._stopping.add(broadcast_id)
+        await asyncio.gather(task, return_exceptions=True)
+        self._stopping.discard(broadcast_id)
+        return True
+
+    async def close(self):
+        """停止所有群发并等待在途的发送记录结果（状态保持 running，重启后继续）"""
+        tasks = list(self._jobs.values())
+        self._stopping.update(self._jobs)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._stopping.clear()
+
+    @property
+    def running(self) -> int:
+        return len(self._jobs)
+
+    async def _run(self, broadcast_id: int):
+        job = await self.db.get_broadcast(broadcast_id)
+        kwargs = json.loads(job["payload"])
+        cursor = job["cursor"]
+        slots = asyncio.Semaphore(self.window)
+        last_report = time.monotonic()
+
+        try:
+            while broadcast_id not in self._stopping:
+                recipients = await self.db.get_broadcast_recipients(broadcast_id, cursor, self.batch_size)
+                if not recipients:
+                    await self.db.set_broadcast_status(broadcast_id, "done")
+                    break
+
+                sends = []
+                for user_id in recipients:
+                    if broadcast_id in self._stopping:
+                        break
+                    await slots.acquire()
+                    future = self.scheduler.submit(
+                        self.bot, job["method"], PRIORITY_BROADCAST, chat_id=user_id, **kwargs
+                    )
+                    sends.append(asyncio.create_task(self._record(broadcast_id, user_id, future, slots)))
+                    if time.monotonic() - last_report >= config.BROADCAST_PROGRESS_SECONDS:
+                        last_report = time.monotonic()
+                        await self._report(broadcast_id)
+                await asyncio.gather(*sends)
+
+                if broadcast_id in self._stopping:
+                    break
+                # 这一批全部有结果后才推进游标，中途重启时这一批会重新筛选未发送的用户
+                cursor = recipients[-1]
+                await self.db.advance_broadcast(broadcast_id, cursor)
+        except Exception:
+            logger.exception("群发 #%s 出错，将在重启后继续", broadcast_id)
+        finally:
+            await self.db.flush()
+        await self._report(broadcast_id)
+
+    async def _record(self, broadcast_id: int, user_id: int, future: asyncio.Future,
+                      slots: asyncio.Semaphore):
+        try:
+            await future
+        except Forbidden as e:
+            await self.db.record_broadcast_result(broadcast_id, user_id, "blocked", str(e))
+        except Exception as e:
+            await self.db.record_broadcast_result(broadcast_id, user_id, "failed", str(e))
+        else:
+            await self.db.record_broadcast_result(broadcast_id, user_id, "sent")
+        finally:
+            slots.release()
+
+    async def _report(self, broadcast_id: int):
+        """编辑群发状态消息显示进度"""
+        await self.db.flush()
+        job = await self.db.get_broadcast(broadcast_id)
+        if not job or not job["status_msg_id"] or self.bot is None:
+            return
+        text, keyboard = format_progress(job)
+        try:
+            await self.scheduler.send(
+                self.bot, "edit_message_text", PRIORITY_REPLY,
+                chat_id=job["status_chat_id"], message_id=job["status_msg_id"],
+                text=text, parse_mode=ParseMode.HTML, reply_markup=keyboard,
+            )
+        except Exception as e:
+            # 内容未变化等错误不影响群发
+            logger.debug("更新群发 #%s 进度失败: %s", broadcast_id, e)
+
+
+# 全局群发实例（每个机器人一份）
+broadcaster = TenantLocal(Broadcaster)
@@ -0,0 +1,116 @@
+import asyncio
+import html
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bot.config import config
+from bot.tenant import TenantLocal
+from bot.storage import db as default_db
+
+logger = logging.getLogger(__name__)
+
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+# 摘要中每条留言最多显示的字数（完整内容仍保存在数据库中）
+ENTRY_TEXT_LIMIT = 400
+
+DigestHandler = Callable[[list], Awaitable[None]]
+
+
+class DigestBuffer:
+    """摘要模式：第一条留言到达后 window 秒内的留言攒成一批，整批交给 handler
+
+    无论同时有多少用户留言，每个窗口只给管理员发一条消息。
+    """
+
+    def __init__(self, window: float = None):
+        self.window = window if window is not None else config.DIGEST_WINDOW_SECONDS
+        self._entries: list = []
+        self._handler: Optional[DigestHandler] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def add(self, entry, handler: DigestHandler):
+        self._entries.append(entry)
+        self._handler = handler
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+    async def close(self):
+        """立即处理未满窗口的留言并等待处理完成"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if not self._entries:
+            return
+        entries, self._entries = self._entries, []
+        task = asyncio.create_task(self._run(self._handler, entries))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(handler: DigestHandler, entries: list):
+        try:
+            await handler(entries)
+        except Exception:
+            logger.exception("发送摘要失败（%s 条留言）", len(entries))
+
+
+async def build_digest_page(digest_id: int, page: int, db=None) -> Optional[tuple[str, InlineKeyboardMarkup]]:
+    """生成摘要某一页的文字和按钮（每条留言一行回复/详情/拉黑按钮，底部翻页）"""
+    db = db or default_db
+    page_size = config.DIGEST_PAGE_SIZE
+    entries, total = await db.get_digest_page(digest_id, page * page_size, page_size)
+    if not entries:
+        return None
+    pages = (total + page_size - 1) // page_size
+
+    lines = [f"📨 <b>留言摘要</b>（共 {total} 条，北京时间）", "━━━━━━━━━━━━━━"]
+    keyboard = []
+    for entry in entries:
+        number = entry["position"] + 1
+        name = f"{entry['first_name'] or ''} {entry['last_name'] or ''}".strip() or "未知用户"
+        username = f" @{entry['username']}" if entry["username"] else ""
+        sent_at = datetime.fromtimestamp(entry["created_at"], BEIJING_TZ).strftime("%H:%M:%S")
+        text = entry["text"] or ""
+        if len(text) > ENTRY_TEXT_LIMIT:
+            text = text[:ENTRY_TEXT_LIMIT] + "…"
+        lines.append(f"<b>{number}.</b> 👤 {html.escape(name)}{html.escape(username)} · {sent_at}")
+        lines.append(f"💬「{html.escape(text)}」")
+        lines.append("")
+        keyboard.append([
+            InlineKeyboardButton(f"💬 回复 {number}", callback_data=f"reply_{entry['user_id']}"),
+            InlineKeyboardButton(f"👤 {number}", callback_data=f"info_{entry['user_id']}"),
+            InlineKeyboardButton(f"🚫 {number}", callback_data=f"ban_{entry['user_id']}"),
+        ])
+
+    if pages > 1:
+        lines.append(f"第 {page + 1}/{pages} 页")
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️ 上一页", callback_data=f"digest_{digest_id}_{page - 1}"))
+        if page + 1 < pages:
+            nav.append(InlineKeyboardButton("下一页 ▶️", callback_data=f"digest_{digest_id}_{page + 1}"))
+        keyboard.append(nav)
+
+    return "\n".join(lines).rstrip(), InlineKeyboardMarkup(keyboard)
+
+
+# 全局摘要缓冲实例（每个机器人一份）
+digest_buffer = TenantLocal(DigestBuffer)
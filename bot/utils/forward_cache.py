@@ -0,0 +1,47 @@
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+
+class ForwardCache:
+    """(管理员会话, 转发消息 ID) → 用户 ID 的映射缓存，超过 max_entries 淘汰最久未用的
+
+    映射写入后不会变化，因此不需要过期时间。
+    """
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple[int, int]) -> Optional[int]:
+        user_id = self._entries.get(key)
+        if user_id is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user_id
+
+    def put(self, key: tuple[int, int], user_id: int):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = user_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def load(self, pairs: Iterable[tuple[tuple[int, int], int]]):
+        """批量写入 ((chat_id, forward_msg_id), user_id)，按从旧到新的顺序传入"""
+        for key, user_id in pairs:
+            self.put(key, user_id)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from bot.config import config
+from bot.tenant import TenantLocal
+
+logger = logging.getLogger(__name__)
+
+# Telegram 相册最多 10 条
+MAX_MEDIA_GROUP_SIZE = 10
+
+GroupHandler = Callable[[list], Awaitable[None]]
+
+
+class PendingGroup:
+    __slots__ = ("messages", "handler", "timer")
+
+    def __init__(self, handler: GroupHandler):
+        self.messages: list = []
+        self.handler = handler
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MediaGroupCollector:
+    """按 media_group_id 收集相册中的各条消息，整组交给 handler 处理一次
+
+    相册的每条消息是单独的更新，最后一条到达 window 秒后（或凑满 10 条时）视为收齐。
+    """
+
+    def __init__(self, window: float = None):
+        self.window = window if window is not None else config.MEDIA_GROUP_WINDOW_MS / 1000
+        self._groups: dict[tuple[int, str], PendingGroup] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, message, handler: GroupHandler):
+        key = (message.chat_id, message.media_group_id)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = PendingGroup(handler)
+        group.messages.append(message)
+        if group.timer:
+            group.timer.cancel()
+        if len(group.messages) >= MAX_MEDIA_GROUP_SIZE:
+            self._flush(key)
+        else:
+            group.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+    @property
+    def pending(self) -> int:
+        return len(self._groups)
+
+    async def close(self):
+        """立即处理所有未收齐的相册并等待处理完成"""
+        for key in list(self._groups):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush(self, key: tuple[int, str]):
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        if group.timer:
+            group.timer.cancel()
+        messages = sorted(group.messages, key=lambda m: m.message_id)
+        task = asyncio.create_task(self._run(group.handler, messages))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(handler: GroupHandler, messages: list):
+        try:
+            await handler(messages)
+        except Exception:
+            logger.exception("处理相册失败 (media_group_id %s)", messages[0].media_group_id)
+
+
+# 全局相册收集器实例（每个机器人一份）
+media_groups = TenantLocal(MediaGroupCollector)
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Any, Optional
+
+from telegram import (
+    InlineKeyboardMarkup, InputMediaAnimation, InputMediaAudio, InputMediaDocument,
+    InputMediaPhoto, InputMediaVideo,
+)
+from telegram.error import NetworkError, RetryAfter
+
+from bot.config import config
+from bot.tenant import TenantLocal
+from bot.storage import db as default_db
+from bot.shards import current_shard
+from bot.utils.send_scheduler import scheduler as default_scheduler, PRIORITY_FORWARD, PRIORITY_REPLY
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 600.0
+
+# 记录类型
+KIND_FORWARD = "forward"        # 转发给管理员的留言卡片，发送成功后保存消息映射
+KIND_ATTACHMENT = "attachment"  # 卡片之后单独发送的相册
+KIND_REPLY = "reply"            # 管理员回复用户
+KIND_DIGEST = "digest"          # 摘要模式下合并多条留言的消息（留言在生成摘要时已保存）
+
+_INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "animation": InputMediaAnimation,
+    "audio": InputMediaAudio,
+    "document": InputMediaDocument,
+}
+
+
+def is_retryable(error: Exception) -> bool:
+    """网络错误和限流可以重试；BadRequest、Forbidden 等重试也不会成功"""
+    return isinstance(error, (NetworkError, RetryAfter))
+
+
+def dump_payload(kwargs: dict) -> str:
+    payload = dict(kwargs)
+    if isinstance(payload.get("reply_markup"), InlineKeyboardMarkup):
+        payload["reply_markup"] = payload["reply_markup"].to_dict()
+    if payload.get("media"):
+        # send_media_group 的 InputMedia 列表
+        payload["media"] = [media.to_dict() for media in payload["media"]]
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def load_payload(payload: str, bot) -> dict:
+    kwargs = json.loads(payload)
+    if kwargs.get("reply_markup"):
+        kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(kwargs["reply_markup"], bot)
+    if kwargs.get("media"):
+        kwargs["media"] = [
+            _INPUT_MEDIA[media.pop("type")].de_json(media, bot) for media in kwargs["media"]
+        ]
+    return kwargs
+
+
+def sent_message_id(result) -> Optional[int]:
+    """发送结果的消息 ID（send_media_group 返回多条消息，取第一条）"""
+    if isinstance(result, (tuple, list)):
+        result = result[0] if result else None
+    return getattr(result, "message_id", None)
+
+
+class Outbox:
+    """持久化发件箱：先落库再发送，失败按指数退避重试，重启后继续发送未完成的记录
+
+    dedup_key 唯一，同一条更新被重复投递时不会重复转发。发送请求已发出但进程在记录结果前
+    崩溃的记录会在重启后重发（至少一次）。
+    """
+
+    def __init__(self, db=None, scheduler=None):
+        self.db = db or default_db
+        self.scheduler = scheduler or default_scheduler
+        self.bot = None
+        self._inflight: set[int] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self, bot):
+        self.bot = bot
+
+    async def enqueue(self, dedup_key: str, kind: str, method: str,
+                      priority: int = PRIORITY_FORWARD, user_id: int = None,
+                      user_msg_id: int = None, content_type: str = None,
+                      message_text: str = None, **kwargs) -> Optional[asyncio.Future]:
+        """落库后加入发送队列，返回首次发送结果的 future；重复的 dedup_key 返回 None
+
+        message_text 为留言正文，转发成功后随消息映射一起保存（用于搜索）
+        """
+        item_id = await self.db.add_outbox_item(
+            dedup_key, kind, kwargs["chat_id"], method, dump_payload(kwargs), priority,
+            user_id=user_id, user_msg_id=user_msg_id, content_type=content_type,
+            message_text=message_text,
+        )
+        if item_id is None:
+            return None
+        item = {
+            "id": item_id, "kind": kind, "chat_id": kwargs["chat_id"], "method": method,
+            "priority": priority,
+            "user_id": user_id, "user_msg_id": user_msg_id, "content_type": content_type,
+            "message_text": message_text, "attempts": 0,
+        }
+        return self._submit(item, kwargs)
+
+    async def deliver(self, dedup_key: str, kind: str, method: str,
+                      priority: int = PRIORITY_REPLY, **kwargs) -> Any:
+        """落库、发送并等待首次发送结果（失败时抛出异常，可重试的错误会在后台继续重试）"""
+        future = await self.enqueue(dedup_key, kind, method, priority, **kwargs)
+        return await future if future else None
+
+    async def drain(self, limit: int = 100):
+        """把到期的待发送记录交给发送队列"""
+        # 分片时每个工作进程只重发自己用户的记录，避免两个进程重复发送
+        for item in await self.db.get_due_outbox_items(time.time(), limit, *current_shard()):
+            if item["id"] in self._inflight:
+                continue
+            self._submit(item, load_payload(item["payload"], self.bot))
+
+    async def close(self):
+        """等待发送结果写入数据库"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def _submit(self, item: dict, kwargs: dict) -> asyncio.Future:
+        self._inflight.add(item["id"])
+        future = self.scheduler.submit(self.bot, item["method"], item["priority"], **kwargs)
+        task = asyncio.create_task(self._watch(item, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def _watch(self, item: dict, future: asyncio.Future):
+        # 结果落盘后才移出 _inflight，避免 drain 读到旧状态而重复发送
+        try:
+            sent_msg = await future
+        except Exception as e:
+            await self._on_failed(item, e)
+        else:
+            await self._on_sent(item, sent_msg)
+        finally:
+            self._inflight.discard(item["id"])
+
+    async def _on_sent(self, item: dict, result):
+        message_id = sent_message_id(result)
+        if item["kind"] == KIND_FORWARD:
+            # 保存消息映射（同时更新消息计数），与下面的状态更新在同一批次或更早提交
+            await self.db.save_message(
+                user_id=item["user_id"],
+                user_msg_id=item["user_msg_id"],
+                forward_msg_id=message_id,
+                forward_chat_id=item["chat_id"],
+                content_type=item["content_type"],
+                text=item["message_text"]
+            )
+        elif item["kind"] == KIND_REPLY and item["user_id"]:
+            # 回复记入用户的会话历史
+            await self.db.save_reply(
+                item["user_id"], message_id, item["content_type"], item["message_text"]
+            )
+        await self.db.mark_outbox_sent(item["id"], message_id)
+
+    async def _on_failed(self, item: dict, error: Exception):
+        attempts = item["attempts"] + 1
+        if is_retryable(error) and attempts < config.OUTBOX_MAX_ATTEMPTS:
+            delay = min(MAX_RETRY_DELAY, config.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            await self.db.mark_outbox_retry(item["id"], time.time() + delay, str(error))
+        else:
+            logger.error("发件箱记录 %s 放弃发送: %s", item["id"], error)
+            await self.db.mark_outbox_failed(item["id"], str(error))
+
+
+# 全局发件箱实例（每个机器人一份）
+outbox = TenantLocal(Outbox)
@@ -0,0 +1,274 @@
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional
+
+from bot.config import config
+from bot.tenant import TenantLocal
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowState:
+    __slots__ = ("window_start", "prev_count", "curr_count")
+
+    def __init__(self, now: float):
+        self.window_start = now
+        self.prev_count = 0.0
+        self.curr_count = 0.0
+
+
+class SlidingWindowPolicy:
+    """滑动窗口计数（用上一窗口计数按比例加权近似，每个 key 只需三个数字）"""
+
+    def __init__(self, limit: int, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+
+    @property
+    def max_cost(self) -> float:
+        """一次能计入的最大 cost"""
+        return self.limit
+
+    def new_state(self, now: float) -> SlidingWindowState:
+        return SlidingWindowState(now)
+
+    def acquire(self, state: SlidingWindowState, now: float, cost: float) -> bool:
+        elapsed = now - state.window_start
+        if elapsed >= self.window:
+            # 滚动窗口：相邻窗口保留计数，更久以前的直接清零
+            state.prev_count = state.curr_count if elapsed < 2 * self.window else 0.0
+            state.curr_count = 0.0
+            state.window_start = now - (elapsed % self.window)
+            elapsed = now - state.window_start
+        weight = 1.0 - elapsed / self.window
+        if state.prev_count * weight + state.curr_count + cost > self.limit:
+            return False
+        state.curr_count += cost
+        return True
+
+    def release(self, state: SlidingWindowState, cost: float):
+        """退还 acquire 计入的 cost（后续检查拒绝时使用）"""
+        state.curr_count = max(0.0, state.curr_count - cost)
+
+    def is_idle(self, state: SlidingWindowState, now: float) -> bool:
+        return now - state.window_start >= 2 * self.window
+
+
+class TokenBucketState:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now
+
+
+class TokenBucketPolicy:
+    """令牌桶：每秒补充 rate 个令牌，最多积攒 capacity 个"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+
+    @property
+    def max_cost(self) -> float:
+        """一次能计入的最大 cost"""
+        return self.capacity
+
+    def new_state(self, now: float) -> TokenBucketState:
+        return TokenBucketState(self.capacity, now)
+
+    def acquire(self, state: TokenBucketState, now: float, cost: float) -> bool:
+        tokens = min(self.capacity, state.tokens + (now - state.updated_at) * self.rate)
+        state.updated_at = now
+        if tokens < cost:
+            state.tokens = tokens
+            return False
+        state.tokens = tokens - cost
+        return True
+
+    def release(self, state: TokenBucketState, cost: float):
+        """退还 acquire 取走的令牌（后续检查拒绝时使用）"""
+        state.tokens = min(self.capacity, state.tokens + cost)
+
+    def wait_time(self, state: TokenBucketState, now: float, cost: float = 1.0) -> float:
+        """距离攒够 cost 个令牌还需等待的秒数"""
+        tokens = min(self.capacity, state.tokens + (now - state.updated_at) * self.rate)
+        return max(0.0, (cost - tokens) / self.rate)
+
+    def is_idle(self, state: TokenBucketState, now: float) -> bool:
+        return state.tokens + (now - state.updated_at) * self.rate >= self.capacity
+
+
+class UserLimitState:
+    __slots__ = ("window", "cooldown_until", "day", "day_count")
+
+    def __init__(self, window):
+        self.window = window
+        self.cooldown_until = 0.0
+        self.day = 0
+        self.day_count = 0
+
+
+def build_policy(algorithm: str, per_minute: int):
+    """根据配置名称构建限流策略"""
+    if algorithm == "token_bucket":
+        return TokenBucketPolicy(rate=per_minute / 60.0, capacity=per_minute)
+    if algorithm == "sliding_window":
+        return SlidingWindowPolicy(limit=per_minute, window=60.0)
+    raise ValueError(f"未知的限流算法: {algorithm}")
+
+
+def parse_costs(spec: str) -> dict[str, float]:
+    """解析 "photo:2,voice:3" 形式的消息类型权重"""
+    costs = {}
+    for item in spec.split(","):
+        if ":" not in item:
+            continue
+        content_type, cost = item.split(":", 1)
+        costs[content_type.strip()] = float(cost)
+    return costs
+
+
+class RateLimiter:
+    """内存限流器：按用户和全局策略判定，冷却状态定期快照到数据库"""
+
+    def __init__(self, user_policy=None, global_policy=None,
+                 per_day: int = None, cooldown_minutes: int = None,
+                 costs: dict[str, float] = None,
+                 clock: Callable[[], float] = time.time):
+        self.user_policy = user_policy or build_policy(
+            config.RATE_LIMIT_ALGORITHM, config.RATE_LIMIT_PER_MINUTE
+        )
+        if global_policy is None and config.GLOBAL_RATE_LIMIT_PER_MINUTE > 0:
+            global_policy = build_policy(
+                config.RATE_LIMIT_ALGORITHM, config.GLOBAL_RATE_LIMIT_PER_MINUTE
+            )
+        self.global_policy = global_policy
+        self.per_day = per_day if per_day is not None else config.RATE_LIMIT_PER_DAY
+        self.cooldown = 60.0 * (
+            cooldown_minutes if cooldown_minutes is not None else config.COOLDOWN_MINUTES
+        )
+        self.costs = self._cap_costs(
+            costs if costs is not None else parse_costs(config.RATE_LIMIT_COSTS)
+        )
+        self.clock = clock
+
+        self._users: dict[int, UserLimitState] = {}
+        self._global_state = global_policy.new_state(clock()) if global_policy else None
+        self._dirty: set[int] = set()
+        self._day = 0
+        self._day_end = 0.0
+
+    def _cap_costs(self, costs: dict[str, float]) -> dict[str, float]:
+        """超过额度的权重永远无法通过（每条都会触发冷却），按额度封顶"""
+        limit = self.user_policy.max_cost
+        if self.global_policy is not None:
+            limit = min(limit, self.global_policy.max_cost)
+        capped = {}
+        for content_type, cost in costs.items():
+            if cost > limit:
+                logger.warning("RATE_LIMIT_COSTS 中 %s 的权重 %s 超过每分钟额度，按 %s 计算",
+                               content_type, cost, limit)
+                cost = limit
+            capped[content_type] = cost
+        return capped
+
+    def _today(self, now: float) -> int:
+        if now >= self._day_end:
+            today = date.fromtimestamp(now)
+            self._day = today.toordinal()
+            tomorrow = datetime.combine(today + timedelta(days=1), datetime.min.time())
+            self._day_end = tomorrow.timestamp()
+        return self._day
+
+    def _state(self, user_id: int, now: float) -> UserLimitState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = UserLimitState(self.user_policy.new_state(now))
+            self._users[user_id] = state
+        return state
+
+    def check(self, user_id: int, content_type: str = "text") -> tuple[bool, str]:
+        """返回 (是否允许, 原因)"""
+        now = self.clock()
+        state = self._state(user_id, now)
+
+        # 检查冷却
+        if now < state.cooldown_until:
+            remaining = int((state.cooldown_until - now) / 60) + 1
+            return False, f"发送过于频繁，请 {remaining} 分钟后再试"
+
+        # 检查每日限制
+        today = self._today(now)
+        if state.day != today:
+            state.day = today
+            state.day_count = 0
+        if state.day_count >= self.per_day:
+            return False, "已达到今日消息上限，请明天再试"
+
+        # 检查用户频率，超限触发冷却
+        cost = self.costs.get(content_type, 1.0)
+        if not self.user_policy.acquire(state.window, now, cost):
+            state.cooldown_until = now + self.cooldown
+            state.window = self.user_policy.new_state(now)
+            self._dirty.add(user_id)
+            return False, f"发送过于频繁，请 {int(self.cooldown / 60)} 分钟后再试"
+
+        # 检查全局频率；被全局限流拒绝的消息不占用该用户的额度
+        if self._global_state is not None and \
+                not self.global_policy.acquire(self._global_state, now, cost):
+            self.user_policy.release(state.window, cost)
+            return False, "当前留言人数较多，请稍后再试"
+
+        state.day_count += 1
+        return True, ""
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    # ===== 持久化 =====
+
+    async def restore(self, db):
+        """启动时从数据库恢复冷却状态和今日计数"""
+        now = self.clock()
+        today = self._today(now)
+        for user_id, count in await db.get_today_msg_counts():
+            state = self._state(user_id, now)
+            state.day = today
+            state.day_count = count
+        for user_id, cooldown_until in await db.get_active_cooldowns(now):
+            self._state(user_id, now).cooldown_until = cooldown_until
+
+    async def snapshot(self, db):
+        """把有变化的冷却状态写入数据库，并清理空闲用户的状态"""
+        now = self.clock()
+        if self._dirty:
+            dirty, self._dirty = self._dirty, set()
+            rows = [
+                (user_id, self._users[user_id].cooldown_until)
+                for user_id in dirty if user_id in self._users
+            ]
+            try:
+                await db.save_cooldowns(rows)
+            except Exception:
+                # 写入失败：下次快照重试（写入期间新变化的用户已在新的集合中）
+                self._dirty |= dirty
+                raise
+        self.evict_idle(now)
+
+    def evict_idle(self, now: Optional[float] = None):
+        now = self.clock() if now is None else now
+        today = self._today(now)
+        idle = [
+            user_id for user_id, state in self._users.items()
+            if state.cooldown_until <= now
+            and (state.day != today or state.day_count == 0)
+            and self.user_policy.is_idle(state.window, now)
+        ]
+        for user_id in idle:
+            del self._users[user_id]
+
+
+# 全局限流器实例（每个机器人一份）
+rate_limiter = TenantLocal(RateLimiter)
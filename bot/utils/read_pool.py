@@ -0,0 +1,65 @@
+import asyncio
+from typing import Optional
+
+import aiosqlite
+
+# 所有连接共用的调优参数
+COMMON_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",      # 每个连接 16MB 页缓存
+    "PRAGMA mmap_size = 268435456",    # 最多 256MB 内存映射读
+)
+
+# 写连接：WAL 模式下 synchronous=NORMAL 只在检查点时 fsync，进程崩溃不丢已提交的事务
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+) + COMMON_PRAGMAS
+
+READER_PRAGMAS = ("PRAGMA query_only = ON",) + COMMON_PRAGMAS
+
+
+async def apply_pragmas(conn: aiosqlite.Connection, pragmas: tuple[str, ...]):
+    for pragma in pragmas:
+        await conn.execute(pragma)
+
+
+class ReadPool:
+    """只读连接池：每个连接有自己的线程，WAL 模式下读操作不等待写事务提交"""
+
+    def __init__(self, db_path: str, size: int = 3):
+        self.db_path = db_path
+        self.size = size
+        self._idle: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+        self._conns: list[aiosqlite.Connection] = []
+        self.waits = 0
+
+    async def open(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(self.db_path)
+            conn.row_factory = aiosqlite.Row
+            await apply_pragmas(conn, READER_PRAGMAS)
+            self._conns.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._conns:
+            await conn.close()
+        self._conns = []
+        self._idle = None
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> list[aiosqlite.Row]:
+        if self._idle.empty():
+            self.waits += 1
+        conn = await self._idle.get()
+        try:
+            cursor = await conn.execute(sql, params)
+            return await cursor.fetchall()
+        finally:
+            self._idle.put_nowait(conn)
+
+    async def fetchone(self, sql: str, params: tuple = ()) -> Optional[aiosqlite.Row]:
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
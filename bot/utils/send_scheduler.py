@@ -0,0 +1,213 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Optional
+
+from telegram.error import RetryAfter
+
+from bot.config import config
+from bot.utils.rate_limiter import TokenBucketPolicy
+
+logger = logging.getLogger(__name__)
+
+# 优先级（数字越小越先发送）
+PRIORITY_REPLY = 0      # 管理员回复用户
+PRIORITY_FORWARD = 1    # 转发用户留言给管理员
+PRIORITY_BROADCAST = 2  # 群发，只占用回复和转发剩下的发送额度
+
+MAX_RETRY_AFTER_ATTEMPTS = 5
+
+
+class SendItem:
+    __slots__ = ("priority", "seq", "bot", "method", "kwargs", "future", "attempts")
+
+    def __init__(self, priority: int, seq: int, bot, method: str, kwargs: dict,
+                 future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.bot = bot
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+    def __lt__(self, other: "SendItem") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ChatLane:
+    """一个机器人发往单个会话的待发队列：按优先级排序，同一会话同时只发一条
+
+    bot_bucket 是所属机器人的全局令牌桶状态（Telegram 的限额按机器人计算）
+    """
+
+    __slots__ = ("heap", "bucket", "bot_bucket", "blocked_until", "busy")
+
+    def __init__(self, bucket, bot_bucket):
+        self.heap: list[SendItem] = []
+        self.bucket = bucket
+        self.bot_bucket = bot_bucket
+        self.blocked_until = 0.0
+        self.busy = False
+
+
+class SendScheduler:
+    """统一的出站发送调度：按会话和全局令牌桶限速，管理员回复优先，自动遵守 RetryAfter
+
+    多个机器人共用一个调度器时，会话队列按 (机器人, chat_id) 区分，每个机器人有自己的全局令牌桶。
+    """
+
+    def __init__(self, global_per_second: float = None, chat_per_second: float = None,
+                 chat_burst: float = None):
+        global_per_second = global_per_second or config.SEND_GLOBAL_PER_SECOND
+        chat_per_second = chat_per_second or config.SEND_CHAT_PER_SECOND
+        chat_burst = chat_burst or config.SEND_CHAT_BURST
+        self.global_policy = TokenBucketPolicy(global_per_second, global_per_second)
+        self.chat_policy = TokenBucketPolicy(chat_per_second, chat_burst)
+        self._bot_buckets: dict[int, object] = {}
+        self._lanes: dict[tuple[int, int], ChatLane] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set[asyncio.Task] = set()
+        self._closing = False
+
+        self.sent = 0
+        self.failed = 0
+        self.retry_after_hits = 0
+        self.pending = {PRIORITY_REPLY: 0, PRIORITY_FORWARD: 0, PRIORITY_BROADCAST: 0}
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, bot, method: str, priority: int = PRIORITY_FORWARD,
+               **kwargs) -> asyncio.Future:
+        """把 bot.<method>(**kwargs) 加入发送队列，返回发送结果的 future"""
+        future = asyncio.get_running_loop().create_future()
+        item = SendItem(priority, next(self._seq), bot, method, kwargs, future)
+        self._push(item)
+        return future
+
+    async def send(self, bot, method: str, priority: int = PRIORITY_REPLY, **kwargs):
+        """入队并等待发送完成"""
+        return await self.submit(bot, method, priority, **kwargs)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(self.pending.values())
+
+    async def close(self, timeout: float = 10.0):
+        """等待队列发送完毕（最多 timeout 秒）后停止"""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.queue_depth or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def _push(self, item: SendItem):
+        key = (id(item.bot), item.kwargs["chat_id"])
+        lane = self._lanes.get(key)
+        if lane is None:
+            now = time.monotonic()
+            bot_bucket = self._bot_buckets.get(key[0])
+            if bot_bucket is None:
+                bot_bucket = self._bot_buckets[key[0]] = self.global_policy.new_state(now)
+            lane = self._lanes[key] = ChatLane(self.chat_policy.new_state(now), bot_bucket)
+        heapq.heappush(lane.heap, item)
+        self.pending[item.priority] = self.pending.get(item.priority, 0) + 1
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _next_ready(self, now: float) -> tuple[Optional[tuple[int, int]], float]:
+        """选出会话和所属机器人都有额度、优先级最高的会话队列；否则返回最短等待时间"""
+        best_key, best_item, wait = None, None, 60.0
+        idle = []
+        for key, lane in self._lanes.items():
+            if lane.busy:
+                continue
+            if not lane.heap:
+                # 令牌已回满的空闲会话可以丢弃，避免会话表无限增长
+                if lane.blocked_until <= now and self.chat_policy.is_idle(lane.bucket, now):
+                    idle.append(key)
+                continue
+            ready_in = max(lane.blocked_until - now,
+                           self.chat_policy.wait_time(lane.bucket, now),
+                           self.global_policy.wait_time(lane.bot_bucket, now))
+            if ready_in > 0:
+                wait = min(wait, ready_in)
+                continue
+            if best_item is None or lane.heap[0] < best_item:
+                best_key, best_item = key, lane.heap[0]
+        for key in idle:
+            del self._lanes[key]
+        return best_key, wait
+
+    async def _run(self):
+        while not self._closing:
+            self._wakeup.clear()
+            now = time.monotonic()
+            key, wait = self._next_ready(now)
+            if key is not None:
+                self._dispatch(key, now)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, key: tuple[int, int], now: float):
+        lane = self._lanes[key]
+        item = heapq.heappop(lane.heap)
+        self.pending[item.priority] -= 1
+        self.chat_policy.acquire(lane.bucket, now, 1)
+        self.global_policy.acquire(lane.bot_bucket, now, 1)
+        lane.busy = True
+        task = asyncio.create_task(self._send(lane, item))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, lane: ChatLane, item: SendItem):
+        try:
+            item.attempts += 1
+            result = await getattr(item.bot, item.method)(**item.kwargs)
+        except RetryAfter as e:
+            self.retry_after_hits += 1
+            lane.blocked_until = time.monotonic() + float(e.retry_after)
+            if item.attempts < MAX_RETRY_AFTER_ATTEMPTS:
+                logger.warning("发送受限，%s 秒后重试 (chat %s)", e.retry_after, item.kwargs["chat_id"])
+                heapq.heappush(lane.heap, item)
+                self.pending[item.priority] += 1
+            else:
+                self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.sent += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            lane.busy = False
+            self._wakeup.set()
+
+    def _fail(self, item: SendItem, error: Exception):
+        self.failed += 1
+        logger.error("发送失败 (%s -> chat %s): %s", item.method, item.kwargs["chat_id"], error)
+        if not item.future.done():
+            item.future.set_exception(error)
+            # 未被等待的 future 也不要触发 "never retrieved" 警告
+            item.future.exception()
+
+
+# 全局发送调度器实例
+scheduler = SendScheduler()
@@ -0,0 +1,189 @@
+import re
+import time
+from collections import deque
+from itertools import islice
+from typing import Callable, Optional
+
+from bot.config import config
+from bot.tenant import TenantLocal
+from bot.shards import is_worker, supervisor_link
+
+# MinHash 签名长度（one-permutation hashing：按哈希值分桶，每桶取最小值）。
+# 每个值只保留低 8 位（b-bit MinHash），整个签名 64 字节，比较时一次异或即可
+NUM_BINS = 64
+# LSH 分段：BANDS 段 × ROWS 行。相似度 0.7 的文本约 99% 概率至少有一段完全相同，
+# 相似度 0.3 的只有约 12% 会成为候选
+BANDS = 16
+ROWS = NUM_BINS // BANDS
+SHINGLE_SIZE = 4
+# 每个分段桶只比较最近的若干条指纹，常见短语形成的大桶不会拖慢检测
+BUCKET_SCAN_LIMIT = 16
+QUARANTINE_SIZE = 50
+
+_MASK = (1 << 64) - 1
+_EMPTY = 0xFFFFFFFF
+_COLLISION = 1 / 256
+_NOISE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """去掉空白和标点并转小写，避免靠插入符号绕过"""
+    return _NOISE.sub("", text).lower()
+
+
+def minhash(text: str) -> bytes:
+    """字符 shingle 集合的 MinHash 签名（每个 shingle 只计算一次哈希）"""
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    signature = [_EMPTY] * NUM_BINS
+    for shingle in shingles:
+        h = hash(shingle) & _MASK
+        b = h % NUM_BINS
+        v = (h >> 32) & _EMPTY
+        if v < signature[b]:
+            signature[b] = v
+    # 空桶借用下一个非空桶的值（densification），保证短文本的签名也可比较
+    for i in range(NUM_BINS):
+        if signature[i] == _EMPTY:
+            for j in range(1, NUM_BINS):
+                v = signature[(i + j) % NUM_BINS]
+                if v != _EMPTY:
+                    signature[i] = v
+                    break
+    return bytes(v & 0xFF for v in signature)
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """由签名估计 Jaccard 相似度"""
+    return _similarity(int.from_bytes(a, "big"), int.from_bytes(b, "big"))
+
+
+def _similarity(a: int, b: int) -> float:
+    # 相同的值异或后为 0 字节；减去低 8 位偶然相同的概率 1/256
+    matches = (a ^ b).to_bytes(NUM_BINS, "big").count(0) / NUM_BINS
+    return (matches - _COLLISION) / (1 - _COLLISION)
+
+
+class Fingerprint:
+    __slots__ = ("user_id", "created_at", "signature", "keys")
+
+    def __init__(self, user_id: int, created_at: float, signature: Optional[int], keys: list):
+        self.user_id = user_id
+        self.created_at = created_at
+        self.signature = signature
+        self.keys = keys
+
+
+class SpamFilter:
+    """跨用户的近似重复内容检测
+
+    文字按 MinHash + LSH 分段索引，媒体按 file_unique_id 精确匹配。window 秒内有
+    min_users 个不同用户发送了相似内容（相似度不低于 threshold）时判定为刷屏。
+    指纹按时间淘汰，最多保留 max_entries 条。
+    """
+
+    def __init__(self, threshold: float = None, min_users: int = None, window: float = None,
+                 max_entries: int = None, min_text_length: int = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold if threshold is not None else config.SPAM_SIMILARITY
+        self.min_users = min_users if min_users is not None else config.SPAM_MIN_USERS
+        self.window = window if window is not None else config.SPAM_WINDOW_SECONDS
+        self.max_entries = max_entries if max_entries is not None else config.SPAM_MAX_FINGERPRINTS
+        self.min_text_length = min_text_length if min_text_length is not None \
+            else config.SPAM_MIN_TEXT_LENGTH
+        self.clock = clock
+
+        self._entries: deque[Fingerprint] = deque()
+        self._buckets: dict[int, list[Fingerprint]] = {}
+        self.checked = 0
+        self.flagged = 0
+        # 隔离的消息 (时间戳, user_id, 显示名, 内容预览)，供管理员 /spam 查看
+        self.quarantined: deque[tuple[float, int, str, str]] = deque(maxlen=QUARANTINE_SIZE)
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_users > 0
+
+    def check(self, user_id: int, text: Optional[str] = None,
+              file_id: Optional[str] = None) -> bool:
+        """记录这条内容的指纹，返回是否判定为刷屏"""
+        now = self.clock()
+        self._evict(now)
+        self.checked += 1
+
+        keys = []
+        signature = None
+        users = {user_id}
+        if file_id:
+            key = hash(("file", file_id))
+            keys.append(key)
+            users.update(fp.user_id for fp in self._buckets.get(key, ()))
+        if text:
+            text = normalize(text)
+            if len(text) >= self.min_text_length:
+                digest = minhash(text)
+                band_keys = [
+                    hash((band, digest[band * ROWS:(band + 1) * ROWS]))
+                    for band in range(BANDS)
+                ]
+                signature = int.from_bytes(digest, "big")
+                keys.extend(band_keys)
+                self._add_similar_users(signature, band_keys, users)
+
+        if not keys:
+            return False
+        fingerprint = Fingerprint(user_id, now, signature, keys)
+        self._entries.append(fingerprint)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(fingerprint)
+
+        if len(users) >= self.min_users:
+            self.flagged += 1
+            return True
+        return False
+
+    def _add_similar_users(self, signature: int, band_keys: list[int], users: set[int]):
+        """把候选桶中内容相似的用户加入 users，凑够 min_users 即停止"""
+        seen = set()
+        for key in band_keys:
+            bucket = self._buckets.get(key)
+            if not bucket:
+                continue
+            for fp in islice(reversed(bucket), BUCKET_SCAN_LIMIT):
+                if fp.user_id in users or id(fp) in seen:
+                    continue
+                seen.add(id(fp))
+                if fp.signature is not None and _similarity(signature, fp.signature) >= self.threshold:
+                    users.add(fp.user_id)
+                    if len(users) >= self.min_users:
+                        return
+
+    def _evict(self, now: float):
+        cutoff = now - self.window
+        while self._entries and (self._entries[0].created_at < cutoff
+                                 or len(self._entries) >= self.max_entries):
+            fingerprint = self._entries.popleft()
+            for key in fingerprint.keys:
+                # 指纹按时间顺序加入各个桶，最旧的一条总在桶首
+                bucket = self._buckets[key]
+                del bucket[0]
+                if not bucket:
+                    del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def snapshot(self) -> dict:
+        """统计和隔离列表（/stats、/spam 显示用，可序列化后传给工作进程）"""
+        return {"enabled": self.enabled, "checked": self.checked, "flagged": self.flagged,
+                "fingerprints": len(self), "quarantined": list(self.quarantined)}
+
+
+# 全局刷屏检测实例（每个机器人一份）
+spam_filter = TenantLocal(SpamFilter)
+
+
+async def spam_snapshot() -> dict:
+    """当前的刷屏检测统计：分片时检测在主进程中进行（见 bot.shards），向主进程查询"""
+    if is_worker():
+        return await supervisor_link.query("spam")
+    return spam_filter.snapshot()
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Any, Awaitable, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """并发处理更新，但同一用户的更新按到达顺序逐条处理
+
+    先按用户排队再占用并发名额，刷屏用户排队中的更新不会占满名额、拖慢其他用户。
+    父类的信号量只用来限制排队中的更新总数（max_pending_updates）。
+    """
+
+    __slots__ = ("concurrency", "_workers", "_user_locks")
+
+    def __init__(self, concurrency: int, max_pending_updates: int = 10000):
+        super().__init__(max(max_pending_updates, concurrency, 2))
+        self.concurrency = concurrency
+        self._workers = asyncio.BoundedSemaphore(concurrency)
+        # user_id -> [锁, 持有或等待该锁的更新数]
+        self._user_locks: dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user_id = _get_user_id(update)
+        if user_id is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(user_id)
+        if entry is None:
+            entry = self._user_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[user_id]
+
+    async def initialize(self) -> None:
+        """无需初始化"""
+
+    async def shutdown(self) -> None:
+        """无需清理"""
+
+    @property
+    def active_users(self) -> int:
+        return len(self._user_locks)
+
+
+def _get_user_id(update: object) -> Optional[int]:
+    user = getattr(update, "effective_user", None)
+    return user.id if user else None
@@ -0,0 +1,121 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class UserRecord:
+    """users 表的一行（用 __slots__ 代替 dict，减少缓存内存占用）"""
+
+    __slots__ = (
+        "user_id", "username", "first_name", "last_name", "is_banned", "ban_reason",
+        "msg_count", "msg_count_today", "last_msg_date", "created_at", "assigned_admin",
+    )
+
+    def __init__(self, user_id: int, username: str = None, first_name: str = None,
+                 last_name: str = None, is_banned: int = 0, ban_reason: str = None,
+                 msg_count: int = 0, msg_count_today: int = 0,
+                 last_msg_date: str = None, created_at: int = None, assigned_admin: int = None):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.is_banned = is_banned
+        self.ban_reason = ban_reason
+        self.msg_count = msg_count
+        self.msg_count_today = msg_count_today
+        self.last_msg_date = last_msg_date
+        self.created_at = created_at
+        self.assigned_admin = assigned_admin
+
+    @classmethod
+    def from_row(cls, row) -> "UserRecord":
+        return cls(**{name: row[name] for name in cls.__slots__})
+
+    @property
+    def display_name(self) -> str:
+        return f"{self.first_name or ''} {self.last_name or ''}".strip()
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# 每条缓存除记录本身外的开销：OrderedDict 节点、键、(过期时间, 记录, 大小) 元组
+ENTRY_OVERHEAD = 200
+
+
+def record_size(record: UserRecord) -> int:
+    """一条缓存记录大约占用的字节数（记录对象和其中的字符串）"""
+    size = ENTRY_OVERHEAD + sys.getsizeof(record)
+    for name in UserRecord.__slots__:
+        value = getattr(record, name)
+        if isinstance(value, str):
+            size += sys.getsizeof(value)
+    return size
+
+
+class UserCache:
+    """用户资料 LRU 缓存：条目数超过 max_entries 或估算的内存超过 max_bytes（0 表示不限制）时
+    淘汰最久未用的，超过 ttl 秒视为过期"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 600.0, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, UserRecord, int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, record, _ = entry
+        if time.monotonic() >= expires_at:
+            self._remove(user_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return record
+
+    def put(self, record: UserRecord):
+        if self.max_entries <= 0:
+            return
+        self._remove(record.user_id)
+        size = record_size(record)
+        self._entries[record.user_id] = (time.monotonic() + self.ttl, record, size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or \
+                (self.max_bytes and self.bytes > self.max_bytes and len(self._entries) > 1):
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def peek(self, user_id: int) -> Optional[UserRecord]:
+        """不计入命中统计、不调整顺序地读取（用于写入后同步缓存）"""
+        entry = self._entries.get(user_id)
+        return entry[1] if entry else None
+
+    def invalidate(self, user_id: int):
+        self._remove(user_id)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def _remove(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry:
+            self.bytes -= entry[2]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import sqlite3
+from typing import Any, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+def check_connection_internals(conn: aiosqlite.Connection):
+    """合并提交要在 aiosqlite 的连接线程中直接使用 sqlite3 连接（Connection._execute / _conn），
+    aiosqlite 没有对应的公开接口，所以 requirements.txt 固定了版本。升级后这两个内部属性不存在时
+    在启动时报错，而不是每次写入都失败"""
+    if not callable(getattr(conn, "_execute", None)) or \
+            not isinstance(getattr(conn, "_conn", None), sqlite3.Connection):
+        raise RuntimeError(
+            f"aiosqlite {getattr(aiosqlite, '__version__', '?')} 不兼容合并写入队列"
+            f"（缺少 Connection._execute / _conn），请安装 requirements.txt 中固定的版本"
+        )
+
+
+class WriteOp:
+    __slots__ = ("statements", "future", "fetch")
+
+    def __init__(self, statements: list[tuple[str, tuple]], future: asyncio.Future,
+                 fetch: bool = False):
+        self.statements = statements
+        self.future = future
+        self.fetch = fetch
+
+
+class WriteQueue:
+    """写入合并队列：把并发的写操作攒成一批，在同一个事务里提交
+
+    队列一空就提交，不额外等待：没有并发时每次写入单独提交，不增加延迟；
+    提交进行中入队的写操作在下一批合并提交（每批最多 max_batch 条）。
+    submit() 返回的 future 在所在事务提交后得到 lastrowid（fetch=True 时为结果行，
+    用于 RETURNING 语句），需要落盘保证的调用方可以 await。
+    submit_many() 提交的多条语句作为一个整体执行，要么全部生效要么全部回滚。
+    """
+
+    def __init__(self, conn: aiosqlite.Connection, max_batch: int = 50):
+        self.conn = conn
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue[Optional[WriteOp]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.ops = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, sql: str, params: tuple = (), fetch: bool = False) -> asyncio.Future:
+        return self.submit_many([(sql, params)], fetch)
+
+    def submit_many(self, statements: list[tuple[str, tuple]],
+                    fetch: bool = False) -> asyncio.Future:
+        """原子地执行多条语句，future 的结果取自第一条语句"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(WriteOp(statements, future, fetch))
+        return future
+
+    async def flush(self):
+        """等待当前已入队的写操作全部提交"""
+        await self.submit("SELECT 1")
+
+    async def close(self):
+        """提交剩余写操作并停止后台任务"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            op = await self._queue.get()
+            if op is None:
+                break
+            batch = [op]
+            # 只取已经在排队的写操作（上一批提交期间入队的），不等待新的
+            while len(batch) < self.max_batch:
+                try:
+                    op = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if op is None:
+                    stopping = True
+                    break
+                batch.append(op)
+            await self._commit(batch)
+
+    async def _commit(self, batch: list[WriteOp]):
+        results = await self._execute_batch(batch)
+        self.batches += 1
+        self.ops += len(batch)
+        for op, result in zip(batch, results):
+            if op.future.done():
+                continue
+            if isinstance(result, Exception):
+                op.future.set_exception(result)
+            else:
+                op.future.set_result(result)
+
+    async def _execute_batch(self, batch: list[WriteOp]) -> list[Any]:
+        """在一个事务里执行一批写操作，返回每个写操作的结果或异常（其他数据库的实现覆盖这个方法）"""
+        # 整批在 aiosqlite 的连接线程中一次执行：逐条 await 每条语句都要切换一次线程，
+        # 多进程共用一个写连接（见 bot.shards）时这是写入吞吐的上限。
+        # 用到的是 aiosqlite 的内部接口，见 check_connection_internals
+        return await self.conn._execute(self._commit_batch, batch)
+
+    def _commit_batch(self, batch: list[WriteOp]) -> list[Any]:
+        """在连接线程中执行：返回每个写操作的结果或异常"""
+        conn = self.conn._conn
+        results: list[Any] = []
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            for op in batch:
+                grouped = len(op.statements) > 1
+                try:
+                    if grouped:
+                        conn.execute("SAVEPOINT write_op")
+                    results.append(self._execute(conn, op))
+                    if grouped:
+                        conn.execute("RELEASE write_op")
+                except Exception as e:
+                    logger.error("写入失败: %s (%s)", e, op.statements[0][0].strip().splitlines()[0])
+                    if grouped:
+                        conn.execute("ROLLBACK TO write_op")
+                        conn.execute("RELEASE write_op")
+                    results.append(e)
+            conn.commit()
+        except Exception as e:
+            logger.exception("批量提交失败")
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            return [e] * len(batch)
+        return results
+
+    @staticmethod
+    def _execute(conn: sqlite3.Connection, op: WriteOp) -> Any:
+        result = None
+        for i, (sql, params) in enumerate(op.statements):
+            cursor = conn.execute(sql, params)
+            if i == 0:
+                result = cursor.fetchall() if op.fetch else cursor.lastrowid
+        return result
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import signal
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from bot.config import config
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+class WebhookServer:
+    """内置的 webhook HTTP 服务：接收 Telegram 推送的更新并放入 update_queue
+
+    只实现 webhook 需要的最小 HTTP/1.1 子集（POST + Content-Length + keep-alive），
+    校验 X-Telegram-Bot-Api-Secret-Token，同时处理的连接数不超过 max_connections。
+    多个机器人共用一个端口时，每个机器人用 add_route 注册自己的路径。
+    raw=True 的路径放入队列的是未解析的 JSON（dict），由分片工作进程解析。
+    """
+
+    def __init__(self, update_queue: Optional[asyncio.Queue], bot=None, listen: str = "0.0.0.0",
+                 port: int = 8443, path: str = "/webhook", secret_token: str = "",
+                 max_connections: int = 40):
+        self.listen = listen
+        self.port = port
+        self.path = path
+        # 路径 → (update_queue, bot, secret_token, raw)
+        self.routes: dict[str, tuple[asyncio.Queue, object, str, bool]] = {}
+        if update_queue is not None:
+            self.add_route(path, update_queue, bot, secret_token)
+        self._connections = asyncio.Semaphore(max_connections)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        self.received = 0
+        self.rejected = 0
+
+    def add_route(self, path: str, update_queue: asyncio.Queue, bot=None, secret_token: str = "",
+                  raw: bool = False):
+        self.routes[path] = (update_queue, bot, secret_token, raw)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        # port=0 时使用系统分配的端口
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Webhook 服务监听 %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async with self._connections:
+            try:
+                while await self._handle_request(reader, writer):
+                    pass
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                pass
+            finally:
+                writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> bool:
+        """处理一个请求，返回连接是否保持"""
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY_SIZE:
+            await self._respond(writer, 413, keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = headers.get("connection", "").lower() != "close"
+
+        route = self.routes.get(path.split("?", 1)[0])
+        if route is None:
+            status = 404
+        elif method != "POST":
+            status = 405
+        elif route[2] and headers.get("x-telegram-bot-api-secret-token") != route[2]:
+            status = 403
+        else:
+            status = await self._accept(body, *route[:2], raw=route[3])
+
+        if status != 200:
+            self.rejected += 1
+        await self._respond(writer, status, keep_alive)
+        return keep_alive
+
+    async def _accept(self, body: bytes, update_queue: asyncio.Queue, bot, raw: bool = False) -> int:
+        try:
+            data = json.loads(body)
+            if raw:
+                update = data if isinstance(data, dict) and "update_id" in data else None
+            else:
+                update = Update.de_json(data, bot)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        if update is None:
+            return 400
+        self.received += 1
+        await update_queue.put(update)
+        return 200
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool = True):
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+
+async def run_webhook(application: Application, allowed_updates: list[str]):
+    """以 webhook 模式运行，生命周期与 Application.run_polling 一致"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = WebhookServer(
+        application.update_queue,
+        application.bot,
+        listen=config.WEBHOOK_LISTEN,
+        port=config.WEBHOOK_PORT,
+        path=config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET_TOKEN,
+        max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+    )
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.bot.set_webhook(
+            url=config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET_TOKEN or None,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=allowed_updates,
+        )
+        await application.start()
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)